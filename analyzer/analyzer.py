@@ -1,11 +1,13 @@
 from statistics import mean
 from threading import Lock
-from time import sleep
 
-from clock import get_clock
+from analyzer.block_count_history import load_block_moments, count_blocks_in_windows, \
+    backfill_average_window_block_counts
+from analyzer.monte_carlo import RentalRewardSimulator
 from clock.clock import calculate_tick_duration_from_sleep_duration
 from clock.tick_performer import TickPerformer
 from configuration import EXECUTION_CONFIGS
+from data_bank import get_database_handler
 from utility.datetime_helpers import size_in_seconds
 from utility.log import logger
 
@@ -65,6 +67,7 @@ class AverageWindowMetric:
         else:
             for i in range(0, len(window_boundaries)):
                 new_window_info.append((window_boundaries[i], window_values[i],))
+        self.window_values_mutex.acquire()
         try:
             self.window_values = new_window_info
         finally:
@@ -84,11 +87,11 @@ class AverageWindowMetric:
             self.window_values_mutex.release()
 
     def get_average_on_all_values(self):
-        return mean([v[1] for v in self.get_values()])
+        return mean([v[1] for v in self.get_window_values()])
 
     def calculate_new_window_values_and_boundaries(self):
         """
-        When called, the object should return a tuple of two lists like (new_values, new_boundaries)
+        When called, the object should return a tuple of two lists like (new_boundaries, new_values)
         :return:
         """
         pass
@@ -97,19 +100,24 @@ class AverageWindowMetric:
 class AverageWindowBlockCount(AverageWindowMetric):
     def calculate_new_window_values_and_boundaries(self):
         """
-        When called, the object should return a tuple of two lists like (new_values, new_boundaries)
-        :return:
+        Counts the blocks in each short window with one query and one histogram
+        :return: a tuple of two lists like (new_boundaries, new_values), from latest to oldest
         """
         boundaries = self.get_short_window_boundaries()
-        # TODO: calculate new values
-        return [], boundaries
+        if len(boundaries) == 0:
+            return boundaries, []
+        block_moments = load_block_moments(get_database_handler(),
+                                           begin_timestamp=boundaries[-1] - self.short_window_length,
+                                           end_timestamp=boundaries[0])
+        counts = count_blocks_in_windows(block_moments, boundaries[::-1], self.short_window_length)
+        return boundaries, counts[::-1].tolist()
 
 
 class RecentHistoryStatistics:
     def __init__(self):
         #
         # Each member is a tuple window average window metric container
-        average_window_metric_containers = [
+        self.average_window_metric_containers = [
             AverageWindowBlockCount(short_window_length_seconds=size_in_seconds(days=1),
                                     large_window_length_seconds=size_in_seconds(days=10)),
             AverageWindowBlockCount(short_window_length_seconds=size_in_seconds(days=1),
@@ -118,6 +126,19 @@ class RecentHistoryStatistics:
                                     large_window_length_seconds=size_in_seconds(days=250))
         ]
 
+    def backfill_block_count_averages(self, begin_timestamp, end_timestamp):
+        """
+        Calculates the averages of all block count metrics for every short window that ends between
+        the given timestamps, in one pass over the block history
+        :param begin_timestamp:
+        :param end_timestamp:
+        :return: a tuple (window_ends, averages) where averages maps each large window length to an array
+        """
+        short_window_length = self.average_window_metric_containers[0].short_window_length
+        return backfill_average_window_block_counts(
+            get_database_handler(), begin_timestamp, end_timestamp, short_window_length=short_window_length,
+            large_window_lengths=[c.large_window_length for c in self.average_window_metric_containers])
+
 
 class Analyzer(TickPerformer):
     def __init__(self):
@@ -125,15 +146,36 @@ class Analyzer(TickPerformer):
         A singleton class that is the analyzer
         """
         super().__init__()
-        self.tick_duration = calculate_tick_duration_from_sleep_duration(EXECUTION_CONFIGS.analyzer_sleep_duration)
-
-    def run(self, should_stop):
-        while True:
-            if should_stop():
-                break
-            sleep(self.tick_duration)
-            current_timestamp = get_clock().read_timestamp_of_now()
-            logger('analyzer').debug("Updating analytics at timestamp {0}.".format(current_timestamp))
+        self.sleep_duration = EXECUTION_CONFIGS.analyzer_sleep_duration
+        self.tick_duration = calculate_tick_duration_from_sleep_duration(self.sleep_duration)
+        self.rental_reward_simulator = RentalRewardSimulator(
+            EXECUTION_CONFIGS.analyzer_monte_carlo_paths, EXECUTION_CONFIGS.analyzer_monte_carlo_seed,
+            max_cached_distributions=EXECUTION_CONFIGS.analyzer_monte_carlo_max_cached_results)
+
+    def estimate_rental_rewards(self, current_timestamp, rented_hash_rate, duration, price=None):
+        """
+        Simulates the rewards of renting hashrate for the pool from the timestamp on, at the latest hash rate
+        of the pool and difficulty of the network
+        :param current_timestamp:
+        :param rented_hash_rate: hashes per second
+        :param duration: seconds the hashrate is rented for
+        :param price: coins per hash per second per day of the rented hashrate, or None if the cost is not needed
+        :return: a RentalRewardDistribution, or None if the hash rate of the pool or the difficulty is not known
+        """
+        network_state = get_database_handler().get_latest_pool_hash_rate_and_difficulty(
+            prior_to_moment=current_timestamp)
+        if network_state is None:
+            logger('analyzer').warning("The pool hash rate or the network difficulty at {0} is not known.",
+                                       current_timestamp)
+            return None
+        pool_hash_rate, difficulty = network_state
+        return self.rental_reward_simulator.simulate(pool_hash_rate, difficulty, rented_hash_rate, duration,
+                                                     EXECUTION_CONFIGS.analyzer_block_reward,
+                                                     pool_fee=EXECUTION_CONFIGS.analyzer_pool_fee, price=price)
+
+    def perform_tick(self, current_timestamp):
+        logger('analyzer').debug("Updating analytics at timestamp {0}.", current_timestamp)
+        return False
 
     def post_run(self):
         logger('analyzer').info("Analyzer is terminating.")
@@ -0,0 +1,77 @@
+import numpy as np
+
+from configuration.constants import SLUSHPOOL_ID
+
+
+def load_block_moments(db_handler, begin_timestamp, end_timestamp, pool_id=SLUSHPOOL_ID):
+    """
+    Loads the moments of the blocks of the pool between the given timestamps in one query (or from the cache)
+    :param db_handler: a MineDatabaseHandler
+    :param begin_timestamp:
+    :param end_timestamp:
+    :param pool_id:
+    :return: a sorted array of epoch seconds
+    """
+    return db_handler.get_block_moments_between(begin_timestamp, end_timestamp, pool_id=pool_id)
+
+
+def count_blocks_in_windows(block_moments, window_ends, window_length):
+    """
+    Counts the blocks in back to back windows
+    :param block_moments: a sorted array of epoch seconds
+    :param window_ends: an ascending array of window ending boundaries, window_length apart
+    :param window_length: seconds
+    :return: an array with the number of blocks in [end - window_length, end) of each window
+    """
+    window_ends = np.asarray(window_ends, dtype=np.float64)
+    if len(window_ends) == 0:
+        return np.zeros(0, dtype=np.int64)
+    edges = np.concatenate(([window_ends[0] - window_length], window_ends))
+    return np.diff(np.searchsorted(block_moments, edges, side='left'))
+
+
+def calculate_trailing_averages(counts, window_sizes):
+    """
+    Averages the counts over trailing windows of the given sizes, all from one cumulative sum
+    :param counts: an array of counts of back to back short windows, oldest first
+    :param window_sizes: the number of short windows in each large window
+    :return: a dictionary from window size to an array of averages. The average at index i covers the counts
+             i - size + 1 to i, and is NaN where there is not enough history.
+    """
+    cumulative_counts = np.concatenate(([0], np.cumsum(counts)))
+    averages = {}
+    for size in window_sizes:
+        window_averages = np.full(len(counts), np.nan)
+        if size <= len(counts):
+            window_averages[size - 1:] = (cumulative_counts[size:] - cumulative_counts[:-size]) / float(size)
+        averages[size] = window_averages
+    return averages
+
+
+def backfill_average_window_block_counts(db_handler, begin_timestamp, end_timestamp, short_window_length,
+                                         large_window_lengths, pool_id=SLUSHPOOL_ID):
+    """
+    Calculates the average number of blocks per short window over each of the large windows, for every
+    short window that ends between the given timestamps. The blocks are loaded once, counted per short window
+    with one histogram, and every large window average comes from the same cumulative sum.
+    :param db_handler: a MineDatabaseHandler
+    :param begin_timestamp:
+    :param end_timestamp: the ending boundary of the latest short window
+    :param short_window_length: seconds (e.g. a day)
+    :param large_window_lengths: a list of seconds (e.g. 10, 50 and 250 days)
+    :param pool_id:
+    :return: a tuple (window_ends, averages) where window_ends is an ascending array of the ending boundaries
+             of the short windows, and averages maps each large window length to an array of averages
+    """
+    number_of_windows = int((end_timestamp - begin_timestamp) // short_window_length)
+    window_sizes = {length: int(length // short_window_length) for length in large_window_lengths}
+    number_of_history_windows = max(list(window_sizes.values()) + [1]) - 1
+    total_number_of_windows = number_of_windows + number_of_history_windows
+    all_window_ends = end_timestamp - short_window_length * np.arange(total_number_of_windows - 1, -1, -1,
+                                                                      dtype=np.float64)
+    history_begin_timestamp = end_timestamp - short_window_length * total_number_of_windows
+    block_moments = load_block_moments(db_handler, history_begin_timestamp, end_timestamp, pool_id=pool_id)
+    counts = count_blocks_in_windows(block_moments, all_window_ends, short_window_length)
+    averages_by_size = calculate_trailing_averages(counts, set(window_sizes.values()))
+    averages = {length: averages_by_size[size][number_of_history_windows:] for length, size in window_sizes.items()}
+    return all_window_ends[number_of_history_windows:], averages
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+from configuration.constants import DAY_SECONDS
+
+# The reward quantiles that are calculated unless others are asked for
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95,)
+# Hashes it takes on average to find a block at difficulty 1
+HASHES_PER_DIFFICULTY = 2 ** 32
+
+
+class MonteCarloException(Exception):
+    pass
+
+
+class RentalRewardDistribution:
+    """
+    The simulated rewards of renting hashrate for the pool over a duration
+    """
+
+    def __init__(self, quantiles, reward_quantiles, mean_reward, expected_number_of_blocks,
+                 probability_of_no_block, cost=None):
+        """
+        :param quantiles: a tuple of the quantiles, e.g. (0.05, 0.5, 0.95)
+        :param reward_quantiles: an array of the reward at each quantile, in coins
+        :param mean_reward: in coins
+        :param expected_number_of_blocks: the blocks the pool finds on average while the hashrate is rented
+        :param probability_of_no_block: the fraction of the paths on which the pool found no block
+        :param cost: what the rented hashrate costs in coins, or None if no price was given
+        """
+        self.quantiles = quantiles
+        self.reward_quantiles = reward_quantiles
+        self.mean_reward = mean_reward
+        self.expected_number_of_blocks = expected_number_of_blocks
+        self.probability_of_no_block = probability_of_no_block
+        self.cost = cost
+
+    def get_reward_at(self, quantile):
+        return float(self.reward_quantiles[self.quantiles.index(quantile)])
+
+    def get_profit_quantiles(self):
+        """
+        :return: an array of the reward minus the cost at each quantile, or None if the cost is not known
+        """
+        if self.cost is None:
+            return None
+        return self.reward_quantiles - self.cost
+
+    def __str__(self):
+        return "mean reward {0:.8f}, {1}, {2:.2f} blocks expected, no block with probability {3:.3f}{4}".format(
+            self.mean_reward, ", ".join("q{0:g} {1:.8f}".format(q, r) for q, r in zip(self.quantiles,
+                                                                                     self.reward_quantiles)),
+            self.expected_number_of_blocks, self.probability_of_no_block,
+            "" if self.cost is None else ", cost {0:.8f}".format(self.cost))
+
+
+def simulate_rental_rewards(pool_hash_rate, difficulty, rented_hash_rate, duration, block_reward, pool_fee=0.0,
+                            price=None, number_of_paths=10000, seed=0, quantiles=DEFAULT_QUANTILES):
+    """
+    Simulates the blocks the pool finds while the hashrate is rented on many paths at once. Blocks arrive as a
+    Poisson process whose rate is the hashrate of the pool together with the rented hashrate over the hashes a
+    block takes at the difficulty, so the number of blocks of each path is drawn from a Poisson distribution.
+    The renter is paid the share of the rented hashrate in the pool of the reward of every block, after the fee.
+    :param pool_hash_rate: hashes per second of the pool without the rented hashrate
+    :param difficulty: of the network, which is taken not to change while the hashrate is rented
+    :param rented_hash_rate: hashes per second
+    :param duration: seconds the hashrate is rented for
+    :param block_reward: coins per block
+    :param pool_fee: the fraction of the rewards that the pool keeps
+    :param price: coins per hash per second per day of the rented hashrate, to calculate the cost; None if unknown
+    :param number_of_paths:
+    :param seed: the seed of the random number generator, so that the same inputs give the same distribution
+    :param quantiles: a tuple of quantiles of the rewards to calculate
+    :return: a RentalRewardDistribution
+    """
+    if pool_hash_rate < 0 or rented_hash_rate < 0 or duration < 0 or difficulty <= 0 or number_of_paths < 1:
+        raise MonteCarloException("Cannot simulate a pool hash rate of {0}, a rented hash rate of {1}, a duration "
+                                  "of {2}, a difficulty of {3} and {4} paths.".format(
+                                      pool_hash_rate, rented_hash_rate, duration, difficulty, number_of_paths))
+    total_hash_rate = pool_hash_rate + rented_hash_rate
+    expected_number_of_blocks = total_hash_rate * duration / (difficulty * HASHES_PER_DIFFICULTY)
+    rng = np.random.default_rng(seed)
+    numbers_of_blocks = rng.poisson(expected_number_of_blocks, number_of_paths)
+    share = rented_hash_rate / total_hash_rate if total_hash_rate > 0 else 0.0
+    rewards = numbers_of_blocks * (block_reward * (1.0 - pool_fee) * share)
+    return RentalRewardDistribution(
+        quantiles=tuple(quantiles),
+        reward_quantiles=np.quantile(rewards, quantiles),
+        mean_reward=float(rewards.mean()),
+        expected_number_of_blocks=expected_number_of_blocks,
+        probability_of_no_block=float(np.count_nonzero(numbers_of_blocks == 0)) / number_of_paths,
+        cost=None if price is None else price * rented_hash_rate * duration / DAY_SECONDS)
+
+
+class RentalRewardSimulator:
+    """
+    Simulates rental rewards with a fixed number of paths and seed, and keeps the distributions of the latest
+    distinct inputs, so that asking again while the inputs do not change costs a dictionary lookup
+    """
+
+    def __init__(self, number_of_paths, seed, max_cached_distributions=128):
+        self.number_of_paths = number_of_paths
+        self.seed = seed
+        self.max_cached_distributions = max_cached_distributions
+        # A map from the inputs of a simulation to its distribution, the most recently used one last
+        self.distributions = OrderedDict()
+        self.distributions_mutex = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def simulate(self, pool_hash_rate, difficulty, rented_hash_rate, duration, block_reward, pool_fee=0.0,
+                 price=None, quantiles=DEFAULT_QUANTILES):
+        """
+        :return: the RentalRewardDistribution of simulate_rental_rewards, which must not be modified
+        """
+        key = (pool_hash_rate, difficulty, rented_hash_rate, duration, block_reward, pool_fee, price,
+               tuple(quantiles),)
+        self.distributions_mutex.acquire()
+        try:
+            distribution = self.distributions.get(key)
+            if distribution is not None:
+                self.distributions.move_to_end(key)
+                self.hits += 1
+                return distribution
+            self.misses += 1
+        finally:
+            self.distributions_mutex.release()
+
+        distribution = simulate_rental_rewards(pool_hash_rate, difficulty, rented_hash_rate, duration, block_reward,
+                                               pool_fee=pool_fee, price=price, number_of_paths=self.number_of_paths,
+                                               seed=self.seed, quantiles=quantiles)
+        self.distributions_mutex.acquire()
+        try:
+            self.distributions[key] = distribution
+            while len(self.distributions) > self.max_cached_distributions:
+                self.distributions.popitem(last=False)
+        finally:
+            self.distributions_mutex.release()
+        return distribution
+
+    def get_statistics(self):
+        self.distributions_mutex.acquire()
+        try:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached_distributions': len(self.distributions),
+            }
+        finally:
+            self.distributions_mutex.release()
@@ -0,0 +1,510 @@
+"""
+Benchmarks the hot paths of the data bank, the nicehash driver and the analyzer on synthetic data, writes the
+results as JSON and compares them with a stored baseline.
+
+The database benchmarks run in a disposable database that is created for the run and dropped afterwards, on the
+PostgreSQL server of the config file. SMART_MINER_BENCHMARK_DB_HOST, SMART_MINER_BENCHMARK_DB_PORT,
+SMART_MINER_BENCHMARK_DB_USER and SMART_MINER_BENCHMARK_DB_PASSWORD point it at another server; the user needs
+to be allowed to create databases.
+
+Usage, from the root of the project:
+
+    python -m benchmarks.run_benchmarks [--config files/config.yaml] [--output benchmark-results.json]
+                                        [--baseline benchmarks/baseline.json] [--save-baseline]
+
+A run exits with 1 if any benchmark is slower than its baseline by more than the tolerance. There is no baseline
+in the repository, since the numbers only mean something on the machine they were taken on; --save-baseline
+stores the results of a run as the baseline to compare later runs with.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import psycopg2
+
+import configuration
+from benchmarks.synthetic_data import generate_block_moments, write_blocks_csv_file, generate_orders, \
+    generate_market_history, write_market_history_csv_file
+from configuration.constants import SLUSHPOOL_ID, DAY_SECONDS
+from utility.datetime_helpers import size_in_seconds
+
+DB_HOST_ENVIRONMENT_VARIABLE = "SMART_MINER_BENCHMARK_DB_HOST"
+DB_PORT_ENVIRONMENT_VARIABLE = "SMART_MINER_BENCHMARK_DB_PORT"
+DB_USER_ENVIRONMENT_VARIABLE = "SMART_MINER_BENCHMARK_DB_USER"
+DB_PASSWORD_ENVIRONMENT_VARIABLE = "SMART_MINER_BENCHMARK_DB_PASSWORD"
+# The database the disposable database is created from
+MAINTENANCE_DATABASE_NAME = "postgres"
+SCHEMA_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "vagrant", "ansible", "init_postgresql.sql")
+DEFAULT_BASELINE_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# The moment the synthetic data begins
+BEGIN_TIMESTAMP = 1609459200
+# Seconds between two records of the synthetic market history
+MARKET_HISTORY_INTERVAL = 60
+
+
+class BenchmarkContext:
+    """
+    The synthetic data and the handlers the benchmarks work on
+    """
+
+    def __init__(self, arguments, workspace_directory_path, mine_db_handler):
+        self.arguments = arguments
+        self.workspace_directory_path = workspace_directory_path
+        self.mine_db_handler = mine_db_handler
+        self.block_moments = generate_block_moments(arguments.blocks, BEGIN_TIMESTAMP, arguments.seed)
+        self.end_timestamp = int(self.block_moments[-1])
+        self.blocks_csv_file_path = os.path.join(workspace_directory_path, "blocks.benchmark.mine.csv")
+        write_blocks_csv_file(self.blocks_csv_file_path, self.block_moments)
+        self.orders = generate_orders(arguments.orders, arguments.changes, BEGIN_TIMESTAMP, self.end_timestamp,
+                                      arguments.seed)
+        self.market_history_csv_file_path = os.path.join(workspace_directory_path, "market_history.csv")
+        write_market_history_csv_file(self.market_history_csv_file_path, *generate_market_history(
+            BEGIN_TIMESTAMP, self.end_timestamp, MARKET_HISTORY_INTERVAL, arguments.seed))
+        self.rng = np.random.default_rng(arguments.seed)
+
+
+def measure(run, repeat, setup=None):
+    """
+    :param run: a function that takes the state returned by setup and returns the number of items it processed
+    :param repeat: the number of timed calls of run
+    :param setup: a function whose time is not measured, called before every call of run
+    :return: a dictionary of the statistics of the calls
+    """
+    timings = []
+    number_of_items = 0
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        begin = time.perf_counter()
+        number_of_items = run(state)
+        timings.append(time.perf_counter() - begin)
+    median_seconds = statistics.median(timings)
+    return {
+        'repeat': repeat,
+        'items': number_of_items,
+        'min_seconds': min(timings),
+        'median_seconds': median_seconds,
+        'mean_seconds': statistics.mean(timings),
+        'items_per_second': number_of_items / median_seconds if median_seconds > 0 else None,
+    }
+
+
+def benchmark_load_csv_file(context):
+    handler = context.mine_db_handler
+
+    def setup():
+        handler.execute_write("TRUNCATE TABLE {0};".format(handler.BLOCKS_TABLE_NAME))
+
+    def run(_):
+        report = handler.load_csv_file(handler.BLOCKS_TABLE_NAME, context.blocks_csv_file_path)
+        return report.rows_inserted
+
+    result = measure(run, context.arguments.repeat, setup=setup)
+    # the other benchmarks need the blocks
+    setup()
+    run(None)
+    return result
+
+
+def benchmark_execute_write(context):
+    handler = context.mine_db_handler
+    number_of_writes = context.arguments.queries
+
+    def run(_):
+        for i in range(number_of_writes):
+            handler.execute_write("""INSERT INTO key_values (owner, key, value) VALUES ('benchmark', 'key_{0}', '{1}')
+            ON CONFLICT ON CONSTRAINT owner_key_unique DO UPDATE SET value = EXCLUDED.value;""".format(i, i * 2))
+        return number_of_writes
+
+    return measure(run, context.arguments.repeat)
+
+
+def benchmark_execute_select(context):
+    handler = context.mine_db_handler
+    number_of_selects = context.arguments.queries
+
+    def run(_):
+        for i in range(number_of_selects):
+            handler.execute_select("""SELECT value FROM key_values
+            WHERE owner = 'benchmark' AND key = 'key_{0}';""".format(i))
+        return number_of_selects
+
+    return measure(run, context.arguments.repeat)
+
+
+def get_block_ranges(context):
+    begin_timestamps = context.rng.integers(BEGIN_TIMESTAMP, context.end_timestamp, context.arguments.queries)
+    return [(int(b), int(b) + DAY_SECONDS,) for b in begin_timestamps]
+
+
+def benchmark_get_blocks_between(context, block_cache_enabled):
+    handler = context.mine_db_handler
+    block_ranges = get_block_ranges(context)
+
+    def setup():
+        configuration.EXECUTION_CONFIGS.db_block_cache_enabled = block_cache_enabled
+        handler.invalidate_block_caches()
+        if block_cache_enabled:
+            # the cache is loaded once, and that is not what is measured
+            handler.get_blocks_between(BEGIN_TIMESTAMP, BEGIN_TIMESTAMP, pool_id=SLUSHPOOL_ID)
+
+    def run(_):
+        for begin_timestamp, end_timestamp in block_ranges:
+            handler.get_blocks_between(begin_timestamp, end_timestamp, pool_id=SLUSHPOOL_ID)
+        return len(block_ranges)
+
+    try:
+        return measure(run, context.arguments.repeat, setup=setup)
+    finally:
+        configuration.EXECUTION_CONFIGS.db_block_cache_enabled = True
+
+
+def create_orders(context):
+    from nicehash.simulation_driver import NiceHashOrder
+
+    orders = []
+    for i, order in enumerate(context.orders):
+        nice_hash_order = NiceHashOrder(order.creation_timestamp, "benchmark_{0}".format(i), order.initial_limit,
+                                        order.initial_price)
+        for timestamp, limit_change, price_change in order.changes:
+            nice_hash_order.change(timestamp, limit_change=limit_change, price_change=price_change)
+        orders.append(nice_hash_order)
+    return orders
+
+
+def get_query_timestamps(context):
+    # ascending, as the ticks of a simulation ask for them
+    return [int(t) for t in np.linspace(BEGIN_TIMESTAMP, context.end_timestamp, context.arguments.queries)]
+
+
+def benchmark_calculate_limit_at(context):
+    query_timestamps = get_query_timestamps(context)
+
+    def run(orders):
+        for timestamp in query_timestamps:
+            for order in orders:
+                order.calculate_limit_at(timestamp)
+        return len(query_timestamps) * len(orders)
+
+    return measure(run, context.arguments.repeat, setup=lambda: create_orders(context))
+
+
+def benchmark_calculate_price_at(context):
+    query_timestamps = get_query_timestamps(context)
+
+    def run(orders):
+        for timestamp in query_timestamps:
+            for order in orders:
+                order.calculate_price_at(timestamp)
+        return len(query_timestamps) * len(orders)
+
+    return measure(run, context.arguments.repeat, setup=lambda: create_orders(context))
+
+
+def create_simulation_driver(context):
+    from nicehash.simulation_driver import NiceHashSimulationDriver
+
+    driver = NiceHashSimulationDriver()
+    order_ids = [driver.create_order(order.creation_timestamp, order.initial_limit, order.initial_price)
+                 for order in context.orders]
+    return driver, order_ids
+
+
+def benchmark_change_order(context):
+    changes = sorted((timestamp, i, limit_change, price_change,)
+                     for i, order in enumerate(context.orders)
+                     for timestamp, limit_change, price_change in order.changes)
+
+    def run(state):
+        driver, order_ids = state
+        for timestamp, i, limit_change, price_change in changes:
+            driver.change_order(timestamp, order_ids[i], limit_change=limit_change, price_change=price_change)
+        return len(changes)
+
+    return measure(run, context.arguments.repeat, setup=lambda: create_simulation_driver(context))
+
+
+def benchmark_get_orders(context):
+    number_of_calls = context.arguments.queries * 10
+
+    def run(state):
+        driver, order_ids = state
+        for i in range(number_of_calls):
+            for order in driver.get_orders():
+                driver.get_orders(order_id=order.order_id)
+        return number_of_calls
+
+    return measure(run, context.arguments.repeat, setup=lambda: create_simulation_driver(context))
+
+
+def benchmark_load_market_replay(context):
+    from nicehash.market_replay import load_market_replay
+
+    def run(_):
+        return len(load_market_replay(context.market_history_csv_file_path))
+
+    return measure(run, context.arguments.repeat)
+
+
+def benchmark_deliver_hashrate(context):
+    from nicehash.market_replay import load_market_replay
+
+    query_timestamps = get_query_timestamps(context)
+    market_replay = load_market_replay(context.market_history_csv_file_path)
+
+    def setup():
+        driver, order_ids = create_simulation_driver(context)
+        driver.market_replay = market_replay
+        return driver
+
+    def run(driver):
+        for timestamp in query_timestamps:
+            driver.deliver_hashrate(timestamp)
+        return len(query_timestamps)
+
+    return measure(run, context.arguments.repeat, setup=setup)
+
+
+def benchmark_get_short_window_boundaries(context):
+    from analyzer.analyzer import AverageWindowMetric
+
+    metric = AverageWindowMetric(size_in_seconds(days=0, hours=1), size_in_seconds(days=30))
+    metric.set_latest_timestamp(context.end_timestamp)
+    number_of_calls = context.arguments.queries
+
+    def run(_):
+        for _ in range(number_of_calls):
+            metric.get_short_window_boundaries()
+        return number_of_calls
+
+    return measure(run, context.arguments.repeat)
+
+
+def benchmark_simulate_rental_rewards(context, cached):
+    from analyzer.monte_carlo import RentalRewardSimulator
+
+    # a pool of about a tenth of the network, renting up to a hundredth of it for an hour
+    difficulty = 2.0e13
+    pool_hash_rate = difficulty * 2 ** 32 / 600 / 10
+    rented_hash_rates = pool_hash_rate / 10 * context.rng.random(100)
+    number_of_calls = context.arguments.queries if cached else len(rented_hash_rates)
+
+    def simulate(simulator, calls):
+        for i in range(calls):
+            simulator.simulate(pool_hash_rate, difficulty, rented_hash_rates[i % len(rented_hash_rates)],
+                               size_in_seconds(days=0, hours=1), 6.25, pool_fee=0.02, price=0.0001)
+        return calls
+
+    def setup():
+        simulator = RentalRewardSimulator(10000, context.arguments.seed,
+                                          max_cached_distributions=len(rented_hash_rates))
+        if cached:
+            simulate(simulator, len(rented_hash_rates))
+        return simulator
+
+    return measure(lambda simulator: simulate(simulator, number_of_calls), context.arguments.repeat, setup=setup)
+
+
+# In the order they run; the database benchmarks after load_csv_file use the blocks it loads
+BENCHMARKS = [
+    ('database/load_csv_file', benchmark_load_csv_file),
+    ('database/execute_write', benchmark_execute_write),
+    ('database/execute_select', benchmark_execute_select),
+    ('mine_database/get_blocks_between', lambda c: benchmark_get_blocks_between(c, block_cache_enabled=True)),
+    ('mine_database/get_blocks_between_uncached',
+     lambda c: benchmark_get_blocks_between(c, block_cache_enabled=False)),
+    ('nicehash/calculate_limit_at', benchmark_calculate_limit_at),
+    ('nicehash/calculate_price_at', benchmark_calculate_price_at),
+    ('nicehash/change_order', benchmark_change_order),
+    ('nicehash/get_orders', benchmark_get_orders),
+    ('nicehash/load_market_replay', benchmark_load_market_replay),
+    ('nicehash/deliver_hashrate', benchmark_deliver_hashrate),
+    ('analyzer/get_short_window_boundaries', benchmark_get_short_window_boundaries),
+    ('analyzer/simulate_rental_rewards', lambda c: benchmark_simulate_rental_rewards(c, cached=True)),
+    ('analyzer/simulate_rental_rewards_uncached', lambda c: benchmark_simulate_rental_rewards(c, cached=False)),
+]
+
+
+def get_connection_parameters():
+    """
+    :return: a dictionary of the parameters of the connections to the server, from the environment or the configs
+    """
+    return {
+        'host': os.environ.get(DB_HOST_ENVIRONMENT_VARIABLE, configuration.EXECUTION_CONFIGS.db_host),
+        'port': os.environ.get(DB_PORT_ENVIRONMENT_VARIABLE, configuration.EXECUTION_CONFIGS.db_port),
+        'user': os.environ.get(DB_USER_ENVIRONMENT_VARIABLE, configuration.EXECUTION_CONFIGS.db_user),
+        'password': os.environ.get(DB_PASSWORD_ENVIRONMENT_VARIABLE, configuration.EXECUTION_CONFIGS.db_password),
+    }
+
+
+def run_maintenance_query(connection_parameters, sql_query):
+    connection = psycopg2.connect(database=MAINTENANCE_DATABASE_NAME, **connection_parameters)
+    try:
+        # CREATE and DROP DATABASE can not run in a transaction
+        connection.autocommit = True
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql_query)
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+
+
+def read_schema(database_name):
+    """
+    :param database_name: smart_miner or smart_miner_simulation_data
+    :return: the list of statements that create the tables of the database in the init script of the server
+    """
+    statements = []
+    current_database_name = None
+    with open(SCHEMA_FILE_PATH) as schema_file:
+        for line in schema_file:
+            line = line.strip()
+            if line.startswith("\\c "):
+                current_database_name = line[3:].strip()
+            elif current_database_name == database_name and line != "":
+                statements.append(line)
+    return statements
+
+
+@contextmanager
+def disposable_mine_database(connection_parameters):
+    """
+    Creates a database with the tables of smart_miner for the run, and drops it afterwards
+    :return: a MineDatabaseHandler of the database
+    """
+    from data_bank.mine_database import MineDatabaseHandler
+
+    database_name = "smart_miner_benchmark_{0}".format(os.getpid())
+    run_maintenance_query(connection_parameters, "CREATE DATABASE {0};".format(database_name))
+    handler = None
+    try:
+        handler = MineDatabaseHandler(connection_parameters['user'], connection_parameters['password'],
+                                      database_name, connection_parameters['host'], connection_parameters['port'])
+        for statement in read_schema("smart_miner"):
+            handler.execute_write(statement)
+        yield handler
+    finally:
+        if handler is not None:
+            handler.close()
+        run_maintenance_query(connection_parameters, "DROP DATABASE IF EXISTS {0};".format(database_name))
+
+
+def run_benchmarks(arguments):
+    """
+    :return: a dictionary with the parameters, the environment and the results of the run
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as workspace_directory_path:
+        with disposable_mine_database(get_connection_parameters()) as mine_db_handler:
+            context = BenchmarkContext(arguments, workspace_directory_path, mine_db_handler)
+            for name, benchmark in BENCHMARKS:
+                if arguments.only is not None and arguments.only not in name:
+                    continue
+                results[name] = benchmark(context)
+                print("{0:<45} {1:>12.6f} s median {2:>14.1f} items/s".format(
+                    name, results[name]['median_seconds'], results[name]['items_per_second'] or 0.0))
+    return {
+        'parameters': {
+            'blocks': arguments.blocks,
+            'orders': arguments.orders,
+            'changes': arguments.changes,
+            'queries': arguments.queries,
+            'repeat': arguments.repeat,
+            'seed': arguments.seed,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'numpy': np.__version__,
+            'psycopg2': psycopg2.__version__,
+        },
+        'created_at': int(time.time()),
+        'results': results,
+    }
+
+
+def compare_with_baseline(run_results, baseline, tolerance):
+    """
+    :param run_results: the output of run_benchmarks
+    :param baseline: an earlier output of run_benchmarks
+    :param tolerance: the fraction by which the median time of a benchmark may grow before it is a regression
+    :return: a list of (name, baseline median seconds, median seconds, ratio, status) tuples
+    """
+    comparisons = []
+    for name, result in sorted(run_results['results'].items()):
+        baseline_result = baseline['results'].get(name)
+        if baseline_result is None or baseline_result['median_seconds'] <= 0:
+            comparisons.append((name, None, result['median_seconds'], None, 'new',))
+            continue
+        ratio = result['median_seconds'] / baseline_result['median_seconds']
+        if ratio > 1 + tolerance:
+            status = 'regression'
+        elif ratio < 1 / (1 + tolerance):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        comparisons.append((name, baseline_result['median_seconds'], result['median_seconds'], ratio, status,))
+    return comparisons
+
+
+def write_json(data, file_path):
+    with open(file_path, 'w') as json_file:
+        json.dump(data, json_file, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths on synthetic data.")
+    parser.add_argument('--config', default=None, help="the config file with the database server")
+    parser.add_argument('--blocks', type=int, default=100000, help="the number of synthetic blocks")
+    parser.add_argument('--orders', type=int, default=100, help="the number of synthetic orders")
+    parser.add_argument('--changes', type=int, default=100, help="the number of changes of each order")
+    parser.add_argument('--queries', type=int, default=1000, help="the number of calls of the lookup benchmarks")
+    parser.add_argument('--repeat', type=int, default=5, help="the number of timed runs of each benchmark")
+    parser.add_argument('--seed', type=int, default=1368, help="the seed of the synthetic data")
+    parser.add_argument('--only', default=None, help="runs only the benchmarks whose name contains this")
+    parser.add_argument('--output', default="benchmark-results.json", help="the file the results are written into")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE_PATH, help="the results to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="stores the results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="the fraction by which a benchmark may be slower than its baseline")
+    arguments = parser.parse_args()
+
+    configuration.configure(arguments.config, runtime_mode=configuration.RuntimeMode.SIMULATION,
+                            overrides={'log_level': logging.WARNING, 'identifier': 'benchmark',
+                                       'db_csv_separator': ',', 'metrics_file_path': None,
+                                       'metrics_http_port': None, 'db_backend': 'postgresql'})
+    run_results = run_benchmarks(arguments)
+    write_json(run_results, arguments.output)
+    print("Results are in {0}.".format(arguments.output))
+
+    if arguments.save_baseline:
+        write_json(run_results, arguments.baseline)
+        print("Stored the results as the baseline in {0}.".format(arguments.baseline))
+        sys.exit(0)
+    if not os.path.exists(arguments.baseline):
+        print("There is no baseline in {0} to compare with; --save-baseline stores one.".format(arguments.baseline))
+        sys.exit(0)
+    with open(arguments.baseline) as baseline_file:
+        baseline_results = json.load(baseline_file)
+    if baseline_results['parameters'] != run_results['parameters']:
+        print("The baseline was taken with other parameters: {0}.".format(baseline_results['parameters']))
+    number_of_regressions = 0
+    for name, baseline_seconds, seconds, ratio, status in compare_with_baseline(run_results, baseline_results,
+                                                                                arguments.tolerance):
+        print("{0:<45} {1:>12} {2:>12.6f} {3:>7} {4}".format(
+            name, "-" if baseline_seconds is None else "{0:.6f}".format(baseline_seconds), seconds,
+            "-" if ratio is None else "{0:.2f}x".format(ratio), status))
+        if status == 'regression':
+            number_of_regressions += 1
+    sys.exit(0 if number_of_regressions == 0 else 1)
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+from configuration.constants import SLUSHPOOL_ID
+
+# Seconds between two blocks of the pool on average
+MEAN_BLOCK_INTERVAL = 10 * 60
+
+
+class SyntheticOrder:
+    """
+    An order and the changes that are applied to it after its creation
+    """
+
+    def __init__(self, creation_timestamp, initial_limit, initial_price, changes):
+        """
+        :param creation_timestamp:
+        :param initial_limit:
+        :param initial_price:
+        :param changes: a list of (timestamp, limit change, price change) tuples, sorted by timestamp
+        """
+        self.creation_timestamp = creation_timestamp
+        self.initial_limit = initial_limit
+        self.initial_price = initial_price
+        self.changes = changes
+
+
+def generate_block_moments(number_of_blocks, begin_timestamp, seed, mean_interval=MEAN_BLOCK_INTERVAL):
+    """
+    Blocks are found by a Poisson process, so the time between two of them is exponentially distributed
+    :return: a sorted array of distinct whole epoch seconds
+    """
+    rng = np.random.default_rng(seed)
+    intervals = np.maximum(1, np.rint(rng.exponential(mean_interval, number_of_blocks))).astype(np.int64)
+    return begin_timestamp + np.cumsum(intervals)
+
+
+def write_blocks_csv_file(file_full_path, block_moments, pool_id=SLUSHPOOL_ID, first_block_id=1):
+    """
+    Writes the blocks in the format of the CSV data files of the blocks table
+    :return: None
+    """
+    with open(file_full_path, 'w') as csv_file:
+        csv_file.write("moment,id,pool_id\n")
+        for i, moment in enumerate(block_moments):
+            csv_file.write("'{0}',{1},{2}\n".format(datetime.fromtimestamp(int(moment), tz=pytz.UTC),
+                                                    first_block_id + i, pool_id))
+
+
+def generate_orders(number_of_orders, number_of_changes, begin_timestamp, end_timestamp, seed):
+    """
+    :param number_of_orders:
+    :param number_of_changes: the number of changes of each order
+    :param begin_timestamp: the orders are created between the begin and end timestamps
+    :param end_timestamp: and changed between their creation and the end timestamp
+    :param seed:
+    :return: a list of SyntheticOrder
+    """
+    rng = np.random.default_rng(seed)
+    orders = []
+    for creation_timestamp in np.sort(rng.integers(begin_timestamp, end_timestamp, number_of_orders)):
+        change_timestamps = np.sort(rng.integers(creation_timestamp + 1, end_timestamp + 1, number_of_changes))
+        limit_changes = np.round(rng.normal(0.0, 0.5, number_of_changes), 3)
+        price_changes = np.round(rng.normal(0.0, 0.0001, number_of_changes), 6)
+        orders.append(SyntheticOrder(int(creation_timestamp), round(float(rng.uniform(0.5, 5.0)), 3),
+                                     round(float(rng.uniform(0.001, 0.003)), 6),
+                                     [(int(t), float(l), float(p),)
+                                      for t, l, p in zip(change_timestamps, limit_changes, price_changes)]))
+    return orders
+
+
+def generate_market_history(begin_timestamp, end_timestamp, interval, seed):
+    """
+    The price level and the available hashrate of the marketplace drift as random walks
+    :param interval: seconds between two records
+    :return: a tuple (moments, prices, available hashrates) of arrays
+    """
+    rng = np.random.default_rng(seed)
+    moments = np.arange(begin_timestamp, end_timestamp + 1, interval, dtype=np.int64)
+    prices = np.maximum(0.0001, 0.002 + np.cumsum(rng.normal(0.0, 0.00001, len(moments))))
+    available_hashrates = np.maximum(0.0, 50.0 + np.cumsum(rng.normal(0.0, 0.5, len(moments))))
+    return moments, np.round(prices, 6), np.round(available_hashrates, 3)
+
+
+def write_market_history_csv_file(file_full_path, moments, prices, available_hashrates):
+    """
+    Writes the records in the format of the market history files of the simulation driver
+    :return: None
+    """
+    with open(file_full_path, 'w') as csv_file:
+        csv_file.write("moment,price,available_hashrate\n")
+        for moment, price, available_hashrate in zip(moments, prices, available_hashrates):
+            csv_file.write("{0},{1},{2}\n".format(int(moment), price, available_hashrate))
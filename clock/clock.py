@@ -1,53 +1,111 @@
-from time import sleep
-from threading import Lock
+from threading import Condition
+from time import time
 
 from configuration import EXECUTION_CONFIGS
 from clock.tick_performer import TickPerformer
-from utility.datetime_helpers import datetime_string_to_timestamp
 from utility.log import logger
 
-clock_real_tick_time_interval = EXECUTION_CONFIGS.clock_timestamp_increase_per_tick
-clock_tick_duration = EXECUTION_CONFIGS.clock_tick_duration
-
 
 def calculate_tick_duration_from_sleep_duration(sleep_duration):
+    clock_real_tick_time_interval = EXECUTION_CONFIGS.clock_timestamp_increase_per_tick
     if clock_real_tick_time_interval is None:
         return sleep_duration
-    return (clock_tick_duration * sleep_duration) / clock_real_tick_time_interval
+    return (EXECUTION_CONFIGS.clock_tick_duration * sleep_duration) / clock_real_tick_time_interval
+
+
+class ClockSubscription:
+    """
+    Wakes a subscriber every time the simulation clock passes the next multiple of its interval
+    """
+
+    def __init__(self, clock, interval):
+        """
+        :param clock:
+        :param interval: seconds of clock time between two wake ups
+        """
+        self.clock = clock
+        self.interval = interval
+        self.next_due_timestamp = clock.read_timestamp_of_now() + interval
+        self.cancelled = False
+
+    def wait_for_next_tick(self):
+        """
+        Blocks until the clock reaches the next due timestamp. Due timestamps that the clock jumped over
+        are skipped.
+        :return: the timestamp of the clock, or None if the subscription was cancelled
+        """
+        self.clock.tick_condition.acquire()
+        try:
+            while not self.cancelled and self.clock.timestamp_of_now < self.next_due_timestamp:
+                self.clock.tick_condition.wait()
+            if self.cancelled:
+                return None
+            timestamp = int(self.clock.timestamp_of_now)
+        finally:
+            self.clock.tick_condition.release()
+        self.next_due_timestamp += (int((timestamp - self.next_due_timestamp) // self.interval) + 1) * self.interval
+        return timestamp
+
+    def cancel(self):
+        """
+        Wakes the subscriber up for good
+        :return: None
+        """
+        self.clock.tick_condition.acquire()
+        try:
+            self.cancelled = True
+            self.clock.tick_condition.notify_all()
+        finally:
+            self.clock.tick_condition.release()
 
 
 class Clock(TickPerformer):
     def __init__(self):
         super().__init__()
+        # replaced as a whole on every tick, so it is read without a lock
         self.timestamp_of_now = EXECUTION_CONFIGS.clock_start_timestamp
         self.tick_number = 0
-        self.timestamp_of_now_safe_mutex = Lock()
+        # notifies the subscribers when the timestamp is written
+        self.tick_condition = Condition()
+        self.sleep_duration = EXECUTION_CONFIGS.clock_timestamp_increase_per_tick
+        self.tick_duration = EXECUTION_CONFIGS.clock_tick_duration
+
+    def is_simulated(self):
+        """
+        :return: True if the clock moves in ticks rather than following the real time
+        """
+        return self.sleep_duration is not None
 
     def read_timestamp_of_now(self):
-        if clock_real_tick_time_interval is None:
-            return int(datetime_string_to_timestamp(datetime_string=None))
-        self.timestamp_of_now_safe_mutex.acquire()
-        try:
-            return int(self.timestamp_of_now)
-        finally:
-            self.timestamp_of_now_safe_mutex.release()
+        if self.sleep_duration is None:
+            return int(time())
+        return int(self.timestamp_of_now)
 
     def write_timestamp_of_now(self, new_value):
-        self.timestamp_of_now_safe_mutex.acquire()
+        self.tick_condition.acquire()
         try:
             self.timestamp_of_now = new_value
+            self.tick_number += 1
+            self.tick_condition.notify_all()
         finally:
-            self.timestamp_of_now_safe_mutex.release()
-
-    def run(self, should_stop):
-        if clock_real_tick_time_interval is None:
-            return
-        while True:
-            if should_stop():
-                break
-            sleep(clock_tick_duration)
-            next_ts_of_now_value = self.read_timestamp_of_now() + clock_real_tick_time_interval
-            self.write_timestamp_of_now(next_ts_of_now_value)
+            self.tick_condition.release()
+
+    def subscribe(self, interval):
+        """
+        Subscribes to the ticks of a simulation clock
+        :param interval: seconds of clock time between two wake ups of the subscriber
+        :return: a ClockSubscription
+        """
+        return ClockSubscription(self, interval)
+
+    def before_ticks(self):
+        # the clock does not tick in realtime execution
+        return self.sleep_duration is not None
+
+    def perform_tick(self, current_timestamp):
+        next_ts_of_now_value = current_timestamp + self.sleep_duration
+        self.write_timestamp_of_now(next_ts_of_now_value)
+        return False
 
     def post_run(self):
         logger('clock').info("Clock is terminating.")
@@ -0,0 +1,180 @@
+import heapq
+from threading import Event, Lock
+from time import monotonic
+
+from clock.tick_performer import calculate_next_deadline
+from utility.log import logger
+
+SCHEDULING_THREADS = 'threads'
+SCHEDULING_VIRTUAL_TIME = 'virtual'
+SCHEDULING_DEADLINES = 'deadline'
+
+
+class SchedulerException(Exception):
+    pass
+
+
+class Scheduler:
+    """
+    Runs the ticks of tick performers on the calling thread, from a heap of the moments the performers are due
+    """
+
+    def __init__(self, clock):
+        """
+        :param clock: the clock the timestamps of the ticks are read from
+        """
+        self.clock = clock
+        self.performers = []
+        self.ticking_performers = set()
+        # A heap of (due_moment, priority) tuples, where priority is the index of the performer
+        self.due_ticks = []
+
+    def add(self, performer):
+        """
+        Registers a performer. Performers added earlier tick first when they are due at the same moment.
+        :param performer: a TickPerformer whose thread is not started
+        :return: None
+        """
+        self.performers.append(performer)
+
+    def begin_ticks(self, start_moment, get_period):
+        """
+        Calls before_ticks of every performer and schedules the first tick of the ones that need ticks
+        :param start_moment:
+        :param get_period: a function that returns the time between two ticks of a performer
+        :return: None
+        """
+        for priority, performer in enumerate(self.performers):
+            if performer.before_ticks():
+                self.ticking_performers.add(priority)
+                heapq.heappush(self.due_ticks, (start_moment + get_period(performer), priority,))
+            else:
+                performer.end_run()
+
+    def finish_all(self):
+        """
+        Ends the performers that are still ticking, in the order they were added
+        :return: None
+        """
+        for priority in sorted(self.ticking_performers):
+            self.finish(priority)
+        self.due_ticks = []
+
+    def finish(self, priority):
+        if priority not in self.ticking_performers:
+            return
+        self.ticking_performers.remove(priority)
+        performer = self.performers[priority]
+        performer.after_ticks()
+        performer.end_run()
+
+
+class VirtualTimeScheduler(Scheduler):
+    """
+    Runs tick performers on the calling thread in virtual time: instead of sleeping, the clock jumps straight
+    to the next moment at which any performer is due, and the performers that are due at the same moment
+    tick in the order they were added. Repeating a simulation therefore gives identical results, and it runs
+    as fast as the ticks can be performed.
+    """
+
+    def __init__(self, clock):
+        """
+        :param clock: the clock whose timestamp is moved forward by the scheduler
+        """
+        if clock.sleep_duration is None:
+            raise SchedulerException("Virtual time needs a simulation clock.")
+        super().__init__(clock)
+
+    def run(self, until=None):
+        """
+        Performs ticks until no performer needs any more ticks, or until the given condition holds
+        :param until: a function that returns True when the scheduler should return
+        :return: None
+        """
+        self.begin_ticks(self.clock.read_timestamp_of_now(), lambda performer: performer.sleep_duration)
+        while len(self.due_ticks) != 0:
+            if until is not None and until():
+                return
+            due_timestamp, priority = heapq.heappop(self.due_ticks)
+            performer = self.performers[priority]
+            if performer.should_stop():
+                self.finish(priority)
+                continue
+            if due_timestamp > self.clock.read_timestamp_of_now():
+                self.clock.write_timestamp_of_now(due_timestamp)
+            if performer.tick(due_timestamp):
+                self.finish(priority)
+            else:
+                heapq.heappush(self.due_ticks, (due_timestamp + performer.sleep_duration, priority,))
+        logger('clock/scheduler').info("No performer needs any more ticks at timestamp {0}.",
+                                       self.clock.read_timestamp_of_now())
+
+
+class DeadlineScheduler(Scheduler):
+    """
+    Runs tick performers on the calling thread in real time, including the clock of a simulation. Every
+    performer ticks on a fixed grid of monotonic deadlines tick_duration seconds apart, so the time spent
+    in ticks does not add up to drift. Deadlines that passed while other ticks ran are skipped, and a tick that
+    takes longer than the period of its performer is reported as an overrun. Waiting for the next deadline ends as soon as the
+    scheduler is stopped.
+    """
+
+    def __init__(self, clock):
+        """
+        :param clock: the clock the timestamps of the ticks are read from
+        """
+        super().__init__(clock)
+        self.stop_event = Event()
+        self.statistics_mutex = Lock()
+        # A map from performer name to a (number of overruns, skipped ticks, longest overrunning tick) tuple
+        self.overruns = {}
+
+    def stop(self):
+        """
+        Makes run return without waiting for the next deadline. May be called from any thread.
+        :return: None
+        """
+        self.stop_event.set()
+
+    def run(self, until=None):
+        """
+        Performs ticks until no performer needs any more ticks, the scheduler is stopped, or the given
+        condition holds
+        :param until: a function that returns True when the scheduler should return
+        :return: None
+        """
+        self.begin_ticks(monotonic(), lambda performer: performer.tick_duration)
+        while len(self.due_ticks) != 0:
+            if self.stop_event.is_set() or (until is not None and until()):
+                return
+            deadline, priority = self.due_ticks[0]
+            if self.stop_event.wait(max(0.0, deadline - monotonic())):
+                return
+            heapq.heappop(self.due_ticks)
+            performer = self.performers[priority]
+            if performer.should_stop():
+                self.finish(priority)
+                continue
+            tick_begin = monotonic()
+            if performer.tick(self.clock.read_timestamp_of_now()):
+                self.finish(priority)
+                continue
+            tick_end = monotonic()
+            next_deadline, number_of_skipped_ticks = calculate_next_deadline(deadline, performer.tick_duration,
+                                                                             tick_end)
+            if tick_end - tick_begin > performer.tick_duration:
+                self.record_overrun(performer, tick_end - tick_begin, number_of_skipped_ticks)
+            heapq.heappush(self.due_ticks, (next_deadline, priority,))
+        logger('clock/scheduler').info("No performer needs any more ticks.")
+
+    def record_overrun(self, performer, tick_time, number_of_skipped_ticks):
+        performer.report_overrun(tick_time, number_of_skipped_ticks)
+        name = type(performer).__name__
+        with self.statistics_mutex:
+            number_of_overruns, skipped_ticks, longest_tick_time = self.overruns.get(name, (0, 0, 0.0,))
+            self.overruns[name] = (number_of_overruns + 1, skipped_ticks + number_of_skipped_ticks,
+                                   max(longest_tick_time, tick_time),)
+
+    def get_overrun_statistics(self):
+        with self.statistics_mutex:
+            return dict(self.overruns)
@@ -1,56 +1,177 @@
-from threading import Thread, Lock
+from threading import Thread, Event
+from time import monotonic
+
+from utility.log import logger
+from utility.metrics import get_metrics_registry
+
+# Upper bounds of the buckets of the lag of the ticks, in clock seconds
+TICK_LAG_BUCKETS = (0, 1, 10, 60, 300, 900, 3600, 6 * 3600, 24 * 3600,)
+
+TICK_DURATION = get_metrics_registry().histogram(
+    'smart_miner_tick_duration_seconds', "Real seconds a tick of a performer took", ('performer',))
+TICK_LAG = get_metrics_registry().histogram(
+    'smart_miner_tick_lag_clock_seconds',
+    "Clock seconds between the timestamp a tick of a performer was due at and the end of the tick",
+    ('performer',), buckets=TICK_LAG_BUCKETS)
+TICK_OVERRUNS = get_metrics_registry().counter(
+    'smart_miner_tick_overruns_total', "Ticks that took longer than the period of their performer", ('performer',))
+SKIPPED_TICKS = get_metrics_registry().counter(
+    'smart_miner_skipped_ticks_total', "Ticks that were skipped because of overruns", ('performer',))
+
+
+def calculate_next_deadline(deadline, period, now):
+    """
+    Finds the next deadline of a periodic tick. Deadlines stay on the grid of the first one, so the time spent
+    in ticks does not accumulate as drift. Deadlines that already passed are skipped.
+    :param deadline: the deadline of the tick that was just performed
+    :param period: seconds between two deadlines
+    :param now: the current monotonic time
+    :return: a tuple (next deadline, number of skipped deadlines)
+    """
+    next_deadline = deadline + period
+    if next_deadline >= now:
+        return next_deadline, 0
+    number_of_skipped_deadlines = int((now - next_deadline) // period) + 1
+    return next_deadline + number_of_skipped_deadlines * period, number_of_skipped_deadlines
 
 
 class TickPerformer:
     def __init__(self):
         self.t = Thread(target=self.run_all, args=(self.should_stop,), daemon=self.is_a_daemon())
-        self.stop_flag = False
-        self.stop_flag_mutex = Lock()
-        self.execution_ended = False
-        self.execution_ended_mutex = Lock()
+        # set when the performer is asked to stop, which also cuts its wait for the next tick short
+        self.stop_event = Event()
+        self.execution_ended_event = Event()
+        # the subscription to the ticks of a simulation clock while the thread of the performer runs
+        self.clock_subscription = None
+        # seconds of clock time between two ticks, and the real seconds the performer sleeps for it
+        self.sleep_duration = None
+        self.tick_duration = None
 
     def should_end_execution(self):
-        self.execution_ended_mutex.acquire()
-        try:
-            return self.execution_ended
-        finally:
-            self.execution_ended_mutex.release()
+        return self.execution_ended_event.is_set()
+
+    def wait_for_end_of_execution(self, timeout=None):
+        """
+        Blocks until the execution of the performer ends or the timeout passes
+        :return: True if the execution ended
+        """
+        return self.execution_ended_event.wait(timeout)
 
     def set_end_of_execution(self):
         # notify other threads to exit
-        self.execution_ended_mutex.acquire()
-        try:
-            self.execution_ended = True
-        finally:
-            self.execution_ended_mutex.release()
+        self.execution_ended_event.set()
 
     def stop(self):
-        self.stop_flag_mutex.acquire()
-        try:
-            self.stop_flag = True
-        finally:
-            self.stop_flag_mutex.release()
+        self.stop_event.set()
+        clock_subscription = self.clock_subscription
+        if clock_subscription is not None:
+            clock_subscription.cancel()
 
     def should_stop(self):
-        self.stop_flag_mutex.acquire()
-        try:
-            return self.stop_flag
-        finally:
-            self.stop_flag_mutex.release()
+        return self.stop_event.is_set()
 
     def start(self):
         self.t.start()
 
     def join(self):
-        if not self.is_a_daemon():
+        # performers that are driven by a scheduler never start their thread
+        if not self.is_a_daemon() and self.t.is_alive():
             self.t.join()
 
     def run_all(self, should_stop):
         self.run(should_stop)
+        self.end_run()
+
+    def end_run(self):
         self.post_run()
         self.set_end_of_execution()
 
     def run(self, should_stop):
+        """
+        Performs a tick every tick_duration seconds until the performer is stopped or has nothing more to do.
+        With a simulation clock, the performer ticks whenever the clock passes the next multiple of sleep_duration.
+        """
+        # imported here because the clock is itself a tick performer
+        from clock import get_clock
+        if not self.before_ticks():
+            return
+        clock = get_clock()
+        if clock is not self and clock.is_simulated():
+            self.run_on_clock_ticks(clock, should_stop)
+        else:
+            self.run_on_deadlines(should_stop)
+        self.after_ticks()
+
+    def run_on_clock_ticks(self, clock, should_stop):
+        self.clock_subscription = clock.subscribe(self.sleep_duration)
+        while not should_stop():
+            timestamp = self.clock_subscription.wait_for_next_tick()
+            if timestamp is None or self.tick(timestamp):
+                break
+
+    def run_on_deadlines(self, should_stop):
+        # imported here because the clock is itself a tick performer
+        from clock import get_clock
+        deadline = monotonic() + self.tick_duration
+        while True:
+            if should_stop():
+                break
+            if self.stop_event.wait(max(0.0, deadline - monotonic())):
+                break
+            tick_begin = monotonic()
+            if self.tick(get_clock().read_timestamp_of_now()):
+                break
+            tick_end = monotonic()
+            deadline, number_of_skipped_ticks = calculate_next_deadline(deadline, self.tick_duration, tick_end)
+            if tick_end - tick_begin > self.tick_duration:
+                self.report_overrun(tick_end - tick_begin, number_of_skipped_ticks)
+
+    def tick(self, current_timestamp):
+        """
+        Performs a tick, and records how long it took and how far the clock got ahead of it
+        :return: the return value of perform_tick
+        """
+        # imported here because the clock is itself a tick performer
+        from clock import get_clock
+        tick_begin = monotonic()
+        no_more_ticks = self.perform_tick(current_timestamp)
+        name = type(self).__name__
+        TICK_DURATION.labels(name).observe(monotonic() - tick_begin)
+        TICK_LAG.labels(name).observe(max(0, get_clock().read_timestamp_of_now() - current_timestamp))
+        return no_more_ticks
+
+    def report_overrun(self, tick_time, number_of_skipped_ticks):
+        """
+        Called when a tick took longer than the period of the ticks
+        :param tick_time: seconds the tick took
+        :param number_of_skipped_ticks:
+        :return: None
+        """
+        TICK_OVERRUNS.labels(type(self).__name__).inc()
+        SKIPPED_TICKS.labels(type(self).__name__).inc(number_of_skipped_ticks)
+        logger('clock/tick-performer').warning(
+            "A tick of {0} took {1:.3f} seconds while its period is {2} seconds; {3} ticks were skipped.",
+            type(self).__name__, tick_time, self.tick_duration, number_of_skipped_ticks)
+
+    def before_ticks(self):
+        """
+        Called once before the first tick
+        :return: False if no ticks should be performed
+        """
+        return True
+
+    def perform_tick(self, current_timestamp):
+        """
+        Performs one tick at the given clock timestamp
+        :return: True if the performer does not need any more ticks
+        """
+        return False
+
+    def after_ticks(self):
+        """
+        Called once after the last tick
+        :return: None
+        """
         pass
 
     def post_run(self):
@@ -58,5 +179,3 @@ class TickPerformer:
 
     def is_a_daemon(self):
         pass
-
-
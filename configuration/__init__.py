@@ -1,20 +1,66 @@
+from threading import Lock
+
 from configuration import constants as consts
 from configuration import configs as configs
-from configuration.configs import SimulationConfigs, RealtimeConfigs, RuntimeMode, RUNTIME_MODE, SIMULATION_CONFIGS, \
-    REALTIME_CONFIGS
+from configuration.configs import SimulationConfigs, RealtimeConfigs, RuntimeMode, ConfigsException, load_configs
+
+CURRENT_CONFIGS = None
+CONFIGS_LOCK = Lock()
+
+
+def configure(config_file_path=None, overrides=None, runtime_mode=None):
+    """
+    Sets the configs of the execution. It has to be called before the components are created, since they read
+    the configs when they are; otherwise the configs are loaded from the default config file on first use.
+    :param config_file_path: defaults to the file named by the environment, or files/config.yaml
+    :param overrides: a dictionary of evaluated entries that take precedence over those of the config file
+    :param runtime_mode: a RuntimeMode to run in instead of the one of the config file
+    :return: the configs
+    """
+    global CURRENT_CONFIGS
+    execution_configs = load_configs(config_file_path=config_file_path, overrides=overrides,
+                                     runtime_mode=runtime_mode)
+    CONFIGS_LOCK.acquire()
+    try:
+        CURRENT_CONFIGS = execution_configs
+    finally:
+        CONFIGS_LOCK.release()
+    return execution_configs
+
+
+def get_execution_configs():
+    """
+    :return: the configs of the execution, loaded from the default config file if none were set
+    """
+    global CURRENT_CONFIGS
+    if CURRENT_CONFIGS is None:
+        CONFIGS_LOCK.acquire()
+        try:
+            if CURRENT_CONFIGS is None:
+                CURRENT_CONFIGS = load_configs()
+        finally:
+            CONFIGS_LOCK.release()
+    return CURRENT_CONFIGS
+
+
+class LazyExecutionConfigs:
+    """
+    Stands for the configs of the execution, which are only loaded when one of them is first read
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_execution_configs(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_execution_configs(), name, value)
 
 
 def is_simulation():
-    return RUNTIME_MODE == RuntimeMode.SIMULATION
+    return get_execution_configs().runtime_mode == RuntimeMode.SIMULATION
 
 
 def is_new_simulation_going_to_happen():
     return EXECUTION_CONFIGS.identifier is not None
 
 
-EXECUTION_CONFIGS = None
-
-if is_simulation():
-    EXECUTION_CONFIGS = SIMULATION_CONFIGS
-else:
-    EXECUTION_CONFIGS = REALTIME_CONFIGS
+EXECUTION_CONFIGS = LazyExecutionConfigs()
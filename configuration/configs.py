@@ -1,3 +1,4 @@
+import ast
 import os
 import sys
 
@@ -5,15 +6,18 @@ import yaml
 import logging
 from enum import Enum
 
-from configuration.constants import MINUTE_SECONDS
+from configuration.constants import MINUTE_SECONDS, DEFAULT_CONFIG_FILE_PATH, CONFIG_FILE_PATH_ENVIRONMENT_VARIABLE
 from utility.datetime_helpers import datetime_string_to_timestamp
 
-config_raw_data = None
-with open("files/config.yaml") as config_file:
-    config_raw_data = yaml.safe_load(config_file)
+try:
+    # the libyaml parser, when PyYAML was built with it
+    from yaml import CSafeLoader as ConfigFileLoader
+except ImportError:
+    from yaml import SafeLoader as ConfigFileLoader
 
-config_raw_realtime = config_raw_data['realtime']
-config_raw_simulation = config_raw_data['simulation']
+
+class ConfigsException(Exception):
+    pass
 
 
 def evaluate_value(value):
@@ -22,7 +26,11 @@ def evaluate_value(value):
     elif value.startswith("!!"):
         return custom_evaluation(value)
     else:
-        return eval(value)
+        try:
+            # numbers, booleans, None and the like do not need the interpreter
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return eval(value)
 
 
 def custom_evaluation(value):
@@ -35,26 +43,234 @@ class RuntimeMode(Enum):
     REALTIME = 2
 
 
-RUNTIME_MODE = evaluate_value("RuntimeMode." + config_raw_data['runtime_mode'])
+# Values of the entries that may be left out of the config file
+DEFAULT_ENTRIES = {
+    # format and write the log records on a thread of their own instead of the threads that log them
+    'log_asynchronously': True,
+    # the maximum number of messages per second of the components that are named here, e.g.
+    # "{'simulation/db/handler': 10}"
+    'log_rate_limits': {},
+    # 'threads' runs every tick performer in its own thread, 'virtual' runs a simulation in virtual time,
+    # 'deadline' runs all tick performers on the main thread at fixed real time deadlines
+    'clock_scheduling': 'threads',
+    # where the database handlers keep their data: 'postgresql', or 'sqlite' for databases inside the process,
+    # kept in files in db_sqlite_directory or, if that is None, only in memory for as long as the execution runs
+    'db_backend': 'postgresql',
+    'db_sqlite_directory': None,
+    # connection pool of the database handlers
+    'db_pool_max_connections': 8,
+    'db_pool_acquire_timeout': 30,
+    'db_pool_health_check_interval': MINUTE_SECONDS,
+    # load only the lines appended to the CSV data files since the previous tick, instead of whole new files
+    'db_csv_tail_files': False,
+    # a directory for a memory-mapped snapshot of the block, pool hash rate and network history, which the
+    # mine database updater keeps up to date and the block caches start from; None disables the snapshot
+    'db_history_snapshot_dir': None,
+    # a CSV file of the recorded price level and available hashrate of the marketplace over time, with the
+    # columns moment, price and available_hashrate, that simulated orders are delivered from; if None, every
+    # simulated order gets its limit
+    'nice_hash_market_history_file': None,
+    # Monte Carlo estimates of the rewards of renting hashrate for the pool: the paths simulated for each
+    # estimate, the seed of their random numbers, and the estimates kept for inputs that do not change
+    'analyzer_monte_carlo_paths': 10000,
+    'analyzer_monte_carlo_seed': 0,
+    'analyzer_monte_carlo_max_cached_results': 128,
+    # coins per block, and the fraction of the rewards that the pool keeps
+    'analyzer_block_reward': 6.25,
+    'analyzer_pool_fee': 0.02,
+    # in-memory cache of the block history
+    'db_block_cache_enabled': True,
+    'db_block_cache_max_blocks': 1000000,
+    # background writer of the order info samples of simulations
+    'simulation_sample_writer_batch_size': 1000,
+    'simulation_sample_writer_flush_interval': 5,
+    'simulation_sample_writer_max_queued_samples': 100000,
+    # export of the metrics in the Prometheus text format, into a file that is rewritten every
+    # metrics_file_interval seconds and/or at http://metrics_http_host:metrics_http_port/metrics
+    'metrics_file_path': None,
+    'metrics_file_interval': 15,
+    'metrics_http_host': '127.0.0.1',
+    'metrics_http_port': None,
+}
+
+NUMBER = (int, float,)
+OPTIONAL_NUMBER = (int, float, type(None),)
+
+# The types an entry may have once it is evaluated. Entries that are not listed here are not checked.
+ENTRY_TYPES = {
+    'log_format': (str,),
+    'log_level': (int,),
+    'log_asynchronously': (bool,),
+    'log_rate_limits': (dict,),
+    'clock_start_timestamp': OPTIONAL_NUMBER,
+    'clock_tick_duration': NUMBER,
+    'clock_timestamp_increase_per_tick': OPTIONAL_NUMBER,
+    'clock_scheduling': (str,),
+    'db_user': (str,),
+    'db_password': (str,),
+    'db_database_name': (str,),
+    'db_host': (str,),
+    'db_port': (str, int,),
+    'db_backend': (str,),
+    'db_sqlite_directory': (str, type(None),),
+    'db_csv_data_dir': (str,),
+    'db_csv_separator': (str,),
+    'db_csv_tail_files': (bool,),
+    'db_pool_max_connections': (int,),
+    'db_pool_acquire_timeout': NUMBER,
+    'db_pool_health_check_interval': NUMBER,
+    'db_history_snapshot_dir': (str, type(None),),
+    'db_block_cache_enabled': (bool,),
+    'db_block_cache_max_blocks': (int,),
+    'mine_db_updater_sleep_duration': NUMBER,
+    'controller_sleep_duration': NUMBER,
+    'analyzer_sleep_duration': NUMBER,
+    'analyzer_monte_carlo_paths': (int,),
+    'analyzer_monte_carlo_seed': (int,),
+    'analyzer_monte_carlo_max_cached_results': (int,),
+    'analyzer_block_reward': NUMBER,
+    'analyzer_pool_fee': NUMBER,
+    'nice_hash_sleep_duration': NUMBER,
+    'nice_hash_close_orders_before_shutdown': (bool,),
+    'nice_hash_market_history_file': (str, type(None),),
+    'simulation_sample_writer_batch_size': (int,),
+    'simulation_sample_writer_flush_interval': NUMBER,
+    'simulation_sample_writer_max_queued_samples': (int,),
+    'metrics_file_path': (str, type(None),),
+    'metrics_file_interval': NUMBER,
+    'metrics_http_host': (str,),
+    'metrics_http_port': (int, type(None),),
+}
+# The entries a simulation needs on top of those of a realtime execution
+SIMULATION_ENTRY_TYPES = {
+    'simulation_end_timestamp': NUMBER,
+    'db_simulation_database_name': (str,),
+    'simulation_db_updater_sleep_duration': NUMBER,
+    'simulation_evaluator_sleep_duration': NUMBER,
+    'simulation_summaries_data_dir': (str,),
+    'clean_simulation_database': (bool,),
+    'identifier': (str, type(None),),
+}
+CLOCK_SCHEDULING_CHOICES = ('threads', 'virtual', 'deadline',)
+DB_BACKEND_CHOICES = ('postgresql', 'sqlite',)
+
+
+class ParsedConfigFile:
+    """
+    The evaluated entries of a config file
+    """
+
+    def __init__(self, runtime_mode, realtime_entries, simulation_entries):
+        self.runtime_mode = runtime_mode
+        self.realtime_entries = realtime_entries
+        self.simulation_entries = simulation_entries
+
+
+# The parsed config files by (path, modification time, size), so that a process reads a file only once
+PARSED_CONFIG_FILES = {}
+
+
+def get_config_file_path():
+    """
+    :return: the path of the config file named by the environment, or the default one
+    """
+    return os.environ.get(CONFIG_FILE_PATH_ENVIRONMENT_VARIABLE, DEFAULT_CONFIG_FILE_PATH)
+
+
+def parse_config_file(config_file_path):
+    """
+    :param config_file_path:
+    :return: a ParsedConfigFile, from the cache if the file did not change since it was last parsed
+    """
+    config_file_path = os.path.abspath(config_file_path)
+    config_file_stat = os.stat(config_file_path)
+    cache_key = (config_file_path, config_file_stat.st_mtime_ns, config_file_stat.st_size,)
+    parsed_config_file = PARSED_CONFIG_FILES.get(cache_key)
+    if parsed_config_file is None:
+        with open(config_file_path) as config_file:
+            config_raw_data = yaml.load(config_file, Loader=ConfigFileLoader)
+        try:
+            runtime_mode = RuntimeMode[config_raw_data['runtime_mode']]
+            realtime_entries = {k: evaluate_value(v) for k, v in config_raw_data['realtime'].items()}
+            simulation_entries = {k: evaluate_value(v) for k, v in (config_raw_data.get('simulation') or {}).items()}
+        except (KeyError, AttributeError, TypeError) as e:
+            raise ConfigsException("The config file {0} is malformed: {1!r}".format(config_file_path, e))
+        parsed_config_file = ParsedConfigFile(runtime_mode, realtime_entries, simulation_entries)
+        PARSED_CONFIG_FILES[cache_key] = parsed_config_file
+    return parsed_config_file
+
+
+def get_project_root_directory():
+    main_file_path = getattr(sys.modules.get('__main__'), '__file__', None)
+    if main_file_path is None:
+        # e.g. an interactive interpreter
+        return os.getcwd()
+    return os.path.dirname(main_file_path)
 
 
 class RealtimeConfigs:
-    def __init__(self, entries):
-        self.read_entries(entries)
-        self.project_root_directory = os.path.dirname(sys.modules['__main__'].__file__)
-        self.execution_identifier = "realtime-{0}".format(int(datetime_string_to_timestamp(datetime_string=None)))
+    runtime_mode = RuntimeMode.REALTIME
+    entry_types = ENTRY_TYPES
+
+    def __init__(self, entries, overrides=None):
+        """
+        :param entries: the evaluated entries of the config file
+        :param overrides: a dictionary of evaluated entries that take precedence over those of the config file
+        """
+        self.__dict__.update(DEFAULT_ENTRIES)
+        self.__dict__.update(entries)
+        if overrides is not None:
+            self.__dict__.update(overrides)
+        self.project_root_directory = get_project_root_directory()
+        self.execution_identifier = "{0}-{1}".format(self.runtime_mode.name.lower(),
+                                                     int(datetime_string_to_timestamp(datetime_string=None)))
 
-    def read_entries(self, entries):
-        for k, v in entries.items():
-            self.__dict__[k] = evaluate_value(v)
+    def validate(self):
+        """
+        :raise ConfigsException: naming all entries that are missing or have a wrong type
+        :return: None
+        """
+        problems = []
+        for name, types in sorted(self.entry_types.items()):
+            if name not in self.__dict__:
+                problems.append("{0} is missing".format(name))
+            elif not isinstance(self.__dict__[name], types):
+                problems.append("{0} is {1!r}, expected {2}".format(name, self.__dict__[name],
+                                                                    " or ".join(t.__name__ for t in types)))
+        if self.__dict__.get('clock_scheduling') not in CLOCK_SCHEDULING_CHOICES:
+            problems.append("clock_scheduling is {0!r}, expected one of {1}".format(
+                self.__dict__.get('clock_scheduling'), ", ".join(CLOCK_SCHEDULING_CHOICES)))
+        if self.__dict__.get('db_backend') not in DB_BACKEND_CHOICES:
+            problems.append("db_backend is {0!r}, expected one of {1}".format(
+                self.__dict__.get('db_backend'), ", ".join(DB_BACKEND_CHOICES)))
+        if len(problems) != 0:
+            raise ConfigsException("Invalid configs: {0}".format("; ".join(problems)))
 
 
 class SimulationConfigs(RealtimeConfigs):
-    def __init__(self, realtime_entries, simulation_entries):
-        super().__init__(realtime_entries)
-        self.read_entries(simulation_entries)
-        self.execution_identifier = "simulation-{0}".format(int(datetime_string_to_timestamp(datetime_string=None)))
+    runtime_mode = RuntimeMode.SIMULATION
+    entry_types = dict(ENTRY_TYPES, **SIMULATION_ENTRY_TYPES)
 
+    def __init__(self, realtime_entries, simulation_entries, overrides=None):
+        super().__init__(dict(realtime_entries, **simulation_entries), overrides=overrides)
 
-REALTIME_CONFIGS = RealtimeConfigs(config_raw_realtime)
-SIMULATION_CONFIGS = SimulationConfigs(config_raw_realtime, config_raw_simulation)
+
+def load_configs(config_file_path=None, overrides=None, runtime_mode=None):
+    """
+    Builds the validated configs of an execution
+    :param config_file_path: defaults to the file named by the environment, or files/config.yaml
+    :param overrides: a dictionary of evaluated entries that take precedence over those of the config file
+    :param runtime_mode: a RuntimeMode to run in instead of the one of the config file
+    :return: a RealtimeConfigs or a SimulationConfigs
+    """
+    parsed_config_file = parse_config_file(config_file_path if config_file_path is not None
+                                           else get_config_file_path())
+    if runtime_mode is None:
+        runtime_mode = parsed_config_file.runtime_mode
+    if runtime_mode == RuntimeMode.SIMULATION:
+        execution_configs = SimulationConfigs(parsed_config_file.realtime_entries,
+                                              parsed_config_file.simulation_entries, overrides=overrides)
+    else:
+        execution_configs = RealtimeConfigs(parsed_config_file.realtime_entries, overrides=overrides)
+    execution_configs.validate()
+    return execution_configs
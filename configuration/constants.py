@@ -1,4 +1,5 @@
 MINUTE_SECONDS = 60
+DAY_SECONDS = 24 * 60 * MINUTE_SECONDS
 
 SLUSHPOOL_NAME = 'slushpool'
 SLUSHPOOL_ID = 1
@@ -6,3 +7,12 @@ SLUSHPOOL_ID = 1
 DEFAULT_NUMBER_OF_PAST_BLOCKS_TO_FETCH = 100
 
 NICE_HASH_LIMIT_CHANGE_PER_SECOND = 50.0 / (15 * MINUTE_SECONDS)
+
+BITCOIN_TARGET_BLOCK_INTERVAL_SECONDS = 10 * MINUTE_SECONDS
+
+# The config file, which may be replaced by the path in the environment variable (e.g. by simulation sweeps)
+DEFAULT_CONFIG_FILE_PATH = "files/config.yaml"
+CONFIG_FILE_PATH_ENVIRONMENT_VARIABLE = "SMART_MINER_CONFIG"
+
+# Block exports of the pool (like files/SP_Data.csv) that are picked up from the csv data directory
+SLUSHPOOL_EXPORT_FILE_FORMAT = "SP_Data*.csv"
@@ -1,7 +1,5 @@
 import random
-from time import sleep
 
-from clock import get_clock
 from clock.clock import calculate_tick_duration_from_sleep_duration
 from clock.tick_performer import TickPerformer
 from configuration import EXECUTION_CONFIGS
@@ -14,20 +12,16 @@ class Controller(TickPerformer):
         A singleton class that is the controller
         """
         super().__init__()
-        self.tick_duration = calculate_tick_duration_from_sleep_duration(EXECUTION_CONFIGS.controller_sleep_duration)
-
-    def run(self, should_stop):
-        while True:
-            if should_stop():
-                break
-            sleep(self.tick_duration)
-            current_timestamp = get_clock().read_timestamp_of_now()
-            logger('controller').debug("Updating controller at timestamp {0}.".format(current_timestamp))
-            pass
+        self.sleep_duration = EXECUTION_CONFIGS.controller_sleep_duration
+        self.tick_duration = calculate_tick_duration_from_sleep_duration(self.sleep_duration)
+
+    def perform_tick(self, current_timestamp):
+        logger('controller').debug("Updating controller at timestamp {0}.", current_timestamp)
+        return False
+
+    def after_ticks(self):
         # Do house-keeping before termination
         self.pre_termination_house_keeping()
-        # Let the main logic know it does not have to wait for the controller and
-        # turn off other threads
 
     def pre_termination_house_keeping(self):
         logger('controller').debug("Doing house keeping before termination")
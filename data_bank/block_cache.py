@@ -0,0 +1,233 @@
+from datetime import datetime
+from threading import Lock
+
+import numpy as np
+import pytz
+
+from utility.log import logger
+
+
+class BlockHistoryCache:
+    """
+    A process-local copy of the latest blocks of one pool, kept as parallel arrays of ids and epoch seconds
+    sorted by moment, that answers range and nearest block queries with binary search.
+
+    The cache covers every block after covered_after (all blocks if it is -inf). When the pool has more blocks
+    than the cache may hold, only the latest ones are kept and queries that reach further into the past
+    are not served.
+    """
+
+    def __init__(self, db_handler, pool_id, max_blocks):
+        """
+        :param db_handler: the MineDatabaseHandler the blocks are loaded from
+        :param pool_id:
+        :param max_blocks: the maximum number of blocks kept in memory
+        """
+        self.db_handler = db_handler
+        self.pool_id = pool_id
+        self.max_blocks = max_blocks
+        # A (ids, moments, covered_after) tuple that is replaced as a whole, or None if nothing is loaded
+        self.state = None
+        self.loading_mutex = Lock()
+        self.statistics_mutex = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.number_of_loads = 0
+        self.number_of_extensions = 0
+
+    def get_blocks_between(self, begin_timestamp, end_timestamp, sort_old_to_new=True, number_of_blocks=None):
+        """
+        :return: a list of (id, moment) tuples like MineDatabaseHandler.get_blocks_between,
+                 or None if the range is not covered by the cache
+        """
+        state = self.get_state()
+        if state is None or begin_timestamp <= state[2]:
+            self.record(hit=False)
+            return None
+        self.record(hit=True)
+        ids, moments, _ = state
+        low = np.searchsorted(moments, begin_timestamp, side='left')
+        high = np.searchsorted(moments, end_timestamp, side='right')
+        if sort_old_to_new:
+            if number_of_blocks is not None:
+                high = min(high, low + number_of_blocks)
+            indexes = range(low, high)
+        else:
+            if number_of_blocks is not None:
+                low = max(low, high - number_of_blocks)
+            indexes = range(high - 1, low - 1, -1)
+        return [(int(ids[i]), to_datetime(moments[i]),) for i in indexes]
+
+    def get_block_moments_between(self, begin_timestamp, end_timestamp):
+        """
+        :return: a sorted array of the epoch seconds of the blocks in the range (shared with the cache,
+                 so it must not be modified), or None if the range is not covered by the cache
+        """
+        state = self.get_state()
+        if state is None or begin_timestamp <= state[2]:
+            self.record(hit=False)
+            return None
+        self.record(hit=True)
+        moments = state[1]
+        low = np.searchsorted(moments, begin_timestamp, side='left')
+        high = np.searchsorted(moments, end_timestamp, side='right')
+        return moments[low:high]
+
+    def get_latest_block_info(self, prior_to_moment, return_first_block_info=False):
+        """
+        :return: a tuple (found, (id, moment) or None), where found is False if the cache cannot answer
+        """
+        state = self.get_state()
+        if state is None:
+            self.record(hit=False)
+            return False, None
+        ids, moments, covered_after = state
+        if return_first_block_info:
+            if prior_to_moment <= covered_after:
+                self.record(hit=False)
+                return False, None
+            index = np.searchsorted(moments, prior_to_moment, side='left')
+            found = index < len(moments)
+        else:
+            index = np.searchsorted(moments, prior_to_moment, side='right') - 1
+            found = index >= 0
+            if not found and covered_after != -np.inf:
+                self.record(hit=False)
+                return False, None
+        self.record(hit=True)
+        if not found:
+            return True, None
+        return True, (int(ids[index]), to_datetime(moments[index]),)
+
+    def invalidate(self):
+        """
+        Drops the cached blocks; they are loaded again by the next query
+        :return: None
+        """
+        with self.loading_mutex:
+            self.state = None
+
+    def extend(self):
+        """
+        Adds the blocks that were stored after the latest cached block. If blocks were added anywhere else,
+        the cache is loaded again.
+        :return: None
+        """
+        with self.loading_mutex:
+            if self.state is None:
+                return
+            ids, moments, covered_after = self.state
+            latest_moment = moments[-1] if len(moments) != 0 else covered_after
+            new_ids, new_moments = self.select_blocks(after_moment=latest_moment, ascending=True)
+            number_of_stored_blocks = self.count_blocks(after_moment=covered_after)
+            if number_of_stored_blocks != len(moments) + len(new_moments):
+                logger('database/block-cache').info(
+                    "Blocks of pool {0} were added before the latest cached block; reloading.", self.pool_id)
+                self.state = self.load()
+                return
+            if len(new_moments) == 0:
+                return
+            ids = np.concatenate((ids, new_ids))
+            moments = np.concatenate((moments, new_moments))
+            if len(moments) > self.max_blocks:
+                covered_after = moments[-self.max_blocks - 1]
+                ids = ids[-self.max_blocks:]
+                moments = moments[-self.max_blocks:]
+            self.state = (ids, moments, covered_after,)
+            self.number_of_extensions += 1
+
+    def get_statistics(self):
+        state = self.state
+        with self.statistics_mutex:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'loads': self.number_of_loads,
+                'extensions': self.number_of_extensions,
+                'cached_blocks': 0 if state is None else len(state[1]),
+            }
+
+    def get_state(self):
+        state = self.state
+        if state is not None:
+            return state
+        with self.loading_mutex:
+            if self.state is None:
+                self.state = self.load()
+            return self.state
+
+    def load(self):
+        state = self.load_from_history_snapshot()
+        if state is not None:
+            return state
+        return self.load_from_database()
+
+    def load_from_history_snapshot(self):
+        """
+        Starts from the blocks of the history snapshot and only selects those that were stored after it
+        :return: the state, or None if there is no snapshot or blocks were stored before its latest block
+        """
+        snapshot = self.db_handler.get_history_snapshot()
+        if snapshot is None:
+            return None
+        ids, moments = snapshot.get_blocks_of_pool(self.pool_id)
+        new_ids, new_moments = self.select_blocks(after_moment=moments[-1] if len(moments) != 0 else None)
+        if self.count_blocks(after_moment=-np.inf) != len(moments) + len(new_moments):
+            return None
+        ids = np.concatenate((ids, new_ids))
+        moments = np.concatenate((moments, new_moments))
+        covered_after = -np.inf
+        if len(moments) > self.max_blocks:
+            covered_after = moments[-self.max_blocks - 1]
+            ids = ids[-self.max_blocks:]
+            moments = moments[-self.max_blocks:]
+        self.number_of_loads += 1
+        logger('database/block-cache').info("Cached {0} blocks of pool {1}, starting from version {2} of the "
+                                            "history snapshot.", len(moments), self.pool_id, snapshot.version)
+        return np.ascontiguousarray(ids), np.ascontiguousarray(moments), covered_after
+
+    def load_from_database(self):
+        ids, moments = self.select_blocks(limit=self.max_blocks + 1, ascending=False)
+        ids = ids[::-1]
+        moments = moments[::-1]
+        covered_after = -np.inf
+        if len(moments) > self.max_blocks:
+            covered_after = moments[0]
+            ids = ids[1:]
+            moments = moments[1:]
+        self.number_of_loads += 1
+        logger('database/block-cache').info("Cached {0} blocks of pool {1}.", len(moments), self.pool_id)
+        return np.ascontiguousarray(ids), np.ascontiguousarray(moments), covered_after
+
+    def select_blocks(self, after_moment=None, limit=None, ascending=True):
+        sql_query = """SELECT id, {0} FROM {1}
+        WHERE pool_id = {2} {3}
+        ORDER BY moment {4} {5};""".format(self.db_handler.epoch_seconds_sql('moment'),
+                                           self.db_handler.BLOCKS_TABLE_NAME, self.pool_id,
+                                           "" if after_moment is None or after_moment == -np.inf
+                                           else "AND moment > {0}".format(self.db_handler.timestamp_sql(
+                                               repr(float(after_moment)))),
+                                           "ASC" if ascending else "DESC",
+                                           "" if limit is None else "LIMIT {0}".format(limit))
+        rows = self.db_handler.execute_select(select_sql_query=sql_query)
+        ids = np.array([r[0] for r in rows], dtype=np.int64)
+        moments = np.array([r[1] for r in rows], dtype=np.float64)
+        return ids, moments
+
+    def count_blocks(self, after_moment):
+        sql_query = """SELECT count(*) FROM {0} WHERE pool_id = {1} {2};""".format(
+            self.db_handler.BLOCKS_TABLE_NAME, self.pool_id,
+            "" if after_moment == -np.inf else "AND moment > {0}".format(
+                self.db_handler.timestamp_sql(repr(float(after_moment)))))
+        return self.db_handler.execute_select(select_sql_query=sql_query)[0][0]
+
+    def record(self, hit):
+        with self.statistics_mutex:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+def to_datetime(epoch_seconds):
+    return datetime.fromtimestamp(float(epoch_seconds), tz=pytz.UTC)
@@ -0,0 +1,186 @@
+from threading import Condition
+from time import monotonic
+
+from psycopg2 import Error as PGError
+from psycopg2 import extensions
+
+from utility.log import logger
+
+
+class ConnectionPoolException(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    A bounded pool of database connections that can be shared by several threads
+    """
+
+    def __init__(self, connection_factory, max_connections, acquire_timeout=None, health_check_interval=None):
+        """
+        :param connection_factory: a function that creates and returns a new connection
+        :param max_connections: maximum number of connections that may be open at the same time
+        :param acquire_timeout: seconds to wait for a free connection before failing. None waits forever
+        :param health_check_interval: connections idle for longer than this many seconds are checked
+                                      before they are handed out. None disables the check
+        """
+        if max_connections < 1:
+            raise ConnectionPoolException("Pool size must be positive but {0} was given.".format(max_connections))
+        self.connection_factory = connection_factory
+        self.max_connections = max_connections
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        # A list of (connection, moment_of_release) tuples, the most recently released one is last
+        self.idle_connections = []
+        self.number_of_open_connections = 0
+        self.number_of_connections_in_use = 0
+        self.closed = False
+        self.pool_condition = Condition()
+        # statistics
+        self.total_acquisitions = 0
+        self.total_waits = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_connections_created = 0
+        self.total_connections_discarded = 0
+        self.total_failed_health_checks = 0
+
+    def acquire(self):
+        """
+        Returns a healthy connection, waiting for one to be released if the pool is exhausted
+        :return: a connection that must be given back with release
+        """
+        wait_begin = monotonic()
+        waited = False
+        with self.pool_condition:
+            while True:
+                if self.closed:
+                    raise ConnectionPoolException("Connection pool is closed.")
+                if len(self.idle_connections) != 0 or self.number_of_open_connections < self.max_connections:
+                    break
+                waited = True
+                remaining_time = None
+                if self.acquire_timeout is not None:
+                    remaining_time = self.acquire_timeout - (monotonic() - wait_begin)
+                    if remaining_time <= 0:
+                        raise ConnectionPoolException(
+                            "No connection was released in {0} seconds.".format(self.acquire_timeout))
+                self.pool_condition.wait(remaining_time)
+            idle_connection_info = None
+            if len(self.idle_connections) != 0:
+                idle_connection_info = self.idle_connections.pop()
+            else:
+                # reserve the slot before connecting outside of the lock
+                self.number_of_open_connections += 1
+            self.number_of_connections_in_use += 1
+            self.record_acquisition(waited, monotonic() - wait_begin)
+
+        try:
+            if idle_connection_info is not None:
+                return self.check_health(*idle_connection_info)
+            return self.create_connection()
+        except Exception:
+            with self.pool_condition:
+                self.number_of_open_connections -= 1
+                self.number_of_connections_in_use -= 1
+                self.pool_condition.notify()
+            raise
+
+    def release(self, connection, discard=False):
+        """
+        Gives back a connection that was acquired from this pool
+        :param connection:
+        :param discard: closes the connection instead of keeping it if True is passed (e.g. when it is broken)
+        :return: None
+        """
+        if not discard and not connection.closed:
+            try:
+                # never keep an unfinished transaction around
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except PGError:
+                discard = True
+        with self.pool_condition:
+            self.number_of_connections_in_use -= 1
+            if discard or connection.closed or self.closed:
+                self.number_of_open_connections -= 1
+                self.total_connections_discarded += 1
+                self.close_quietly(connection)
+            else:
+                self.idle_connections.append((connection, monotonic(),))
+            self.pool_condition.notify()
+
+    def close(self):
+        """
+        Closes all idle connections and rejects further acquisitions. Connections in use are closed upon release.
+        :return: None
+        """
+        with self.pool_condition:
+            self.closed = True
+            for connection, _ in self.idle_connections:
+                self.close_quietly(connection)
+            self.number_of_open_connections -= len(self.idle_connections)
+            self.idle_connections = []
+            self.pool_condition.notify_all()
+
+    def get_statistics(self):
+        """
+        :return: a dictionary of the current state and accumulated statistics of the pool
+        """
+        with self.pool_condition:
+            return {
+                'max_connections': self.max_connections,
+                'open_connections': self.number_of_open_connections,
+                'in_use_connections': self.number_of_connections_in_use,
+                'idle_connections': len(self.idle_connections),
+                'acquisitions': self.total_acquisitions,
+                'waits': self.total_waits,
+                'total_wait_time': self.total_wait_time,
+                'max_wait_time': self.max_wait_time,
+                'connections_created': self.total_connections_created,
+                'connections_discarded': self.total_connections_discarded,
+                'failed_health_checks': self.total_failed_health_checks,
+            }
+
+    def record_acquisition(self, waited, wait_time):
+        self.total_acquisitions += 1
+        if waited:
+            self.total_waits += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def create_connection(self):
+        connection = self.connection_factory()
+        with self.pool_condition:
+            self.total_connections_created += 1
+        return connection
+
+    def check_health(self, connection, moment_of_release):
+        """
+        Returns the given idle connection if it is still usable, or a new connection instead
+        """
+        if not connection.closed:
+            if self.health_check_interval is None or monotonic() - moment_of_release < self.health_check_interval:
+                return connection
+            try:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute("SELECT 1;")
+                finally:
+                    cursor.close()
+                connection.rollback()
+                return connection
+            except PGError as e:
+                logger('database/pool').warning("Idle connection failed the health check: {0}.", e)
+        with self.pool_condition:
+            self.total_failed_health_checks += 1
+            self.total_connections_discarded += 1
+        self.close_quietly(connection)
+        return self.create_connection()
+
+    @staticmethod
+    def close_quietly(connection):
+        try:
+            connection.close()
+        except PGError:
+            pass
@@ -0,0 +1,99 @@
+import csv
+
+# COPY reads the files with QUOTE '''', so a field in single quotes may contain the separator
+QUOTE_CHARACTER = "'"
+
+
+class CsvLoadReport:
+    """
+    The outcome of loading the records of a CSV file into a table
+    """
+
+    def __init__(self, table_name, source):
+        self.table_name = table_name
+        self.source = source
+        self.success = False
+        # records that were added to the table
+        self.rows_inserted = 0
+        # well-formed records that were already in the table (or repeated in the file)
+        self.rows_skipped = 0
+        # records with the wrong number of fields, which were not sent to the database; a record whose values
+        # the table does not accept, e.g. a timestamp that cannot be parsed, fails the whole load instead
+        self.rows_rejected = 0
+        # the byte offset right after the last complete line that was loaded, when a file is tailed
+        self.end_offset = None
+
+    def __str__(self):
+        return "{0} -> {1}: {2} inserted, {3} skipped, {4} rejected{5}".format(
+            self.source, self.table_name, self.rows_inserted, self.rows_skipped, self.rows_rejected,
+            "" if self.success else " (FAILED)")
+
+
+class LineFeeder:
+    """
+    An iterator of the one line it was last given, so that a single csv reader splits the lines one at a time
+    and a quote that is not closed does not take the next lines into its field
+    """
+
+    def __init__(self):
+        self.line = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line, self.line = self.line, None
+        if line is None:
+            raise StopIteration
+        return line
+
+
+class CsvCopyStream:
+    """
+    A read-only file-like object that feeds the record lines of a CSV file to COPY, while leaving out
+    the lines that do not have the expected number of fields. Fields are split as COPY splits them, with
+    single quotes around values. The values themselves are not checked, so one that the table does not
+    accept fails the COPY of the whole stream.
+    """
+
+    def __init__(self, lines, number_of_columns, separator):
+        """
+        :param lines: an iterable of record lines (e.g. an open file positioned after the header)
+        :param number_of_columns: the number of fields a well-formed record has
+        :param separator:
+        """
+        self.lines = iter(lines)
+        self.number_of_columns = number_of_columns
+        self.separator = separator
+        self.line_feeder = LineFeeder()
+        self.field_reader = csv.reader(self.line_feeder, delimiter=separator, quotechar=QUOTE_CHARACTER)
+        self.rows_accepted = 0
+        self.rows_rejected = 0
+        self.exhausted = False
+
+    def read(self, size=-1):
+        chunk = []
+        chunk_size = 0
+        while size < 0 or chunk_size < size:
+            line = self.readline()
+            if line == "":
+                break
+            chunk.append(line)
+            chunk_size += len(line)
+        return "".join(chunk)
+
+    def readline(self, size=-1):
+        while not self.exhausted:
+            line = next(self.lines, None)
+            if line is None:
+                self.exhausted = True
+                break
+            if line.strip() == "":
+                continue
+            self.line_feeder.line = line
+            if len(next(self.field_reader, ())) != self.number_of_columns:
+                self.rows_rejected += 1
+                continue
+            self.rows_accepted += 1
+            return line if line.endswith("\n") else line + "\n"
+        return ""
@@ -1,16 +1,27 @@
 import glob, os
 import sys
-from time import sleep
+from time import monotonic
 
-import psycopg2
 from psycopg2 import Error as PGError
 
-from clock import get_clock
 from clock.clock import calculate_tick_duration_from_sleep_duration
 from clock.tick_performer import TickPerformer
 from configuration import EXECUTION_CONFIGS
 from configuration.constants import SLUSHPOOL_NAME, DEFAULT_NUMBER_OF_PAST_BLOCKS_TO_FETCH
+from data_bank.csv_loading import CsvLoadReport, CsvCopyStream
+from data_bank.ingest_ledger import IngestLedgerEntry, read_file_state, calculate_content_hash, \
+    calculate_prefix_hash
+from data_bank.storage_backends import create_storage_backend, SQLITE
 from utility.log import logger
+from utility.metrics import get_metrics_registry
+
+DB_QUERY_DURATION = get_metrics_registry().histogram(
+    'smart_miner_db_query_duration_seconds', "Seconds a query took, including waiting for a pooled connection",
+    ('database', 'statement',))
+DB_QUERY_ROWS = get_metrics_registry().counter(
+    'smart_miner_db_query_rows_total', "Rows that queries selected, wrote or copied", ('database', 'statement',))
+DB_QUERY_FAILURES = get_metrics_registry().counter(
+    'smart_miner_db_query_failures_total', "Queries that failed", ('database', 'statement',))
 
 
 class DatabaseException(Exception):
@@ -19,6 +30,7 @@ class DatabaseException(Exception):
 
 class DatabaseUpdater(TickPerformer):
     KV_OWNER_KEY = 'db'
+    # Before the ingest ledger, the loaded files were kept as a comma separated list under this key
     LOADED_DATA_FILES_LIST_KEY = 'loaded_data_files_list'
 
     def __init__(self, handler):
@@ -27,23 +39,21 @@ class DatabaseUpdater(TickPerformer):
         """
         super().__init__()
         self.handler = handler
-        self.data_files_loaded = []
-        self.init_loaded_data_files_info()
-        self.tick_duration = self.get_tick_duration()
+        # A map from file path to the IngestLedgerEntry of the loaded file
+        self.ingest_ledger = {}
+        self.init_ingest_ledger()
+        self.sleep_duration = self.get_sleep_duration()
+        self.tick_duration = calculate_tick_duration_from_sleep_duration(self.sleep_duration)
 
-    def get_tick_duration(self):
+    def get_sleep_duration(self):
         pass
 
-    def run(self, should_stop):
-        while True:
-            if should_stop():
-                break
-            sleep(self.tick_duration)
-            current_timestamp = get_clock().read_timestamp_of_now()
-            self.update_data(current_timestamp)
+    def perform_tick(self, current_timestamp):
+        self.update_data(current_timestamp)
+        return False
 
     def post_run(self):
-        logger('database').info("Database ({0}) is terminating.".format(self.get_db_csv_name_suffix()))
+        logger('database').info("Database ({0}) is terminating.", self.get_db_csv_name_suffix())
 
     def is_a_daemon(self):
         return False
@@ -51,6 +61,13 @@ class DatabaseUpdater(TickPerformer):
     def get_db_csv_name_suffix(self):
         raise DatabaseException("The base database class should not be used.")
 
+    def on_new_data_loaded(self):
+        """
+        Called after a data file is loaded into the database
+        :return: None
+        """
+        pass
+
     def update_data(self, up_to_timestamp):
         """
         Updates the data up to the given timestamp. Uses current timestamp if None is passed.
@@ -59,54 +76,158 @@ class DatabaseUpdater(TickPerformer):
         # NOTE: this method should execute asynchronically
 
         # TODO 1. Check the data directory for any new data files to load into the database
-        new_csv_files = self.check_new_data_files_to_load()
-        if len(new_csv_files) != 0:
-            self.load_new_csv_files(new_csv_files)
+        if EXECUTION_CONFIGS.db_csv_tail_files:
+            changed_csv_files = self.check_new_data_files_to_load(tail=True)
+            if len(changed_csv_files) != 0:
+                self.load_csv_file_tails(changed_csv_files)
+        else:
+            new_csv_files = self.check_new_data_files_to_load()
+            if len(new_csv_files) != 0:
+                self.load_new_csv_files(new_csv_files)
 
         # TODO 2. Check the APIs to see if there is any new data to fetch and insert into the database
 
         # TODO 3: log some status of the database
 
-    def init_loaded_data_files_info(self):
+    def init_ingest_ledger(self):
+        self.ingest_ledger = self.handler.get_ingest_ledger_entries()
         stored_value = self.handler.key_value_get(self.KV_OWNER_KEY, self.LOADED_DATA_FILES_LIST_KEY)
-        if stored_value is None or stored_value == "":
+        if stored_value is not None and stored_value != "":
+            self.migrate_loaded_data_files_list(stored_value.split(','))
+
+    def migrate_loaded_data_files_list(self, loaded_file_paths):
+        """
+        Moves the files of the legacy list into the ledger, as they are now, so that they are not loaded again
+        :param loaded_file_paths:
+        :return: None
+        """
+        with self.handler.transaction():
+            for path in loaded_file_paths:
+                if path in self.ingest_ledger or not os.path.isfile(path):
+                    continue
+                size, mtime = read_file_state(path)
+                self.record_ingest(IngestLedgerEntry(path, size, mtime, calculate_content_hash(path)))
             self.handler.key_value_put(self.KV_OWNER_KEY, self.LOADED_DATA_FILES_LIST_KEY, "")
-            self.data_files_loaded = []
-        else:
-            self.data_files_loaded = stored_value.split(',')
+        logger('database/updater').info("Moved {0} loaded files into the ingest ledger.", len(loaded_file_paths))
+
+    def record_ingest(self, entry):
+        self.handler.record_ingest_ledger_entry(entry)
+        self.ingest_ledger[entry.path] = entry
 
-    def remember_csv_file_was_loaded(self, file_name):
-        self.data_files_loaded.append(file_name)
-        self.handler.key_value_put(self.KV_OWNER_KEY, self.LOADED_DATA_FILES_LIST_KEY, ",".join(self.data_files_loaded))
+    def record_loaded_file(self, path, size, mtime, content_hash, reports, load_seconds):
+        """
+        Records in the ledger that the file was loaded
+        :param reports: the CsvLoadReports of the tables the file was loaded into
+        :return: None
+        """
+        self.record_ingest(IngestLedgerEntry(path, size, mtime, content_hash,
+                                             rows_inserted=sum(r.rows_inserted for r in reports),
+                                             rows_skipped=sum(r.rows_skipped for r in reports),
+                                             rows_rejected=sum(r.rows_rejected for r in reports),
+                                             load_seconds=load_seconds))
 
-    def check_new_data_files_to_load(self):
+    def check_new_data_files_to_load(self, file_format=None, tail=False):
+        """
+        Returns the files in the data directory that match the given format and are not loaded yet, or whose
+        content changed since they were loaded. Only files whose size or modification time changed are hashed.
+        :param file_format: a glob pattern. Defaults to the CSV files of this database
+        :param tail: returns every file whose size or modification time changed, without hashing it
+        :return: a list of file paths
+        """
         new_files_to_load = []
 
         directory_path = EXECUTION_CONFIGS.db_csv_data_dir
-        file_format = "*.*.{0}.csv".format(self.get_db_csv_name_suffix())
+        if file_format is None:
+            file_format = "*.*.{0}.csv".format(self.get_db_csv_name_suffix())
         file_search_pattern = os.path.join(directory_path, file_format)
         for file_name in glob.glob(file_search_pattern):
-            if file_name not in self.data_files_loaded:
+            entry = self.ingest_ledger.get(file_name)
+            if entry is None:
+                new_files_to_load.append(file_name)
+                continue
+            size, mtime = read_file_state(file_name)
+            if entry.has_same_state(size, mtime):
+                continue
+            if tail:
+                new_files_to_load.append(file_name)
+                continue
+            content_hash = calculate_content_hash(file_name)
+            if content_hash != entry.content_hash:
+                logger('database/updater').info("Content of {0} changed since it was loaded.", file_name)
                 new_files_to_load.append(file_name)
+            else:
+                # touched but not changed
+                self.record_ingest(IngestLedgerEntry(file_name, size, mtime, content_hash, entry.rows_inserted,
+                                                     entry.rows_skipped, entry.rows_rejected, entry.load_seconds))
         return new_files_to_load
 
     def load_new_csv_files(self, new_files_to_load):
         for file_name in new_files_to_load:
-            success = self.load_csv_file(file_name)
-            if success:
-                self.remember_csv_file_was_loaded(file_name)
-                logger('database/updater').info("CSV file {0} was loading into the database successfully.".format(file_name))
+            size, mtime = read_file_state(file_name)
+            content_hash = calculate_content_hash(file_name)
+            load_begin = monotonic()
+            report = self.load_csv_file(file_name)
+            if report.success:
+                self.record_loaded_file(file_name, size, mtime, content_hash, [report], monotonic() - load_begin)
+                self.on_new_data_loaded()
+                logger('database/updater').info("CSV file was loaded into the database: {0}.", report)
+            else:
+                logger('database/updater').error("CSV file could not be loaded: {0}.", report)
 
-    def load_csv_file(self, full_file_path):
+    def load_csv_file_tails(self, changed_files):
+        """
+        Loads the complete lines that were appended to each file since it was last loaded. A file that is now
+        shorter than what was loaded, or whose beginning changed, was truncated or rotated and is loaded from
+        its beginning.
+        :param changed_files: a list of file paths
+        :return: None
+        """
+        for file_name in changed_files:
+            size, mtime = read_file_state(file_name)
+            entry = self.ingest_ledger.get(file_name)
+            begin_offset = 0
+            if entry is not None and entry.byte_offset is not None:
+                if size < entry.byte_offset or \
+                        calculate_prefix_hash(file_name, entry.byte_offset) != entry.prefix_hash:
+                    logger('database/updater').info(
+                        "{0} was truncated or rotated; loading it from the beginning.", file_name)
+                    entry = None
+                else:
+                    begin_offset = entry.byte_offset
+            load_begin = monotonic()
+            report = self.load_csv_file(file_name, begin_offset=begin_offset)
+            if not report.success:
+                logger('database/updater').error("CSV file tail could not be loaded: {0}.", report)
+                continue
+            self.record_ingest(IngestLedgerEntry(
+                file_name, size, mtime, None,
+                rows_inserted=report.rows_inserted + (0 if entry is None else entry.rows_inserted or 0),
+                rows_skipped=report.rows_skipped + (0 if entry is None else entry.rows_skipped or 0),
+                rows_rejected=report.rows_rejected + (0 if entry is None else entry.rows_rejected or 0),
+                load_seconds=monotonic() - load_begin,
+                byte_offset=report.end_offset,
+                prefix_hash=calculate_prefix_hash(file_name, report.end_offset)))
+            if report.rows_inserted != 0:
+                self.on_new_data_loaded()
+            logger('database/updater').info("CSV file tail was loaded into the database: {0}.", report)
+
+    def load_csv_file(self, full_file_path, begin_offset=None):
         file_name = os.path.basename(full_file_path)
         table_name = file_name[:file_name.find('.')]
         # file_full_path = os.path.join(EXECUTION_CONFIGS.project_root_directory,
         #                               EXECUTION_CONFIGS.db_csv_data_dir,
         #                               file_name)
-        return self.handler.load_csv_file(table_name, full_file_path)
+        return self.handler.load_csv_file(table_name, full_file_path, begin_offset=begin_offset)
 
 
 class DatabaseHandler:
+    INGEST_LEDGER_TABLE_NAME = 'ingest_ledger'
+    # The tables an SQLite database of the handler is created with
+    SQLITE_SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS key_values (owner character(100), key character(500), value TEXT, 
+        CONSTRAINT owner_key_unique UNIQUE(owner, key));""",
+    ]
+
     def __init__(self, user, password, database, host="127.0.0.1", port="5432"):
         """
         A singleton class that is the interface of databases
@@ -116,6 +237,82 @@ class DatabaseHandler:
         self.user = user
         self.password = password
         self.database = database
+        # the connections of the backend are shared by all threads that use the handler
+        self.backend = create_storage_backend(user, password, database, host, port)
+        # A map from statement name to the statement of the backend
+        self.prepared_statements = {}
+        self.register_statement('key_value_get', """SELECT value FROM key_values WHERE owner = $1 AND key = $2;""")
+        self.register_statement('key_value_put', """INSERT INTO key_values (owner, key, value) VALUES ($1, $2, $3) 
+        ON CONFLICT ON CONSTRAINT owner_key_unique DO 
+        UPDATE SET value = EXCLUDED.value;""", sqlite_sql="""INSERT INTO key_values (owner, key, value) 
+        VALUES ($1, $2, $3) 
+        ON CONFLICT (owner, key) DO 
+        UPDATE SET value = excluded.value;""")
+        self.register_statement('record_ingest_ledger_entry', """INSERT INTO {0} 
+        (path, size, mtime, content_hash, rows_inserted, rows_skipped, rows_rejected, load_seconds, byte_offset, 
+        prefix_hash) 
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+        ON CONFLICT (path) DO UPDATE SET 
+        size = EXCLUDED.size, mtime = EXCLUDED.mtime, content_hash = EXCLUDED.content_hash, 
+        rows_inserted = EXCLUDED.rows_inserted, rows_skipped = EXCLUDED.rows_skipped, 
+        rows_rejected = EXCLUDED.rows_rejected, load_seconds = EXCLUDED.load_seconds, 
+        byte_offset = EXCLUDED.byte_offset, prefix_hash = EXCLUDED.prefix_hash, loaded_at = {1};""".format(
+            self.INGEST_LEDGER_TABLE_NAME, self.current_timestamp_sql()))
+        self.ingest_ledger_table_exists = False
+        if self.backend.dialect == SQLITE:
+            self.create_sqlite_schema()
+
+    @property
+    def dialect(self):
+        return self.backend.dialect
+
+    def sql_for_dialect(self, sql, sqlite_sql=None):
+        """
+        :param sql: a query in the dialect of PostgreSQL
+        :param sqlite_sql: the query in the dialect of SQLite, if it differs
+        :return: the query in the dialect of the backend
+        """
+        if sqlite_sql is not None and self.backend.dialect == SQLITE:
+            return sqlite_sql
+        return sql
+
+    def epoch_seconds_sql(self, column):
+        """
+        :return: the SQL expression of the epoch seconds of a timestamp column, as a double
+        """
+        return self.sql_for_dialect("extract(epoch FROM {0})::double precision",
+                                    sqlite_sql="CAST({0} AS REAL)").format(column)
+
+    def timestamp_sql(self, epoch_seconds):
+        """
+        :param epoch_seconds: an SQL expression of epoch seconds, e.g. a placeholder
+        :return: the SQL expression of the timestamp of those epoch seconds
+        """
+        # the SQLite backend keeps timestamps as epoch seconds
+        return self.sql_for_dialect("to_timestamp({0})", sqlite_sql="{0}").format(epoch_seconds)
+
+    def current_timestamp_sql(self):
+        return self.sql_for_dialect("now()", sqlite_sql="CAST(strftime('%s', 'now') AS REAL)")
+
+    def create_sqlite_schema(self):
+        """
+        Creates the tables of the handler that are missing from an SQLite database, which, unlike a PostgreSQL
+        database, is not set up beforehand
+        :return: None
+        """
+        with self.transaction():
+            for statement in self.SQLITE_SCHEMA:
+                self.execute_write(write_sql_query=statement)
+
+    def register_statement(self, name, sql, sqlite_sql=None):
+        """
+        Registers a statement that is prepared on each connection the first time it is executed there
+        :param name: a unique name that is a valid SQL identifier
+        :param sql: the statement with $1, $2, ... as parameter placeholders
+        :param sqlite_sql: the statement in the dialect of SQLite, if it differs, with the same placeholders
+        :return: None
+        """
+        self.prepared_statements[name] = self.backend.create_statement(name, self.sql_for_dialect(sql, sqlite_sql))
 
     def key_value_get(self, owner, key):
         """
@@ -128,8 +325,7 @@ class DatabaseHandler:
             raise DatabaseException(
                 "Key value put failed because owner or key was None: owner: {0}, key: {1}".format(owner, key))
 
-        sql_query = "SELECT value FROM key_values WHERE owner = '{0}' AND key = '{1}';".format(owner, key)
-        results = self.execute_select(sql_query)
+        results = self.execute_prepared('key_value_get', (owner, key,), fetch_results=True)
         if len(results) == 0:
             return None
         else:
@@ -143,39 +339,84 @@ class DatabaseHandler:
         :param value:
         :return: None
         """
-        sql_query = """INSERT INTO key_values (owner, key, value) VALUES ('{0}', '{1}', '{2}') 
-         ON CONFLICT ON CONSTRAINT owner_key_unique DO 
-         UPDATE SET value = '{2}';""".format(
-            owner, key,
-            value)
-        self.execute_write(sql_query)
+        self.execute_prepared('key_value_put', (owner, key, value,))
+
+    def create_ingest_ledger_table(self):
+        """
+        Creates the ledger of the loaded data files unless it exists
+        :return: None
+        """
+        if self.ingest_ledger_table_exists:
+            return
+        self.execute_write(write_sql_query="""CREATE TABLE IF NOT EXISTS {0} (
+        path TEXT PRIMARY KEY, 
+        size BIGINT NOT NULL, 
+        mtime DOUBLE PRECISION NOT NULL, 
+        content_hash character(64), 
+        rows_inserted BIGINT, 
+        rows_skipped BIGINT, 
+        rows_rejected BIGINT, 
+        load_seconds DOUBLE PRECISION, 
+        byte_offset BIGINT, 
+        prefix_hash character(64), 
+        loaded_at timestamptz NOT NULL DEFAULT ({1}));""".format(self.INGEST_LEDGER_TABLE_NAME,
+                                                               self.current_timestamp_sql()))
+        if self.backend.dialect != SQLITE:
+            # ledgers that were created before the files were followed have neither the offset nor the prefix hash
+            # of a file, and need a hash of the whole content which a followed file does not have
+            self.execute_write(write_sql_query="""ALTER TABLE {0}
+            ADD COLUMN IF NOT EXISTS byte_offset BIGINT,
+            ADD COLUMN IF NOT EXISTS prefix_hash character(64),
+            ALTER COLUMN content_hash DROP NOT NULL;""".format(self.INGEST_LEDGER_TABLE_NAME))
+        self.ingest_ledger_table_exists = True
+
+    def get_ingest_ledger_entries(self):
+        """
+        :return: a map from file path to the IngestLedgerEntry of every loaded file
+        """
+        self.create_ingest_ledger_table()
+        rows = self.execute_select(select_sql_query="""SELECT path, size, mtime, content_hash, 
+        rows_inserted, rows_skipped, rows_rejected, load_seconds, byte_offset, prefix_hash 
+        FROM {0};""".format(self.INGEST_LEDGER_TABLE_NAME))
+        return {r[0]: IngestLedgerEntry(*r) for r in rows}
+
+    def record_ingest_ledger_entry(self, entry):
+        """
+        Upserts the ledger record of the file of the entry
+        :param entry: an IngestLedgerEntry
+        :return: None
+        """
+        self.create_ingest_ledger_table()
+        self.execute_prepared('record_ingest_ledger_entry', (entry.path, entry.size, entry.mtime, entry.content_hash,
+                                                             entry.rows_inserted, entry.rows_skipped,
+                                                             entry.rows_rejected, entry.load_seconds,
+                                                             entry.byte_offset, entry.prefix_hash,))
 
     def execute_write(self, write_sql_query, return_generated_id=False):
         """
         Executes the given update/insert/delete query
-        :param persistent_connection: when passed non None, no new connection will be made and it won't be closed
         :param return_generated_id: The function returns the generated id if True is passed which means it's an insert
         :param write_sql_query: the sql query to execute
         :return: None or the generated ID
         """
-        conn = None
-        generated_id = None
-        try:
-            conn = self.create_connection()
-            cursor = conn.cursor()
+        def write(cursor):
             cursor.execute(write_sql_query)
+            number_of_rows[0] = max(cursor.rowcount, 0)
             if return_generated_id:
-                generated_id = cursor.fetchone()[0]
-            conn.commit()
+                return cursor.fetchone()[0]
+            return None
+
+        number_of_rows = [0]
+        query_begin = monotonic()
+        try:
+            generated_id = self.run_with_cursor(write)
+            self.record_query('write', query_begin, number_of_rows[0])
             return generated_id
         except (Exception, PGError) as e:
-            logger('database/handler').error("Write query failed {0}.".format(write_sql_query))
-            logger('database/handler').error("Exception {0}.".format(e))
+            self.record_query_failure('write')
+            logger('database/handler').error("Write query failed {0}.", write_sql_query)
+            logger('database/handler').error("Exception {0}.", e)
             raise DatabaseException('WRITE QUERY /// {0} /// FAILED.'.format(write_sql_query))
-        finally:
-            if conn is not None:
-                cursor.close()
-                conn.close()
 
     def execute_select(self, select_sql_query):
         """
@@ -183,50 +424,198 @@ class DatabaseHandler:
         :param select_sql_query: the sql query to execute
         :return: a list of tuples
         """
-        conn = None
-        try:
-            conn = self.create_connection()
-            cursor = conn.cursor()
+        def select(cursor):
             cursor.execute(select_sql_query)
-            resultsList = []
-            rows = cursor.fetchall()
-            for row in rows:
-                resultsList.append([r for r in row])
-            return resultsList
+            return [[r for r in row] for row in cursor.fetchall()]
+
+        query_begin = monotonic()
+        try:
+            rows = self.run_with_cursor(select)
+            self.record_query('select', query_begin, len(rows))
+            return rows
         except (Exception, PGError) as e:
-            logger('database/handler').error("Select query failed {0}.".format(select_sql_query))
-            logger('database/handler').error("Exception {0}.".format(e))
+            self.record_query_failure('select')
+            logger('database/handler').error("Select query failed {0}.", select_sql_query)
+            logger('database/handler').error("Exception {0}.", e)
             raise DatabaseException('SELECT QUERY /// {0} /// FAILED.'.format(select_sql_query))
-        finally:
-            if conn is not None:
-                cursor.close()
-                conn.close()
-
-    def create_connection(self):
-        return psycopg2.connect(user=self.user,
-                                password=self.password,
-                                host=self.host,
-                                port=self.port,
-                                database=self.database)
-
-    def load_csv_file(self, table_name, file_full_path):
+
+    def copy_select_to_stream(self, select_sql_query, stream, binary=False):
+        """
+        Writes the results of the given select query into the stream in a single COPY, which is much faster
+        than fetching the rows one by one for large results
+        :param select_sql_query: the sql query to execute, without a trailing semicolon
+        :param stream: a seekable writable stream (e.g. io.StringIO, or io.BytesIO if binary is True)
+        :param binary: writes the rows in the binary format of COPY instead of CSV lines
+        :return: None
+        """
+        def copy(cursor):
+            return self.backend.copy_select_to_stream(cursor, select_sql_query, stream, binary)
+
+        query_begin = monotonic()
+        try:
+            self.record_query('copy', query_begin, self.run_with_cursor(copy))
+        except (Exception, PGError) as e:
+            self.record_query_failure('copy')
+            logger('database/handler').error("Copying select query failed {0}.", select_sql_query)
+            logger('database/handler').error("Exception {0}.", e)
+            raise DatabaseException('COPY QUERY /// {0} /// FAILED.'.format(select_sql_query))
+
+    def execute_prepared(self, statement_name, parameters=(), fetch_results=False):
+        """
+        Executes the registered statement with the given parameters bound to its placeholders
+        :param statement_name:
+        :param parameters: a tuple with a value for each placeholder
+        :param fetch_results: returns the selected rows if True
+        :return: a list of lists if fetch_results is True, otherwise None
+        """
+        statement = self.prepared_statements[statement_name]
+
+        def execute(cursor):
+            self.backend.execute_statement(cursor, statement, parameters)
+            number_of_rows[0] = max(cursor.rowcount, 0)
+            if fetch_results:
+                return [[r for r in row] for row in cursor.fetchall()]
+            return None
+
+        number_of_rows = [0]
+        query_begin = monotonic()
         try:
-            with open(file_full_path, 'r') as csv_file:
-                header = csv_file.readline()
-                columns = header.split(EXECUTION_CONFIGS.db_csv_separator)
-                record_line = csv_file.readline()
-                while record_line:
-                    record_values = record_line.split(EXECUTION_CONFIGS.db_csv_separator)
-                    sql_insert_statement = """INSERT INTO {0} ({1}) VALUES ({2});""".format(table_name,
-                                                                                            ",".join(columns),
-                                                                                            ",".join(record_values))
-                    try:
-                        self.execute_write(write_sql_query=sql_insert_statement)
-                    except DatabaseException:
-                        logger('database/handler').error("Error: inserting record from csv file failed.")
-                    record_line = csv_file.readline()
-            return True
+            rows = self.run_with_cursor(execute)
+            self.record_query(statement_name, query_begin, number_of_rows[0])
+            return rows
         except (Exception, PGError) as e:
-            logger('database/handler').error("Loading CSV file failed {0}.".format(file_full_path))
-            logger('database/handler').error("Exception {0}.".format(e))
-            return False
+            self.record_query_failure(statement_name)
+            logger('database/handler').error("Prepared statement {0} failed with {1}.", statement_name, parameters)
+            logger('database/handler').error("Exception {0}.", e)
+            raise DatabaseException('PREPARED STATEMENT /// {0} /// FAILED.'.format(statement_name))
+
+    def execute_prepared_many(self, statement_name, list_of_parameters, page_size=1000):
+        """
+        Executes the registered statement once for each tuple of parameters, sending page_size executions
+        to the database in one round trip
+        :param statement_name:
+        :param list_of_parameters: a list of tuples with a value for each placeholder
+        :param page_size:
+        :return: None
+        """
+        statement = self.prepared_statements[statement_name]
+
+        def execute(cursor):
+            self.backend.execute_statement_many(cursor, statement, list_of_parameters, page_size)
+
+        query_begin = monotonic()
+        try:
+            self.run_with_cursor(execute)
+            self.record_query(statement_name, query_begin, len(list_of_parameters))
+        except (Exception, PGError) as e:
+            self.record_query_failure(statement_name)
+            logger('database/handler').error("Prepared statement {0} failed for {1} executions.",
+                                              statement_name, len(list_of_parameters))
+            logger('database/handler').error("Exception {0}.", e)
+            raise DatabaseException('PREPARED STATEMENT /// {0} /// FAILED.'.format(statement_name))
+
+    def record_query(self, statement, query_begin, number_of_rows):
+        """
+        :param statement: the name of a prepared statement, or the kind of an ad hoc query
+        :param query_begin: the monotonic time the query began
+        :param number_of_rows: the rows the query selected, wrote or copied
+        :return: None
+        """
+        DB_QUERY_DURATION.labels(self.database, statement).observe(monotonic() - query_begin)
+        DB_QUERY_ROWS.labels(self.database, statement).inc(number_of_rows)
+
+    def record_query_failure(self, statement):
+        DB_QUERY_FAILURES.labels(self.database, statement).inc()
+
+    def supports_copy_select_to_stream(self):
+        return self.backend.supports_copy_select_to_stream
+
+    def run_with_cursor(self, operation):
+        """
+        Calls the given function with a cursor of the backend and returns its result.
+        Outside of a transaction the work is committed right away.
+        :param operation: a function that takes a cursor
+        :return: the return value of operation
+        """
+        return self.backend.run_with_cursor(operation)
+
+    def transaction(self):
+        """
+        Runs all queries that this thread executes through the handler inside the with block in a single
+        transaction, which is committed at the end of the block or rolled back if the block raises.
+        Nested transactions join the outer one.
+        :return: a context manager that gives the connection of the transaction
+        """
+        return self.backend.transaction()
+
+    def get_connection_pool_statistics(self):
+        return self.backend.get_statistics()
+
+    def close(self):
+        """
+        Closes the connections of the handler
+        :return: None
+        """
+        self.backend.close()
+
+    def load_csv_file(self, table_name, file_full_path, begin_offset=None):
+        """
+        Loads the records of the given CSV file into the table. The first line of the file names the columns
+        and the values are written as SQL literals (strings in single quotes). Records with the wrong number of
+        fields are rejected and counted, but a value that the table does not accept fails the whole file, which
+        is then not recorded as loaded.
+        :param table_name:
+        :param file_full_path:
+        :param begin_offset: if given, only the complete lines from this byte offset on are loaded, and the end
+                             of the last of them is set as the end offset of the report
+        :return: a CsvLoadReport
+        """
+        report = CsvLoadReport(table_name, file_full_path)
+        separator = EXECUTION_CONFIGS.db_csv_separator
+        try:
+            if begin_offset is None:
+                with open(file_full_path, 'r') as csv_file:
+                    header = csv_file.readline()
+                    columns = [c.strip() for c in header.split(separator)]
+                    self.copy_csv_into_table(table_name, columns, CsvCopyStream(csv_file, len(columns), separator),
+                                             report)
+            else:
+                with open(file_full_path, 'rb') as csv_file:
+                    header = csv_file.readline()
+                    if not header.endswith(b'\n'):
+                        # not even the header is complete yet
+                        report.end_offset = 0
+                        report.success = True
+                        return report
+                    csv_file.seek(max(begin_offset, len(header)))
+                    appended_data = csv_file.read()
+                complete_data_length = appended_data.rfind(b'\n') + 1
+                report.end_offset = max(begin_offset, len(header)) + complete_data_length
+                if complete_data_length == 0:
+                    report.success = True
+                    return report
+                columns = [c.strip() for c in header.decode('utf-8').split(separator)]
+                lines = appended_data[:complete_data_length].decode('utf-8').splitlines(True)
+                self.copy_csv_into_table(table_name, columns, CsvCopyStream(lines, len(columns), separator),
+                                         report)
+        except (Exception, PGError) as e:
+            logger('database/handler').error("Loading CSV file failed {0}.", file_full_path)
+            logger('database/handler').error("Exception {0}.", e)
+        return report
+
+    def copy_csv_into_table(self, table_name, columns, csv_stream, report):
+        """
+        Loads the records into the table in one transaction, which the PostgreSQL backend does with COPY into a
+        temporary staging table. Records that collide with existing rows are skipped.
+        :param table_name:
+        :param columns: the column names of the records in the stream
+        :param csv_stream: a CsvCopyStream
+        :param report: the CsvLoadReport that is filled in
+        :return: None
+        """
+        query_begin = monotonic()
+        report.rows_inserted = self.backend.copy_csv_into_table(table_name, columns, csv_stream)
+        report.rows_skipped = csv_stream.rows_accepted - report.rows_inserted
+        report.rows_rejected = csv_stream.rows_rejected
+        report.success = True
+        self.record_query('load_csv', query_begin, csv_stream.rows_accepted)
@@ -0,0 +1,274 @@
+import fcntl
+import json
+import os
+from time import monotonic
+
+import numpy as np
+
+from utility.datetime_helpers import datetime_string_to_timestamp
+from utility.log import logger
+
+# Readers refuse snapshots of another layout
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = 'manifest.json'
+LOCK_FILE_NAME = '.lock'
+
+# The tables in a snapshot and the (name, dtype) of their columns. The rows are sorted by the first column,
+# the epoch seconds of the moment of the row, and every column is a file of raw little endian values.
+SNAPSHOT_TABLES = {
+    'blocks': [('moment', '<i8'), ('id', '<i8'), ('pool_id', '<i8')],
+    'slushpool': [('moment', '<i8'), ('hash_rate', '<f8'), ('scoring_hash_rate', '<f8')],
+    'network_data': [('moment', '<i8'), ('network_hash', '<f8'), ('difficulty', '<f8')],
+}
+
+
+class HistorySnapshotException(Exception):
+    pass
+
+
+class SnapshotTable:
+    """
+    The columns of a table of a snapshot, as read-only arrays mapped from their files
+    """
+
+    def __init__(self, name, columns):
+        """
+        :param name:
+        :param columns: a map from column name to its array
+        """
+        self.name = name
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['moment'])
+
+    def __getitem__(self, column_name):
+        return self.columns[column_name]
+
+    def get_rows_between(self, begin_timestamp, end_timestamp):
+        """
+        :return: a map from column name to the values of the rows whose moment is between the timestamps,
+                 as views of the mapped arrays
+        """
+        moments = self.columns['moment']
+        low = np.searchsorted(moments, begin_timestamp, side='left')
+        high = np.searchsorted(moments, end_timestamp, side='right')
+        return {name: values[low:high] for name, values in self.columns.items()}
+
+
+class HistorySnapshot:
+    """
+    A version of the block, pool hash rate and network history, mapped into memory. The pages of the files
+    are shared by all processes that map them, and only the pages that are read are loaded.
+    """
+
+    def __init__(self, directory, version, updated_at, tables):
+        self.directory = directory
+        self.version = version
+        self.updated_at = updated_at
+        # A map from table name to its SnapshotTable
+        self.tables = tables
+
+    def get_table(self, table_name):
+        return self.tables[table_name]
+
+    def get_blocks_of_pool(self, pool_id):
+        """
+        :return: a tuple (ids, moments) of the blocks of the pool, sorted by moment, with the moments as
+                 float64 epoch seconds
+        """
+        blocks = self.tables['blocks']
+        of_pool = blocks['pool_id'] == pool_id
+        return blocks['id'][of_pool], blocks['moment'][of_pool].astype(np.float64)
+
+
+def read_manifest(directory):
+    """
+    :return: the manifest of the snapshot in the directory, or None if there is no snapshot
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+    if manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        raise HistorySnapshotException("The snapshot in {0} has the format version {1}, expected {2}.".format(
+            directory, manifest.get('format_version'), SNAPSHOT_FORMAT_VERSION))
+    return manifest
+
+
+def write_manifest(directory, manifest):
+    """
+    Replaces the manifest at once, so that a reader sees either the previous version or this one
+    :return: None
+    """
+    manifest_file_path = os.path.join(directory, MANIFEST_FILE_NAME)
+    temporary_file_path = "{0}.tmp".format(manifest_file_path)
+    with open(temporary_file_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    os.replace(temporary_file_path, manifest_file_path)
+
+
+def map_column(directory, column_manifest, number_of_rows):
+    dtype = np.dtype(column_manifest['dtype'])
+    file_path = os.path.join(directory, column_manifest['file'])
+    if os.path.getsize(file_path) < number_of_rows * dtype.itemsize:
+        raise HistorySnapshotException("{0} is shorter than its {1} rows.".format(file_path, number_of_rows))
+    if number_of_rows == 0:
+        # an empty file cannot be mapped
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', shape=(number_of_rows,))
+
+
+def load_history_snapshot(directory):
+    """
+    Maps the latest version of the snapshot in the directory without reading it. The files of a version are
+    only ever appended to, so the arrays stay valid while the snapshot is refreshed.
+    :param directory:
+    :return: a HistorySnapshot, or None if there is no snapshot in the directory
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        manifest = read_manifest(directory)
+        if manifest is None:
+            return None
+        try:
+            tables = {}
+            for table_name, table_manifest in manifest['tables'].items():
+                tables[table_name] = SnapshotTable(table_name, {
+                    c['name']: map_column(directory, c, table_manifest['rows']) for c in table_manifest['columns']})
+            return HistorySnapshot(directory, manifest['version'], manifest['updated_at'], tables)
+        except FileNotFoundError:
+            # a table was written again to new files after the manifest was read
+            if attempt > 1:
+                raise
+
+
+class HistorySnapshotWriter:
+    """
+    Exports the history tables of a MineDatabaseHandler into a snapshot and keeps it up to date. Each refresh
+    that finds new rows makes a new version of the snapshot.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def refresh(self, handler):
+        """
+        Appends the rows that were stored after the latest moment of each table to its files. If rows were
+        stored before that moment, the table is written again to new files.
+        :param handler: the MineDatabaseHandler
+        :return: the version of the snapshot
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE_NAME), 'w') as lock_file:
+            # one writer at a time, e.g. when several processes share the snapshot
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return self.refresh_locked(handler)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh_locked(self, handler):
+        refresh_begin = monotonic()
+        manifest = read_manifest(self.directory)
+        if manifest is None:
+            manifest = {'format_version': SNAPSHOT_FORMAT_VERSION, 'version': 0, 'updated_at': None, 'tables': {}}
+        changed_tables = []
+        for table_name, columns in sorted(SNAPSHOT_TABLES.items()):
+            table_manifest = manifest['tables'].get(table_name)
+            if table_manifest is not None and self.count_rows_until(
+                    handler, table_name, table_manifest['latest_moment']) == table_manifest['rows']:
+                rows = self.select_rows(handler, table_name, columns, after_moment=table_manifest['latest_moment'])
+                if len(rows[0]) == 0:
+                    continue
+                self.append_rows(table_manifest, rows)
+            else:
+                generation = 1 if table_manifest is None else table_manifest['generation'] + 1
+                table_manifest = self.write_table(table_name, columns, generation,
+                                                  self.select_rows(handler, table_name, columns))
+                manifest['tables'][table_name] = table_manifest
+            changed_tables.append(table_name)
+        if len(changed_tables) != 0:
+            manifest['version'] += 1
+            manifest['updated_at'] = datetime_string_to_timestamp(datetime_string=None)
+            write_manifest(self.directory, manifest)
+            self.remove_unreferenced_files(manifest)
+            logger('database/history-snapshot').info("Refreshed {0} of the history snapshot to version {1} in {2:.3f}"
+                                                     " seconds.", ", ".join(changed_tables), manifest['version'],
+                                                     monotonic() - refresh_begin)
+        return manifest['version']
+
+    @staticmethod
+    def count_rows_until(handler, table_name, latest_moment):
+        if latest_moment is None:
+            return 0
+        return handler.execute_select(select_sql_query="""SELECT count(*) FROM {0} WHERE moment <= {1};""".format(
+            table_name, handler.timestamp_sql(repr(float(latest_moment)))))[0][0]
+
+    @staticmethod
+    def select_rows(handler, table_name, columns, after_moment=None):
+        """
+        :return: a list of arrays, one for each column, of the rows after the moment sorted by moment
+        """
+        selected_columns = [handler.epoch_seconds_sql('moment')] + [name for name, _ in columns[1:]]
+        rows = handler.execute_select(select_sql_query="""SELECT {0} FROM {1} {2} ORDER BY {3};""".format(
+            ", ".join(selected_columns), table_name,
+            "" if after_moment is None else "WHERE moment > {0}".format(
+                handler.timestamp_sql(repr(float(after_moment)))),
+            ", ".join(name for name, _ in columns)))
+        values = []
+        for i, (_, dtype) in enumerate(columns):
+            column_values = np.array([r[i] for r in rows], dtype=np.float64)
+            if np.dtype(dtype).kind == 'i':
+                column_values = np.rint(column_values)
+            values.append(column_values.astype(dtype))
+        return values
+
+    def write_table(self, table_name, columns, generation, rows):
+        """
+        Writes the rows into new files of the given generation of the table
+        :return: the manifest of the table
+        """
+        column_manifests = []
+        for (name, dtype), values in zip(columns, rows):
+            file_name = "{0}.g{1}.{2}.{3}".format(table_name, generation, name, np.dtype(dtype).str[1:])
+            with open(os.path.join(self.directory, file_name), 'wb') as column_file:
+                column_file.write(values.tobytes())
+                column_file.flush()
+                os.fsync(column_file.fileno())
+            column_manifests.append({'name': name, 'dtype': dtype, 'file': file_name})
+        return {'generation': generation, 'rows': len(rows[0]),
+                'latest_moment': int(rows[0][-1]) if len(rows[0]) != 0 else None, 'columns': column_manifests}
+
+    def append_rows(self, table_manifest, rows):
+        """
+        Appends the rows to the files of the table and updates its manifest
+        :return: None
+        """
+        for column_manifest, values in zip(table_manifest['columns'], rows):
+            file_path = os.path.join(self.directory, column_manifest['file'])
+            with open(file_path, 'r+b') as column_file:
+                # drop what an interrupted refresh appended after the rows of the manifest
+                column_file.truncate(table_manifest['rows'] * values.itemsize)
+                column_file.seek(0, os.SEEK_END)
+                column_file.write(values.tobytes())
+                column_file.flush()
+                os.fsync(column_file.fileno())
+        table_manifest['rows'] += len(rows[0])
+        table_manifest['latest_moment'] = int(rows[0][-1])
+
+    def remove_unreferenced_files(self, manifest):
+        """
+        Removes the files of the previous generations of the tables. Processes that mapped them keep their
+        arrays until they let go of them.
+        :return: None
+        """
+        referenced_file_names = set(c['file'] for t in manifest['tables'].values() for c in t['columns'])
+        for table_name in SNAPSHOT_TABLES:
+            for file_name in os.listdir(self.directory):
+                if file_name.startswith("{0}.g".format(table_name)) and file_name not in referenced_file_names:
+                    os.remove(os.path.join(self.directory, file_name))
@@ -0,0 +1,69 @@
+import hashlib
+import os
+
+CONTENT_HASH_CHUNK_SIZE = 1024 * 1024
+# The number of leading bytes of a tailed file that tell whether it was rotated
+PREFIX_HASH_LENGTH = 64 * 1024
+
+
+class IngestLedgerEntry:
+    """
+    What the database knows about a data file it loaded
+    """
+
+    def __init__(self, path, size, mtime, content_hash, rows_inserted=None, rows_skipped=None, rows_rejected=None,
+                 load_seconds=None, byte_offset=None, prefix_hash=None):
+        """
+        :param path: the path of the file as it was found in the data directory
+        :param size: bytes
+        :param mtime: the modification time of the file in epoch seconds
+        :param content_hash: the SHA-256 of the content of the file in hex, or None for a tailed file
+        :param rows_inserted: None if not known (e.g. for files loaded before the ledger existed)
+        :param rows_skipped:
+        :param rows_rejected:
+        :param load_seconds: how long loading the file took
+        :param byte_offset: for a tailed file, the offset right after the last complete line that was loaded
+        :param prefix_hash: for a tailed file, the SHA-256 of its first min(byte_offset, PREFIX_HASH_LENGTH) bytes
+        """
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.content_hash = content_hash
+        self.rows_inserted = rows_inserted
+        self.rows_skipped = rows_skipped
+        self.rows_rejected = rows_rejected
+        self.load_seconds = load_seconds
+        self.byte_offset = byte_offset
+        self.prefix_hash = prefix_hash
+
+    def has_same_state(self, size, mtime):
+        return self.size == size and self.mtime == mtime
+
+
+def read_file_state(path):
+    """
+    :return: a tuple (size, mtime) of the file
+    """
+    file_stat = os.stat(path)
+    return file_stat.st_size, file_stat.st_mtime
+
+
+def calculate_content_hash(path):
+    """
+    :return: the SHA-256 of the content of the file in hex
+    """
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as data_file:
+        chunk = data_file.read(CONTENT_HASH_CHUNK_SIZE)
+        while len(chunk) != 0:
+            content_hash.update(chunk)
+            chunk = data_file.read(CONTENT_HASH_CHUNK_SIZE)
+    return content_hash.hexdigest()
+
+
+def calculate_prefix_hash(path, byte_offset):
+    """
+    :return: the SHA-256 of the first min(byte_offset, PREFIX_HASH_LENGTH) bytes of the file in hex
+    """
+    with open(path, 'rb') as data_file:
+        return hashlib.sha256(data_file.read(min(byte_offset, PREFIX_HASH_LENGTH))).hexdigest()
@@ -1,7 +1,15 @@
-from clock.clock import calculate_tick_duration_from_sleep_duration
+from threading import Lock
+from time import monotonic
+
+import numpy as np
+
 from configuration import EXECUTION_CONFIGS
-from configuration.constants import SLUSHPOOL_ID
+from configuration.constants import SLUSHPOOL_ID, SLUSHPOOL_NAME, SLUSHPOOL_EXPORT_FILE_FORMAT
+from data_bank.block_cache import BlockHistoryCache
 from data_bank.database import DatabaseHandler, DatabaseUpdater
+from data_bank.history_snapshot import HistorySnapshotWriter, load_history_snapshot
+from data_bank.ingest_ledger import read_file_state, calculate_content_hash
+from data_bank.slushpool_export import import_slushpool_export
 from utility.datetime_helpers import datetime_string_to_timestamp
 from utility.log import logger
 
@@ -9,12 +17,21 @@ from utility.log import logger
 class MineDatabaseUpdater(DatabaseUpdater):
     def __init__(self, handler):
         super().__init__(handler)
+        self.history_snapshot_writer = None
+        if EXECUTION_CONFIGS.db_history_snapshot_dir is not None:
+            self.history_snapshot_writer = HistorySnapshotWriter(EXECUTION_CONFIGS.db_history_snapshot_dir)
+        # the snapshot is brought up to date with what is in the database on the first tick
+        self.history_snapshot_stale = True
 
     def get_db_csv_name_suffix(self):
         return "mine"
 
-    def get_tick_duration(self):
-        return calculate_tick_duration_from_sleep_duration(EXECUTION_CONFIGS.mine_db_updater_sleep_duration)
+    def get_sleep_duration(self):
+        return EXECUTION_CONFIGS.mine_db_updater_sleep_duration
+
+    def on_new_data_loaded(self):
+        self.handler.refresh_block_caches()
+        self.history_snapshot_stale = True
 
     def update_data(self, up_to_timestamp):
         """
@@ -22,8 +39,36 @@ class MineDatabaseUpdater(DatabaseUpdater):
         :return: None
         """
         super().update_data(up_to_timestamp)
+        new_export_files = self.check_new_data_files_to_load(file_format=SLUSHPOOL_EXPORT_FILE_FORMAT)
+        if len(new_export_files) != 0:
+            self.load_new_slushpool_export_files(new_export_files)
+        if self.history_snapshot_writer is not None and self.history_snapshot_stale:
+            self.refresh_history_snapshot()
         # TODO logic needed to update the mine database
-        logger('mine-database').debug("Updating data up to timestamp {0}.".format(up_to_timestamp))
+        logger('mine-database').debug("Updating data up to timestamp {0}.", up_to_timestamp)
+
+    def refresh_history_snapshot(self):
+        try:
+            self.history_snapshot_writer.refresh(self.handler)
+            self.history_snapshot_stale = False
+        except Exception as e:
+            logger('mine-database').error("Refreshing the history snapshot in {0} failed: {1}.",
+                                          self.history_snapshot_writer.directory, e)
+
+    def load_new_slushpool_export_files(self, new_files_to_load):
+        for file_name in new_files_to_load:
+            size, mtime = read_file_state(file_name)
+            content_hash = calculate_content_hash(file_name)
+            load_begin = monotonic()
+            reports = import_slushpool_export(self.handler, file_name)
+            if all(r.success for r in reports):
+                self.record_loaded_file(file_name, size, mtime, content_hash, reports, monotonic() - load_begin)
+                self.on_new_data_loaded()
+                for report in reports:
+                    logger('mine-database').info("Pool export was loaded into the database: {0}.", report)
+            else:
+                logger('mine-database').error("Pool export could not be loaded: {0}.",
+                                              ", ".join(str(r) for r in reports))
 
 
 class MineDatabaseHandler(DatabaseHandler):
@@ -32,12 +77,90 @@ class MineDatabaseHandler(DatabaseHandler):
     NETWORK_DATA_TABLE_NAME = 'network_data'
     POOLS_TABLE_NAME = 'pools'
     SLUSHPOOL_TABLE_NAME = 'slushpool'
+    # The tables of vagrant/ansible/init_postgresql.sql
+    SQLITE_SCHEMA = DatabaseHandler.SQLITE_SCHEMA + [
+        """CREATE TABLE IF NOT EXISTS pools (id INTEGER PRIMARY KEY, name character(40) NOT NULL UNIQUE);""",
+        """INSERT OR IGNORE INTO pools (id, name) VALUES ({0}, '{1}');""".format(SLUSHPOOL_ID, SLUSHPOOL_NAME),
+        """CREATE TABLE IF NOT EXISTS slushpool (moment timestamptz PRIMARY KEY, 
+        hash_rate DOUBLE PRECISION NOT NULL, scoring_hash_rate DOUBLE PRECISION NOT NULL);""",
+        """CREATE TABLE IF NOT EXISTS network_data (moment timestamptz PRIMARY KEY, 
+        network_hash DOUBLE PRECISION NOT NULL, difficulty DOUBLE PRECISION NOT NULL);""",
+        """CREATE TABLE IF NOT EXISTS blocks (id INTEGER PRIMARY KEY, moment timestamptz NOT NULL, 
+        pool_id INTEGER NOT NULL, CONSTRAINT fk_pool_id FOREIGN KEY(pool_id) REFERENCES pools(id));""",
+        """CREATE INDEX IF NOT EXISTS blocks_range_query_index ON blocks (pool_id, moment);""",
+    ]
 
     def __init__(self, user, password, database="smart_miner", host="127.0.0.1", port="5432"):
         """
         A singleton class that is the interface of our data bank database
         """
         super().__init__(user, password, database, host, port)
+        # A map from pool id to the cache of its blocks
+        self.block_caches = {}
+        self.block_caches_mutex = Lock()
+        # LIMIT NULL does not limit the number of rows, and neither does a negative limit of SQLite
+        for order in ('ASC', 'DESC',):
+            self.register_statement('blocks_between_{0}'.format(order.lower()), """SELECT id,moment FROM {0} 
+            WHERE moment BETWEEN {1} AND {2} AND pool_id = $3
+            ORDER BY moment {3}
+            LIMIT {4};""".format(self.BLOCKS_TABLE_NAME, self.timestamp_sql("$1"), self.timestamp_sql("$2"), order,
+                                  self.sql_for_dialect("$4", sqlite_sql="coalesce($4, -1)")))
+        self.register_statement('latest_block_prior_to', """SELECT id, moment FROM {0} 
+        WHERE pool_id = $1 AND moment <= {1} 
+        ORDER BY moment DESC
+        LIMIT 1;""".format(self.BLOCKS_TABLE_NAME, self.timestamp_sql("$2")))
+        self.register_statement('first_block_after', """SELECT id, moment FROM {0} 
+        WHERE pool_id = $1 AND moment >= {1} 
+        ORDER BY moment ASC
+        LIMIT 1;""".format(self.BLOCKS_TABLE_NAME, self.timestamp_sql("$2")))
+        self.register_statement('latest_pool_hash_rate_prior_to', """SELECT hash_rate FROM {0} 
+        WHERE moment <= {1} 
+        ORDER BY moment DESC
+        LIMIT 1;""".format(self.SLUSHPOOL_TABLE_NAME, self.timestamp_sql("$1")))
+        self.register_statement('latest_difficulty_prior_to', """SELECT difficulty FROM {0} 
+        WHERE moment <= {1} 
+        ORDER BY moment DESC
+        LIMIT 1;""".format(self.NETWORK_DATA_TABLE_NAME, self.timestamp_sql("$1")))
+
+    def get_block_cache(self, pool_id):
+        """
+        :return: the cache of the blocks of the given pool, or None if caching is disabled
+        """
+        if not EXECUTION_CONFIGS.db_block_cache_enabled:
+            return None
+        self.block_caches_mutex.acquire()
+        try:
+            if pool_id not in self.block_caches:
+                self.block_caches[pool_id] = BlockHistoryCache(self, pool_id,
+                                                               max_blocks=EXECUTION_CONFIGS.db_block_cache_max_blocks)
+            return self.block_caches[pool_id]
+        finally:
+            self.block_caches_mutex.release()
+
+    def get_history_snapshot(self):
+        """
+        :return: the latest version of the history snapshot, or None if there is none
+        """
+        if EXECUTION_CONFIGS.db_history_snapshot_dir is None:
+            return None
+        try:
+            return load_history_snapshot(EXECUTION_CONFIGS.db_history_snapshot_dir)
+        except Exception as e:
+            logger('mine-database').warning("The history snapshot in {0} cannot be loaded: {1}.",
+                                            EXECUTION_CONFIGS.db_history_snapshot_dir, e)
+            return None
+
+    def refresh_block_caches(self):
+        """
+        Brings the block caches up to date with the database after new blocks were stored
+        :return: None
+        """
+        for cache in list(self.block_caches.values()):
+            cache.extend()
+
+    def invalidate_block_caches(self):
+        for cache in list(self.block_caches.values()):
+            cache.invalidate()
 
     def get_latest_block_info(self, pool_id=SLUSHPOOL_ID,
                               prior_to_moment=None,
@@ -56,23 +179,33 @@ class MineDatabaseHandler(DatabaseHandler):
                 prior_to_moment = 0
             else:
                 prior_to_moment = datetime_string_to_timestamp(datetime_string=None)
-        sql_query = None
-        if return_first_block_info:
-            sql_query = """SELECT id, moment FROM {0} 
-            WHERE pool_id = {1} AND moment >= to_timestamp({2}) 
-            ORDER BY moment ASC
-            LIMIT 1;""".format(self.BLOCKS_TABLE_NAME, pool_id, prior_to_moment)
-        else:
-            sql_query = """SELECT id, moment FROM {0} 
-            WHERE pool_id = {1} AND moment <= to_timestamp({2}) 
-            ORDER BY moment DESC
-            LIMIT 1;""".format(self.BLOCKS_TABLE_NAME, pool_id, prior_to_moment)
-        ids = self.execute_select(select_sql_query=sql_query)
+        block_cache = self.get_block_cache(pool_id)
+        if block_cache is not None:
+            found, block_info = block_cache.get_latest_block_info(prior_to_moment,
+                                                                  return_first_block_info=return_first_block_info)
+            if found:
+                return block_info
+        statement_name = 'first_block_after' if return_first_block_info else 'latest_block_prior_to'
+        ids = self.execute_prepared(statement_name, (pool_id, prior_to_moment,), fetch_results=True)
         if len(ids) == 0:
             return None
         return ids[0][0], ids[0][1]
 
-    def get_blocks_between(self, begin_timestamp=0, end_timestamp=datetime_string_to_timestamp(datetime_string=None),
+    def get_latest_pool_hash_rate_and_difficulty(self, prior_to_moment=None):
+        """
+        Returns the latest hash rate of the pool and difficulty of the network prior to the given timestamp
+        :param prior_to_moment: defaults to the timestamp of now
+        :return: a tuple (hash_rate, difficulty), or None if either of them has no record prior to the moment
+        """
+        if prior_to_moment is None:
+            prior_to_moment = datetime_string_to_timestamp(datetime_string=None)
+        hash_rates = self.execute_prepared('latest_pool_hash_rate_prior_to', (prior_to_moment,), fetch_results=True)
+        difficulties = self.execute_prepared('latest_difficulty_prior_to', (prior_to_moment,), fetch_results=True)
+        if len(hash_rates) == 0 or len(difficulties) == 0:
+            return None
+        return hash_rates[0][0], difficulties[0][0]
+
+    def get_blocks_between(self, begin_timestamp=0, end_timestamp=None,
                            pool_id=SLUSHPOOL_ID, sort_old_to_new=True, number_of_blocks=None):
         """
         Returns a list of blocks in the given pool in the database whose moment is between the given timestamps
@@ -80,14 +213,35 @@ class MineDatabaseHandler(DatabaseHandler):
         :param sort_old_to_new: results are sorted by moment in ascending order if True, and descending if False
         :param pool_id:
         :param begin_timestamp:
-        :param end_timestamp:
+        :param end_timestamp: defaults to the timestamp of now
         :return: A list of tuples of the form (id, moment) where id is the block id and moment is its timestamp
         """
-        sql_query = """SELECT id,moment FROM {0} 
-        WHERE moment BETWEEN to_timestamp({1}) AND to_timestamp({2}) AND pool_id = {3}
-        ORDER BY moment {4} {5};""".format(self.BLOCKS_TABLE_NAME,
-                                           begin_timestamp, end_timestamp,
-                                           pool_id, "ASC" if sort_old_to_new else "DESC",
-                                           "" if number_of_blocks is None else "LIMIT {0}".format(number_of_blocks))
-        blocks = self.execute_select(select_sql_query=sql_query)
+        if end_timestamp is None:
+            end_timestamp = datetime_string_to_timestamp(datetime_string=None)
+        block_cache = self.get_block_cache(pool_id)
+        if block_cache is not None:
+            blocks = block_cache.get_blocks_between(begin_timestamp, end_timestamp, sort_old_to_new=sort_old_to_new,
+                                                    number_of_blocks=number_of_blocks)
+            if blocks is not None:
+                return blocks
+        statement_name = 'blocks_between_asc' if sort_old_to_new else 'blocks_between_desc'
+        blocks = self.execute_prepared(statement_name, (begin_timestamp, end_timestamp, pool_id, number_of_blocks,),
+                                       fetch_results=True)
         return [(b[0], b[1],) for b in blocks]
+
+    def get_block_moments_between(self, begin_timestamp, end_timestamp, pool_id=SLUSHPOOL_ID):
+        """
+        Returns the moments of the blocks of the given pool between the given timestamps
+        :param begin_timestamp:
+        :param end_timestamp:
+        :param pool_id:
+        :return: a sorted array of epoch seconds that must not be modified
+        """
+        block_cache = self.get_block_cache(pool_id)
+        if block_cache is not None:
+            moments = block_cache.get_block_moments_between(begin_timestamp, end_timestamp)
+            if moments is not None:
+                return moments
+        blocks = self.get_blocks_between(begin_timestamp=begin_timestamp, end_timestamp=end_timestamp,
+                                         pool_id=pool_id, sort_old_to_new=True)
+        return np.array([moment.timestamp() for _, moment in blocks], dtype=np.float64)
@@ -0,0 +1,47 @@
+import re
+
+import psycopg2.extensions
+
+PARAMETER_PATTERN = re.compile(r'\$(\d+)')
+
+
+class PreparedStatement:
+    """
+    A statement that is prepared once on each connection (PREPARE) and then only executed with bound
+    parameters (EXECUTE), so the database does not parse and plan it again on every call
+    """
+
+    def __init__(self, name, sql):
+        """
+        :param name: a unique name that is a valid SQL identifier
+        :param sql: the statement with $1, $2, ... as parameter placeholders
+        """
+        self.name = name
+        self.sql = sql
+        self.number_of_parameters = max([int(n) for n in PARAMETER_PATTERN.findall(sql)] + [0])
+        self.prepare_sql = "PREPARE {0} AS {1}".format(name, sql.rstrip().rstrip(';'))
+        if self.number_of_parameters == 0:
+            self.execute_sql = "EXECUTE {0};".format(name)
+        else:
+            self.execute_sql = "EXECUTE {0} ({1});".format(name, ", ".join(["%s"] * self.number_of_parameters))
+
+    def prepare_on(self, cursor):
+        """
+        Prepares the statement on the connection of the cursor unless it is already prepared there
+        :return: None
+        """
+        connection = cursor.connection
+        if self.name in connection.prepared_statement_names:
+            return
+        cursor.execute(self.prepare_sql)
+        connection.prepared_statement_names.add(self.name)
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    A connection that remembers which statements are prepared on it
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statement_names = set()
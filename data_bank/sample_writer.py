@@ -0,0 +1,181 @@
+from queue import Queue, Empty, Full
+from threading import Thread, Event, Lock
+from time import monotonic
+
+from utility.log import logger
+
+
+class SampleWriterException(Exception):
+    pass
+
+
+class BatchedSampleWriter:
+    """
+    Collects order info samples in memory and writes them into a simulation table from a background thread,
+    as one multi-row insert per batch. A batch is written when it is full or when its oldest sample
+    has waited for flush_interval seconds. Each batch executes a prepared insert statement for all of its samples
+    in one round trip.
+    """
+
+    class FlushRequest:
+        def __init__(self, stop_after_flush=False):
+            self.stop_after_flush = stop_after_flush
+            # the samples whose batches failed since the previous flush, set before done
+            self.number_of_failures = 0
+            self.done = Event()
+
+    def __init__(self, handler, table_name, statement_name, batch_size, flush_interval, max_queued_samples):
+        """
+        :param handler: the database handler used for writing
+        :param table_name: the simulation table that receives the samples
+        :param statement_name: the registered statement of the handler that inserts one sample
+        :param batch_size: maximum number of samples written by one insert
+        :param flush_interval: maximum number of seconds a sample waits in memory
+        :param max_queued_samples: adding a sample blocks while this many samples are waiting
+        """
+        self.handler = handler
+        self.table_name = table_name
+        self.statement_name = statement_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = Queue(maxsize=max_queued_samples)
+        self.closed = False
+        # no sample is queued after the request to stop, which the background thread would not read
+        self.closed_mutex = Lock()
+        self.statistics_mutex = Lock()
+        self.samples_added = 0
+        self.samples_written = 0
+        self.samples_failed = 0
+        self.number_of_flushes = 0
+        self.total_flush_time = 0.0
+        self.max_flush_time = 0.0
+        self.max_queue_depth = 0
+        self.number_of_backpressure_waits = 0
+        # only read and written by the background thread
+        self.failures_since_flush = 0
+        self.thread = Thread(target=self.write_batches, daemon=True)
+        self.thread.start()
+
+    def add(self, order_id, timestamp, limit, price, delivered_hashrate=None):
+        """
+        Queues a sample to be written. Blocks while the queue is full.
+        :return: None
+        """
+        sample = (order_id, timestamp, limit, price, delivered_hashrate,)
+        with self.closed_mutex:
+            if self.closed:
+                raise SampleWriterException("Sample writer of {0} is closed.".format(self.table_name))
+            try:
+                self.queue.put_nowait(sample)
+            except Full:
+                with self.statistics_mutex:
+                    self.number_of_backpressure_waits += 1
+                self.queue.put(sample)
+        queue_depth = self.queue.qsize()
+        with self.statistics_mutex:
+            self.samples_added += 1
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def flush(self):
+        """
+        Blocks until all samples added before the call are written
+        :raise SampleWriterException: if a batch failed since the previous flush, and its samples were not written
+        :return: None
+        """
+        with self.closed_mutex:
+            if self.closed:
+                return
+            flush_request = BatchedSampleWriter.FlushRequest()
+            self.queue.put(flush_request)
+        flush_request.done.wait()
+        self.raise_on_failures(flush_request)
+
+    def close(self):
+        """
+        Writes the remaining samples and stops the background thread. Closing more than once has no effect.
+        :raise SampleWriterException: if a batch failed since the previous flush, and its samples were not written
+        :return: None
+        """
+        with self.closed_mutex:
+            if self.closed:
+                return
+            self.closed = True
+            flush_request = BatchedSampleWriter.FlushRequest(stop_after_flush=True)
+            self.queue.put(flush_request)
+        flush_request.done.wait()
+        self.thread.join()
+        self.raise_on_failures(flush_request)
+
+    def raise_on_failures(self, flush_request):
+        if flush_request.number_of_failures != 0:
+            raise SampleWriterException("{0} samples could not be written into {1}.".format(
+                flush_request.number_of_failures, self.table_name))
+
+    def get_statistics(self):
+        with self.statistics_mutex:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'backpressure_waits': self.number_of_backpressure_waits,
+                'samples_added': self.samples_added,
+                'samples_written': self.samples_written,
+                'samples_failed': self.samples_failed,
+                'flushes': self.number_of_flushes,
+                'total_flush_time': self.total_flush_time,
+                'max_flush_time': self.max_flush_time,
+            }
+
+    def write_batches(self):
+        batch = []
+        batch_deadline = None
+        while True:
+            timeout = None
+            if len(batch) != 0:
+                timeout = max(0.0, batch_deadline - monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                # the oldest sample of the batch waited long enough
+                self.write_batch(batch)
+                batch = []
+                continue
+            if isinstance(item, BatchedSampleWriter.FlushRequest):
+                self.write_batch(batch)
+                batch = []
+                item.number_of_failures = self.failures_since_flush
+                self.failures_since_flush = 0
+                item.done.set()
+                if item.stop_after_flush:
+                    return
+                continue
+            batch.append(item)
+            if len(batch) == 1:
+                batch_deadline = monotonic() + self.flush_interval
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+
+    def write_batch(self, batch):
+        if len(batch) == 0:
+            return
+        flush_begin = monotonic()
+        succeeded = False
+        try:
+            self.handler.execute_prepared_many(self.statement_name, batch, page_size=len(batch))
+            succeeded = True
+        except Exception as e:
+            self.failures_since_flush += len(batch)
+            logger('simulation/db/sample-writer').error(
+                "Writing {0} samples into {1} failed.", len(batch), self.table_name)
+            logger('simulation/db/sample-writer').error("Exception {0}.", e)
+        flush_time = monotonic() - flush_begin
+        with self.statistics_mutex:
+            if succeeded:
+                self.samples_written += len(batch)
+            else:
+                self.samples_failed += len(batch)
+            self.number_of_flushes += 1
+            self.total_flush_time += flush_time
+            self.max_flush_time = max(self.max_flush_time, flush_time)
+        logger('simulation/db/sample-writer').debug(
+            "Wrote {0} samples into {1} in {2:.3f} seconds.", len(batch), self.table_name, flush_time)
@@ -1,6 +1,9 @@
-from clock.clock import calculate_tick_duration_from_sleep_duration
+import json
+
 from configuration import EXECUTION_CONFIGS, is_new_simulation_going_to_happen
 from data_bank.database import DatabaseHandler, DatabaseUpdater
+from data_bank.sample_writer import BatchedSampleWriter, SampleWriterException
+from data_bank.storage_backends import SQLITE
 from utility.log import logger
 
 
@@ -11,8 +14,8 @@ class SimulationDatabaseUpdater(DatabaseUpdater):
     def get_db_csv_name_suffix(self):
         return "simulation"
 
-    def get_tick_duration(self):
-        return calculate_tick_duration_from_sleep_duration(EXECUTION_CONFIGS.simulation_db_updater_sleep_duration)
+    def get_sleep_duration(self):
+        return EXECUTION_CONFIGS.simulation_db_updater_sleep_duration
 
     def update_data(self, up_to_timestamp):
         """
@@ -21,11 +24,14 @@ class SimulationDatabaseUpdater(DatabaseUpdater):
         """
         super().update_data(up_to_timestamp)
         # TODO logic needed to update the simulation database
-        logger('simulation/db/updater').debug("Updating data up to timestamp {0}.".format(up_to_timestamp))
+        logger('simulation/db/updater').debug("Updating data up to timestamp {0}.", up_to_timestamp)
 
 
 class SimulationDatabaseHandler(DatabaseHandler):
     SIMULATION_DATA_TABLE_NAME_PREFIX = 'simulation_'
+    SIMULATION_PROOFS_TABLE_NAME = 'simulation_proofs'
+    KV_OWNER_KEY = 'simulation_db'
+    LEGACY_PROOFS_IMPORTED_KEY = 'legacy_proof_files_imported'
 
     def __init__(self, user, password, database="smart_miner_simulation_data", host="127.0.0.1", port="5432"):
         """
@@ -33,6 +39,20 @@ class SimulationDatabaseHandler(DatabaseHandler):
         """
         super().__init__(user, password, database, host, port)
         self.current_simulation_table_name = None
+        self.order_info_sample_writer = None
+        self.simulation_proofs_table_exists = False
+        self.register_statement('record_simulation_proof', """INSERT INTO {0} 
+        (identifier, table_name, execution_identifier, begin_moment, end_moment, summary) 
+        VALUES ($1, $2, $3, {1}, {2}, $6)
+        ON CONFLICT (identifier) DO UPDATE SET 
+        table_name = EXCLUDED.table_name, execution_identifier = EXCLUDED.execution_identifier, 
+        begin_moment = EXCLUDED.begin_moment, end_moment = EXCLUDED.end_moment, 
+        proven_at = {3}, summary = EXCLUDED.summary;""".format(self.SIMULATION_PROOFS_TABLE_NAME,
+                                                               self.timestamp_sql("$4"), self.timestamp_sql("$5"),
+                                                               self.current_timestamp_sql()))
+        self.register_statement('import_simulation_proof', """INSERT INTO {0} (identifier, table_name, summary) 
+        VALUES ($1, $2, $3)
+        ON CONFLICT (identifier) DO NOTHING;""".format(self.SIMULATION_PROOFS_TABLE_NAME))
 
     def prepare_for_simulation(self, proven_simulation_identifiers=None):
         """
@@ -49,24 +69,138 @@ class SimulationDatabaseHandler(DatabaseHandler):
             self.set_current_simulation_table_name()
             self.create_simulation_table_for_the_current_simulation()
 
-    def insert_order_info_sample(self, order_id, timestamp, limit, price):
-        sql_statement = """INSERT INTO {0} (order_id, moment, power_limit, price)
-        VALUES ('{1}', to_timestamp({2}), {3}, {4});""".format(self.current_simulation_table_name, order_id, timestamp,
-                                                               limit, price)
-        self.execute_write(write_sql_query=sql_statement)
-        logger('simulation/db/handler').debug("Inserted new data sample for order id {0}.".format(order_id))
+    def insert_order_info_sample(self, order_id, timestamp, limit, price, delivered_hashrate=None):
+        """
+        Queues the sample to be written into the table of the current simulation in the background
+        :param delivered_hashrate: the hashrate the marketplace delivered to the order, or None if it is unknown
+        :return: None
+        """
+        self.get_order_info_sample_writer().add(order_id, timestamp, limit, price,
+                                                delivered_hashrate=delivered_hashrate)
+        logger('simulation/db/handler').debug("Queued new data sample for order id {0}.", order_id)
+
+    def get_order_info_sample_writer(self):
+        if self.order_info_sample_writer is None:
+            statement_name = 'insert_order_info_sample_into_{0}'.format(self.current_simulation_table_name)
+            self.register_statement(statement_name, """INSERT INTO {0} (order_id, moment, power_limit, price, 
+            delivered_hashrate) 
+            VALUES ($1, {1}, $3, $4, $5)
+            ON CONFLICT DO NOTHING;""".format(self.current_simulation_table_name, self.timestamp_sql("$2")))
+            self.order_info_sample_writer = BatchedSampleWriter(
+                self, self.current_simulation_table_name, statement_name,
+                batch_size=EXECUTION_CONFIGS.simulation_sample_writer_batch_size,
+                flush_interval=EXECUTION_CONFIGS.simulation_sample_writer_flush_interval,
+                max_queued_samples=EXECUTION_CONFIGS.simulation_sample_writer_max_queued_samples)
+        return self.order_info_sample_writer
+
+    def flush_order_info_samples(self):
+        """
+        Blocks until all queued samples are written
+        :raise SampleWriterException: if samples could not be written
+        :return: None
+        """
+        if self.order_info_sample_writer is not None:
+            self.order_info_sample_writer.flush()
+
+    def close_order_info_sample_writer(self):
+        """
+        Writes the queued samples and stops the background writer
+        :return: None
+        """
+        if self.order_info_sample_writer is not None:
+            try:
+                self.order_info_sample_writer.close()
+            except SampleWriterException as e:
+                logger('simulation/db/handler').error("Order info sample writer closed with lost samples: {0}", e)
+            logger('simulation/db/handler').info("Order info sample writer closed: {0}.",
+                                                 self.order_info_sample_writer.get_statistics())
+
+    def create_simulation_proofs_table(self):
+        """
+        Creates the registry of proven simulations unless it exists
+        :return: None
+        """
+        if self.simulation_proofs_table_exists:
+            return
+        self.execute_write(write_sql_query="""CREATE TABLE IF NOT EXISTS {0} (
+        identifier character varying(200) PRIMARY KEY, 
+        table_name character varying(250) NOT NULL, 
+        execution_identifier character varying(200), 
+        begin_moment timestamptz, 
+        end_moment timestamptz, 
+        proven_at timestamptz NOT NULL DEFAULT ({1}), 
+        summary {2});""".format(self.SIMULATION_PROOFS_TABLE_NAME, self.current_timestamp_sql(),
+                                self.sql_for_dialect("jsonb", sqlite_sql="TEXT")))
+        self.simulation_proofs_table_exists = True
+
+    def record_simulation_proof(self, simulation_identifier, summary, begin_timestamp=None, end_timestamp=None):
+        """
+        Registers the simulation as proven
+        :param simulation_identifier:
+        :param summary: a dictionary with the evaluation of the simulation
+        :param begin_timestamp: the simulated timestamp the simulation began at
+        :param end_timestamp: the simulated timestamp the simulation ended at
+        :return: None
+        """
+        self.create_simulation_proofs_table()
+        self.execute_prepared('record_simulation_proof', (
+            simulation_identifier,
+            self.generate_table_name_from_simulation_identifier(simulation_identifier=simulation_identifier),
+            EXECUTION_CONFIGS.execution_identifier, begin_timestamp, end_timestamp, json.dumps(summary),))
+
+    def are_legacy_simulation_proofs_imported(self):
+        return self.key_value_get(self.KV_OWNER_KEY, self.LEGACY_PROOFS_IMPORTED_KEY) == 'True'
+
+    def import_legacy_simulation_proofs(self, proofs):
+        """
+        Registers the simulations that were proven by a file before the registry existed. Simulations that are
+        registered already are left alone.
+        :param proofs: a list of (simulation identifier, summary dictionary or None) tuples
+        :return: None
+        """
+        self.create_simulation_proofs_table()
+        with self.transaction():
+            if len(proofs) != 0:
+                self.execute_prepared_many('import_simulation_proof', [
+                    (identifier, self.generate_table_name_from_simulation_identifier(simulation_identifier=identifier),
+                     None if summary is None else json.dumps(summary),) for identifier, summary in proofs])
+            self.key_value_put(self.KV_OWNER_KEY, self.LEGACY_PROOFS_IMPORTED_KEY, 'True')
+        logger('simulation/db/handler').info("Imported {0} simulation proof files.", len(proofs))
+
+    def get_proven_simulation_identifiers(self):
+        """
+        :return: the set of the identifiers of the proven simulations
+        """
+        self.create_simulation_proofs_table()
+        proofs = self.execute_select(select_sql_query="""SELECT identifier FROM {0};""".format(
+            self.SIMULATION_PROOFS_TABLE_NAME))
+        return set(p[0] for p in proofs)
 
     def clean_unproven_simulation_data(self, proven_simulation_identifiers):
+        """
+        Drops the tables of all simulations that are not proven, in a single statement unless the backend
+        drops only one table at a time
+        :param proven_simulation_identifiers: a set of simulation identifiers
+        :return: None
+        """
         tables_to_drop = []
         existing_tables = self.get_list_of_simulation_table_names()
         for table_name in existing_tables:
+            if table_name == self.SIMULATION_PROOFS_TABLE_NAME:
+                continue
             table_simulation_identifier = self.generate_simulation_identifier_from_table_name(table_name=table_name)
             if table_simulation_identifier not in proven_simulation_identifiers:
                 tables_to_drop.append(table_name)
-        for table_name in tables_to_drop:
-            logger('simulation/db/handler').info(
-                "Dropping table {0} because its simulation proof was not found.".format(table_name))
-            self.execute_write(write_sql_query="""DROP TABLE {0};""".format(table_name))
+        if len(tables_to_drop) == 0:
+            return
+        logger('simulation/db/handler').info(
+            "Dropping tables {0} because their simulation proofs were not found.", ", ".join(tables_to_drop))
+        with self.transaction():
+            if self.dialect == SQLITE:
+                for table_name in tables_to_drop:
+                    self.execute_write(write_sql_query="""DROP TABLE IF EXISTS {0};""".format(table_name))
+            else:
+                self.execute_write(write_sql_query="""DROP TABLE IF EXISTS {0};""".format(", ".join(tables_to_drop)))
 
     def set_current_simulation_table_name(self):
         self.current_simulation_table_name = self.generate_table_name_from_simulation_identifier(
@@ -78,21 +212,25 @@ class SimulationDatabaseHandler(DatabaseHandler):
         moment timestamptz NOT NULL, 
         power_limit DOUBLE PRECISION DEFAULT 0.0, 
         price DOUBLE PRECISION DEFAULT 0.0, 
+        delivered_hashrate DOUBLE PRECISION, 
         CONSTRAINT {0}_order_status UNIQUE(order_id, moment));""".format(self.current_simulation_table_name)
         self.execute_write(write_sql_query=sql_statement)
         logger('simulation/db/handler').info(
-            "Created table {0} for the simulation that is starting.".format(self.current_simulation_table_name))
+            "Created table {0} for the simulation that is starting.", self.current_simulation_table_name)
 
     def get_list_of_simulation_table_names(self):
         """
         Returns the list of all existing tables that keep simulation data
         :return: A list of table names
         """
-        sql_query = """SELECT table_name FROM information_schema.tables 
+        sql_query = self.sql_for_dialect("""SELECT table_name FROM information_schema.tables 
         WHERE 
         table_schema = 'public' 
         AND table_catalog = '{0}' 
-        AND table_name LIKE '{1}%';""".format(self.database, self.SIMULATION_DATA_TABLE_NAME_PREFIX)
+        AND table_name LIKE '{1}%';""", sqlite_sql="""SELECT name FROM sqlite_master 
+        WHERE 
+        type = 'table' 
+        AND name LIKE '{1}%';""").format(self.database, self.SIMULATION_DATA_TABLE_NAME_PREFIX)
         existing_tables = self.execute_select(select_sql_query=sql_query)
         return [t[0] for t in existing_tables]
 
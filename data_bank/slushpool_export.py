@@ -0,0 +1,192 @@
+import io
+from time import monotonic
+
+import numpy as np
+
+from configuration.constants import SLUSHPOOL_ID, BITCOIN_TARGET_BLOCK_INTERVAL_SECONDS
+from data_bank.csv_loading import CsvLoadReport, CsvCopyStream
+from utility.log import logger
+
+FOUND_AT_COLUMN = 0
+DURATION_COLUMN = 1
+POOL_SCORING_HASH_RATE_COLUMN = 2
+DIFFICULTY_COLUMN = 3
+POOL_LUCK_COLUMN = 4
+BLOCK_NUMBER_COLUMN = 5
+BLOCK_VALUE_COLUMN = 6
+NUMBER_OF_COLUMNS = 8
+
+HASH_RATE_UNIT_MULTIPLIERS = [('K', 1e3), ('M', 1e6), ('G', 1e9), ('T', 1e12), ('P', 1e15), ('E', 1e18), ('Z', 1e21)]
+
+# 'dd.mm.YYYY HH:MM' is rearranged into the ISO 8601 form 'YYYY-mm-ddTHH:MM' by picking its characters
+FOUND_AT_LENGTH = 16
+FOUND_AT_TO_ISO_CHARACTER_ORDER = [6, 7, 8, 9, 2, 3, 4, 5, 0, 1, 10, 11, 12, 13, 14, 15]
+FOUND_AT_ISO_SEPARATORS = [(4, '-'), (7, '-'), (10, 'T')]
+
+
+class SlushPoolExportException(Exception):
+    pass
+
+
+class SlushPoolExport:
+    """
+    The columns of a block export of the pool, parsed into arrays
+    """
+
+    def __init__(self, found_at, duration, scoring_hash_rate, difficulty, luck, block_id, block_value):
+        # epoch seconds (UTC)
+        self.found_at = found_at
+        # seconds it took the pool to find the block
+        self.duration = duration
+        # hashes per second
+        self.scoring_hash_rate = scoring_hash_rate
+        self.difficulty = difficulty
+        # 1.0 means 100%
+        self.luck = luck
+        self.block_id = block_id
+        # BTC
+        self.block_value = block_value
+
+    def __len__(self):
+        return len(self.found_at)
+
+
+def parse_slushpool_export(file_full_path):
+    """
+    Parses a block export of the pool (like files/SP_Data.csv) in one columnar pass
+    :param file_full_path:
+    :return: a SlushPoolExport
+    """
+    with open(file_full_path, 'r') as export_file:
+        table = np.loadtxt(export_file, dtype=str, delimiter=',', skiprows=1, ndmin=2)
+    if table.shape[0] != 0 and table.shape[1] != NUMBER_OF_COLUMNS:
+        raise SlushPoolExportException("Expected {0} columns in {1} but found {2}.".format(
+            NUMBER_OF_COLUMNS, file_full_path, table.shape[1]))
+    if table.shape[0] == 0:
+        table = np.empty((0, NUMBER_OF_COLUMNS), dtype=str)
+    return SlushPoolExport(found_at=parse_found_at(table[:, FOUND_AT_COLUMN]),
+                           duration=parse_duration(table[:, DURATION_COLUMN]),
+                           scoring_hash_rate=parse_hash_rate(table[:, POOL_SCORING_HASH_RATE_COLUMN]),
+                           difficulty=table[:, DIFFICULTY_COLUMN].astype(np.float64),
+                           luck=strip_unit(table[:, POOL_LUCK_COLUMN], '%') / 100.0,
+                           block_id=table[:, BLOCK_NUMBER_COLUMN].astype(np.int64),
+                           block_value=strip_unit(table[:, BLOCK_VALUE_COLUMN], 'BTC'))
+
+
+def parse_found_at(values):
+    """
+    :param values: an array of 'dd.mm.YYYY HH:MM' strings in UTC
+    :return: an array of epoch seconds
+    """
+    values = np.char.strip(values)
+    if np.any(np.char.str_len(values) != FOUND_AT_LENGTH):
+        raise SlushPoolExportException("Block moments must look like dd.mm.YYYY HH:MM.")
+    characters = values.astype('U{0}'.format(FOUND_AT_LENGTH)).view('U1').reshape(-1, FOUND_AT_LENGTH)
+    iso_characters = characters[:, FOUND_AT_TO_ISO_CHARACTER_ORDER]
+    for position, separator in FOUND_AT_ISO_SEPARATORS:
+        iso_characters[:, position] = separator
+    iso_values = np.ascontiguousarray(iso_characters).view('U{0}'.format(FOUND_AT_LENGTH)).ravel()
+    return iso_values.astype('datetime64[m]').astype('datetime64[s]').astype(np.int64)
+
+
+def parse_duration(values):
+    """
+    :param values: an array of 'HH:MM:SS' strings
+    :return: an array of seconds
+    """
+    rest, _, seconds = split_last(values, ':')
+    hours, _, minutes = split_last(rest, ':')
+    return hours.astype(np.int64) * 3600 + minutes.astype(np.int64) * 60 + seconds.astype(np.int64)
+
+
+def parse_hash_rate(values):
+    """
+    :param values: an array of strings like '10.79EH/s'
+    :return: an array of hashes per second
+    """
+    values = np.char.rstrip(np.char.strip(values), 'H/s')
+    unit_symbols = "".join(symbol for symbol, _ in HASH_RATE_UNIT_MULTIPLIERS)
+    multipliers = np.select([np.char.endswith(values, symbol) for symbol, _ in HASH_RATE_UNIT_MULTIPLIERS],
+                            [multiplier for _, multiplier in HASH_RATE_UNIT_MULTIPLIERS], default=1.0)
+    return np.char.rstrip(values, unit_symbols).astype(np.float64) * multipliers
+
+
+def strip_unit(values, unit):
+    """
+    :param values: an array of strings like '76.65 %'
+    :param unit: the unit after the number
+    :return: an array of the numbers
+    """
+    return np.char.strip(np.char.replace(values, unit, '')).astype(np.float64)
+
+
+def split_last(values, separator):
+    parts = np.char.rpartition(values, separator)
+    return parts[:, 0], parts[:, 1], parts[:, 2]
+
+
+def import_slushpool_export(handler, file_full_path):
+    """
+    Parses the export and bulk loads the blocks, the pool hash rates and the network difficulties into the database
+    :param handler: a MineDatabaseHandler
+    :param file_full_path:
+    :return: a list of CsvLoadReport, one for each table
+    """
+    parse_begin = monotonic()
+    try:
+        export = parse_slushpool_export(file_full_path)
+    except Exception as e:
+        logger('database/slushpool-export').error("Parsing pool export failed {0}.", file_full_path)
+        logger('database/slushpool-export').error("Exception {0}.", e)
+        report = CsvLoadReport(handler.BLOCKS_TABLE_NAME, file_full_path)
+        return [report]
+    logger('database/slushpool-export').info("Parsed {0} blocks from {1} in {2:.3f} seconds.",
+                                             len(export), file_full_path, monotonic() - parse_begin)
+
+    moments = format_moments(export.found_at)
+    # The export only has the scoring hash rate of the pool, and the network hash rate is
+    # the one that is expected to find a block every target interval at the given difficulty
+    network_hash_rate = export.difficulty * (2 ** 32) / BITCOIN_TARGET_BLOCK_INTERVAL_SECONDS
+    tables = [
+        (handler.BLOCKS_TABLE_NAME, ['id', 'moment', 'pool_id'],
+         [format_integers(export.block_id), moments,
+          format_integers(np.full(len(export), SLUSHPOOL_ID, dtype=np.int64))]),
+        (handler.SLUSHPOOL_TABLE_NAME, ['moment', 'hash_rate', 'scoring_hash_rate'],
+         [moments, format_floats(export.scoring_hash_rate), format_floats(export.scoring_hash_rate)]),
+        (handler.NETWORK_DATA_TABLE_NAME, ['moment', 'network_hash', 'difficulty'],
+         [moments, format_floats(network_hash_rate), format_floats(export.difficulty)]),
+    ]
+    reports = []
+    for table_name, columns, column_values in tables:
+        report = CsvLoadReport(table_name, file_full_path)
+        try:
+            handler.copy_csv_into_table(table_name, columns,
+                                        CsvCopyStream(io.StringIO(join_csv_lines(column_values)), len(columns), ','),
+                                        report)
+        except Exception as e:
+            logger('database/slushpool-export').error("Loading pool export into {0} failed.", table_name)
+            logger('database/slushpool-export').error("Exception {0}.", e)
+        reports.append(report)
+    return reports
+
+
+def format_moments(epoch_seconds):
+    iso_values = np.datetime_as_string(epoch_seconds.astype('datetime64[s]'))
+    return np.char.add(np.char.add("'", iso_values), "+00'")
+
+
+def format_integers(values):
+    return np.char.mod('%d', values)
+
+
+def format_floats(values):
+    return np.char.mod('%.17g', values)
+
+
+def join_csv_lines(column_values):
+    if len(column_values[0]) == 0:
+        return ""
+    lines = column_values[0]
+    for values in column_values[1:]:
+        lines = np.char.add(np.char.add(lines, ','), values)
+    return "\n".join(lines.tolist()) + "\n"
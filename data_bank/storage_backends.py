@@ -0,0 +1,415 @@
+import csv
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from threading import local, RLock
+
+import psycopg2
+import pytz
+from dateutil.parser import isoparse
+from psycopg2 import Error as PGError, OperationalError, InterfaceError
+from psycopg2.extras import execute_batch
+
+from configuration import EXECUTION_CONFIGS
+from data_bank.connection_pool import ConnectionPool
+from data_bank.prepared_statements import PreparedStatement, PreparingConnection, PARAMETER_PATTERN
+from utility.log import logger
+
+POSTGRESQL = 'postgresql'
+SQLITE = 'sqlite'
+SQLITE_IN_MEMORY_DATABASE = ':memory:'
+
+
+class StorageBackendException(Exception):
+    pass
+
+
+class StorageBackend:
+    """
+    Where a DatabaseHandler keeps its data. The handler builds the queries and records how they went, and the
+    backend runs them on its connections. Statements are written for PostgreSQL, with $1, $2, ... as
+    placeholders, unless the handler registers a variant in the dialect of the backend.
+    """
+    dialect = None
+    # whether the results of a select can be written into a stream with COPY
+    supports_copy_select_to_stream = False
+
+    def create_statement(self, name, sql):
+        """
+        :param name: a unique name that is a valid SQL identifier
+        :param sql: the statement with $1, $2, ... as parameter placeholders
+        :return: the statement in the form execute_statement takes
+        """
+        raise NotImplementedError()
+
+    def execute_statement(self, cursor, statement, parameters):
+        raise NotImplementedError()
+
+    def execute_statement_many(self, cursor, statement, list_of_parameters, page_size):
+        raise NotImplementedError()
+
+    def copy_select_to_stream(self, cursor, select_sql_query, stream, binary):
+        """
+        :return: the number of rows that were written into the stream
+        """
+        raise StorageBackendException("The {0} backend cannot copy the results of a select.".format(self.dialect))
+
+    def copy_csv_into_table(self, table_name, columns, csv_stream):
+        """
+        Inserts the records of the stream into the table in one transaction, skipping those that collide with
+        existing rows
+        :param table_name:
+        :param columns: the column names of the records in the stream
+        :param csv_stream: a CsvCopyStream
+        :return: the number of rows that were inserted
+        """
+        raise NotImplementedError()
+
+    def run_with_cursor(self, operation):
+        """
+        Calls the given function with a cursor and returns its result. Outside of a transaction the work is
+        committed right away.
+        :param operation: a function that takes a cursor
+        :return: the return value of operation
+        """
+        raise NotImplementedError()
+
+    def transaction(self):
+        """
+        :return: a context manager that runs the queries of this thread inside its with block in one transaction
+        """
+        raise NotImplementedError()
+
+    def get_statistics(self):
+        return {}
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def run_operation(connection, operation):
+        cursor = connection.cursor()
+        try:
+            return operation(cursor)
+        finally:
+            cursor.close()
+
+
+class PostgresBackend(StorageBackend):
+    """
+    Keeps the data in a PostgreSQL database, through a pool of connections that is shared by all threads
+    """
+    dialect = POSTGRESQL
+    supports_copy_select_to_stream = True
+    NUMBER_OF_RECONNECT_ATTEMPTS = 1
+
+    def __init__(self, user, password, database, host, port, max_connections, acquire_timeout=None,
+                 health_check_interval=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.database = database
+        self.connection_pool = ConnectionPool(self.create_connection, max_connections=max_connections,
+                                              acquire_timeout=acquire_timeout,
+                                              health_check_interval=health_check_interval)
+        self.thread_state = local()
+
+    def create_statement(self, name, sql):
+        return PreparedStatement(name, sql)
+
+    def execute_statement(self, cursor, statement, parameters):
+        statement.prepare_on(cursor)
+        cursor.execute(statement.execute_sql, parameters)
+
+    def execute_statement_many(self, cursor, statement, list_of_parameters, page_size):
+        statement.prepare_on(cursor)
+        execute_batch(cursor, statement.execute_sql, list_of_parameters, page_size=page_size)
+
+    def copy_select_to_stream(self, cursor, select_sql_query, stream, binary):
+        # drop what a copy that lost its connection wrote before it is retried
+        stream.seek(0)
+        stream.truncate()
+        cursor.copy_expert("COPY ({0}) TO STDOUT WITH (FORMAT {1});".format(select_sql_query,
+                                                                          "binary" if binary else "csv"),
+                           stream)
+        return max(cursor.rowcount, 0)
+
+    def copy_csv_into_table(self, table_name, columns, csv_stream):
+        """
+        Streams the records into a temporary staging table with COPY and merges them into the table with
+        a single statement
+        """
+        staging_table_name = "{0}_staging".format(table_name)
+        column_list = ",".join(columns)
+        with self.transaction() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("""CREATE TEMPORARY TABLE {0} (LIKE {1} INCLUDING DEFAULTS)
+                ON COMMIT DROP;""".format(staging_table_name, table_name))
+                cursor.copy_expert("""COPY {0} ({1}) FROM STDIN
+                WITH (FORMAT csv, DELIMITER '{2}', QUOTE '''');""".format(staging_table_name, column_list,
+                                                                          csv_stream.separator),
+                                   csv_stream)
+                cursor.execute("""INSERT INTO {0} ({1}) SELECT {1} FROM {2}
+                ON CONFLICT DO NOTHING;""".format(table_name, column_list, staging_table_name))
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    def run_with_cursor(self, operation):
+        """
+        Calls the given function with a cursor of a pooled connection and returns its result.
+        Outside of a transaction the work is committed right away and, if the connection turns out
+        to be lost, it is retried once on a new connection.
+        :param operation: a function that takes a cursor
+        :return: the return value of operation
+        """
+        transaction_connection = self.get_transaction_connection()
+        if transaction_connection is not None:
+            return self.run_operation(transaction_connection, operation)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            connection = self.connection_pool.acquire()
+            try:
+                result = self.run_operation(connection, operation)
+                connection.commit()
+                return result
+            except (OperationalError, InterfaceError) as e:
+                if not connection.closed or attempt > self.NUMBER_OF_RECONNECT_ATTEMPTS:
+                    raise
+                logger('database/handler').warning("Connection to the database was lost ({0}); reconnecting.", e)
+            finally:
+                self.connection_pool.release(connection)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs all queries that this thread executes through the backend inside the with block in a single
+        transaction, which is committed at the end of the block or rolled back if the block raises.
+        Nested transactions join the outer one.
+        :return: the connection of the transaction
+        """
+        connection = self.get_transaction_connection()
+        if connection is not None:
+            yield connection
+            return
+        connection = self.connection_pool.acquire()
+        self.thread_state.transaction_connection = connection
+        try:
+            yield connection
+            try:
+                connection.commit()
+            except PGError as e:
+                logger('database/handler').error("Committing the transaction failed {0}.", e)
+                raise StorageBackendException('COMMIT FAILED.')
+        finally:
+            self.thread_state.transaction_connection = None
+            # an unfinished transaction is rolled back by the pool
+            self.connection_pool.release(connection)
+
+    def get_transaction_connection(self):
+        return getattr(self.thread_state, 'transaction_connection', None)
+
+    def get_statistics(self):
+        return self.connection_pool.get_statistics()
+
+    def close(self):
+        self.connection_pool.close()
+
+    def create_connection(self):
+        return psycopg2.connect(user=self.user,
+                                password=self.password,
+                                host=self.host,
+                                port=self.port,
+                                database=self.database,
+                                connection_factory=PreparingConnection)
+
+
+def convert_timestamptz(value):
+    """
+    Timestamps are kept as epoch seconds by the SQLite backend, and are selected as datetimes like PostgreSQL does
+    """
+    return datetime.fromtimestamp(float(value), tz=pytz.UTC)
+
+
+def parse_timestamptz_literal(value):
+    """
+    :param value: a timestamp of a CSV file, e.g. '2021-01-05 12:01:00+00:00'; those without a zone are in UTC
+    :return: epoch seconds
+    """
+    moment = isoparse(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=pytz.UTC)
+    return moment.timestamp()
+
+
+def get_csv_value_parser(column_type):
+    """
+    :param column_type: the declared type of a column, in lower case
+    :return: the function that parses the values of the column in a CSV file, or None if they are kept as text
+    """
+    if column_type.startswith('timestamptz'):
+        return parse_timestamptz_literal
+    # the names of the types of the numeric affinities of SQLite
+    if 'int' in column_type:
+        return int
+    if any(t in column_type for t in ('real', 'floa', 'doub',)):
+        return float
+    return None
+
+
+sqlite3.register_converter('timestamptz', convert_timestamptz)
+
+
+class SqliteStatement:
+    """
+    A statement of the SQLite backend. The connection compiles a statement once and keeps it in its cache,
+    so only the $1, $2, ... placeholders are turned into the ?1, ?2, ... of SQLite.
+    """
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = PARAMETER_PATTERN.sub(r'?\1', sql)
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Keeps the data in an SQLite database inside the process, in a file or only in memory. The only connection
+    is shared by all threads and used by one at a time, so a transaction holds it until it ends.
+    """
+    dialect = SQLITE
+    CACHED_STATEMENTS = 256
+
+    def __init__(self, database_file_path=SQLITE_IN_MEMORY_DATABASE):
+        """
+        :param database_file_path: the file of the database, or ':memory:' for a database that lives as long as
+                                   the backend
+        """
+        self.database_file_path = database_file_path
+        # transactions are begun and ended explicitly
+        self.connection = sqlite3.connect(database_file_path, detect_types=sqlite3.PARSE_DECLTYPES,
+                                          isolation_level=None, check_same_thread=False,
+                                          cached_statements=self.CACHED_STATEMENTS)
+        if database_file_path != SQLITE_IN_MEMORY_DATABASE:
+            self.connection.execute("PRAGMA journal_mode=WAL;")
+            self.connection.execute("PRAGMA synchronous=NORMAL;")
+        self.connection_mutex = RLock()
+        self.thread_state = local()
+        # statistics
+        self.total_transactions = 0
+        self.total_rollbacks = 0
+
+    def create_statement(self, name, sql):
+        return SqliteStatement(name, sql)
+
+    def execute_statement(self, cursor, statement, parameters):
+        cursor.execute(statement.sql, parameters)
+
+    def execute_statement_many(self, cursor, statement, list_of_parameters, page_size):
+        cursor.executemany(statement.sql, list_of_parameters)
+
+    def copy_csv_into_table(self, table_name, columns, csv_stream):
+        """
+        Parses the records and inserts them with one statement that is executed for each of them. Timestamps and
+        numbers are parsed here, since SQLite would keep a value that is not one as text, and records that collide
+        with existing rows are skipped. As with COPY, a value that cannot be parsed or that breaks another
+        constraint fails the whole load.
+        """
+        with self.transaction() as connection:
+            column_types = {r[1]: r[2].lower() for r in connection.execute("PRAGMA table_info({0});".format(
+                table_name))}
+            parsers = [get_csv_value_parser(column_types.get(c, "")) for c in columns]
+
+            def parse(record):
+                try:
+                    return [None if v == "" else v if parser is None else parser(v)
+                            for v, parser in zip(record, parsers)]
+                except ValueError as e:
+                    raise StorageBackendException("A record for {0} has a value of a wrong type: {1}".format(
+                        table_name, e))
+
+            records = csv.reader(iter(csv_stream.readline, ""), delimiter=csv_stream.separator, quotechar="'")
+            # unlike INSERT OR IGNORE, only skips the records that are already in the table
+            cursor = connection.executemany("""INSERT INTO {0} ({1}) VALUES ({2}) ON CONFLICT DO NOTHING;""".format(
+                table_name, ",".join(columns), ",".join(["?"] * len(columns))), (parse(r) for r in records))
+            return max(cursor.rowcount, 0)
+
+    def run_with_cursor(self, operation):
+        """
+        Calls the given function with a cursor and returns its result. Outside of a transaction the work is
+        done in a transaction of its own.
+        :param operation: a function that takes a cursor
+        :return: the return value of operation
+        """
+        with self.transaction() as connection:
+            return self.run_operation(connection, operation)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs all queries that this thread executes through the backend inside the with block in a single
+        transaction, which is committed at the end of the block or rolled back if the block raises.
+        Nested transactions join the outer one. Other threads wait until the transaction ends.
+        :return: the connection of the transaction
+        """
+        if getattr(self.thread_state, 'in_transaction', False):
+            yield self.connection
+            return
+        self.connection_mutex.acquire()
+        try:
+            if self.connection is None:
+                raise StorageBackendException("The database {0} is closed.".format(self.database_file_path))
+            self.connection.execute("BEGIN;")
+            self.thread_state.in_transaction = True
+            self.total_transactions += 1
+            try:
+                yield self.connection
+                self.connection.execute("COMMIT;")
+            except BaseException:
+                if self.connection.in_transaction:
+                    self.connection.execute("ROLLBACK;")
+                self.total_rollbacks += 1
+                raise
+            finally:
+                self.thread_state.in_transaction = False
+        finally:
+            self.connection_mutex.release()
+
+    def get_statistics(self):
+        return {
+            'database_file_path': self.database_file_path,
+            'transactions': self.total_transactions,
+            'rollbacks': self.total_rollbacks,
+        }
+
+    def close(self):
+        self.connection_mutex.acquire()
+        try:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+        finally:
+            self.connection_mutex.release()
+
+
+def create_storage_backend(user, password, database, host, port):
+    """
+    Creates the backend that db_backend names. An SQLite database is kept in <database>.sqlite3 in the
+    db_sqlite_directory, or only in memory if that is None.
+    :return: a StorageBackend
+    """
+    if EXECUTION_CONFIGS.db_backend == POSTGRESQL:
+        return PostgresBackend(user, password, database, host, port,
+                               max_connections=EXECUTION_CONFIGS.db_pool_max_connections,
+                               acquire_timeout=EXECUTION_CONFIGS.db_pool_acquire_timeout,
+                               health_check_interval=EXECUTION_CONFIGS.db_pool_health_check_interval)
+    if EXECUTION_CONFIGS.db_backend == SQLITE:
+        if EXECUTION_CONFIGS.db_sqlite_directory is None:
+            return SqliteBackend(SQLITE_IN_MEMORY_DATABASE)
+        os.makedirs(EXECUTION_CONFIGS.db_sqlite_directory, exist_ok=True)
+        return SqliteBackend(os.path.join(EXECUTION_CONFIGS.db_sqlite_directory, "{0}.sqlite3".format(database)))
+    raise StorageBackendException("Unknown storage backend {0}.".format(EXECUTION_CONFIGS.db_backend))
@@ -1,19 +1,30 @@
 import sys
 import traceback
-from time import sleep
 
 from clock import get_clock
+from clock.scheduler import SCHEDULING_VIRTUAL_TIME, SCHEDULING_DEADLINES, VirtualTimeScheduler, DeadlineScheduler
 from configuration import EXECUTION_CONFIGS, is_simulation
 from nicehash import get_nice_hash_driver
 from simulation_evaluator import get_simulation_evaluator
-from utility import log
+from utility import log, metrics
 from analyzer import get_analyzer
 from controller import get_controller
-from data_bank import get_database_handler, get_database_updater, get_simulation_database_updater
+from data_bank import get_database_handler, get_database_updater, get_simulation_database_updater, \
+    get_simulation_database_handler
 
 
 TICK_PERFORMERS = []
 CONTROLLER = None
+# Drives the tick performers on the main thread instead of their own threads
+SCHEDULER = None
+
+
+def start_tick_performer(performer):
+    if SCHEDULER is None:
+        performer.start()
+    else:
+        SCHEDULER.add(performer)
+    TICK_PERFORMERS.append(performer)
 
 
 def join_tick_performers(stop=False):
@@ -25,65 +36,84 @@ def join_tick_performers(stop=False):
 
 
 def graceful_termination():
-    if CONTROLLER is None:
+    if SCHEDULER is not None:
+        # performers run on this thread, so they are simply ended in order
+        SCHEDULER.finish_all()
+    elif CONTROLLER is None:
         # stop all threads since controller is not running anyways
         join_tick_performers(stop=True)
     else:
         # first stop the controller and wait for it to terminate gracefully
         CONTROLLER.stop()
-        while not CONTROLLER.should_end_execution():
-            sleep(1)
+        CONTROLLER.wait_for_end_of_execution()
         join_tick_performers(stop=True)
+    if is_simulation():
+        # write the order samples that are still buffered
+        get_simulation_database_handler().close_order_info_sample_writer()
 
 
-if __name__ == '__main__':
+def run_execution():
+    """
+    Runs the tick performers of the configured execution until it ends
+    :return: the exit code of the execution
+    """
+    global CONTROLLER, SCHEDULER
     try:
-        log.logger('main').info('Execution identifier is {0}'.format(EXECUTION_CONFIGS.execution_identifier))
+        log.logger('main').info('Execution identifier is {0}', EXECUTION_CONFIGS.execution_identifier)
+        metrics.start_metrics_exporters()
         # start the clock
         clock = get_clock()
-        clock.start()
-        TICK_PERFORMERS.append(clock)
-        log.logger('main').info('Clock started.')
+        if EXECUTION_CONFIGS.clock_scheduling == SCHEDULING_VIRTUAL_TIME:
+            # the scheduler moves the clock forward itself
+            SCHEDULER = VirtualTimeScheduler(clock)
+            log.logger('main').info('Clock is running in virtual time.')
+        elif EXECUTION_CONFIGS.clock_scheduling == SCHEDULING_DEADLINES:
+            SCHEDULER = DeadlineScheduler(clock)
+            SCHEDULER.add(clock)
+            log.logger('main').info('Clock is scheduled with the other performers on the main thread.')
+        else:
+            clock.start()
+            TICK_PERFORMERS.append(clock)
+            log.logger('main').info('Clock started.')
 
         # start the mine database updater
         mine_database_updater = get_database_updater()
-        mine_database_updater.start()
-        TICK_PERFORMERS.append(mine_database_updater)
+        start_tick_performer(mine_database_updater)
         log.logger('main').info('Mine database updater started.')
 
         if is_simulation():
             # start the simulation database updater
             simulation_database_updater = get_simulation_database_updater()
-            simulation_database_updater.start()
-            TICK_PERFORMERS.append(simulation_database_updater)
+            start_tick_performer(simulation_database_updater)
             log.logger('main').info('Simulation database updater started.')
 
         # start the controller
         CONTROLLER = get_controller()
-        CONTROLLER.start()
-        TICK_PERFORMERS.append(CONTROLLER)
+        start_tick_performer(CONTROLLER)
         log.logger('main').info('Controller started.')
 
         # start the analyzer
         analyzer = get_analyzer()
-        analyzer.start()
-        TICK_PERFORMERS.append(analyzer)
+        start_tick_performer(analyzer)
         log.logger('main').info('Analyzer started.')
 
         # start the nice hash driver
         nice_hash = get_nice_hash_driver()
-        nice_hash.start()
-        TICK_PERFORMERS.append(nice_hash)
+        start_tick_performer(nice_hash)
         log.logger('main').info('Nice hash driver started.')
 
         if is_simulation():
             # start the simulation evaluator
             simulation_evaluator = get_simulation_evaluator()
-            simulation_evaluator.start()
-            TICK_PERFORMERS.append(simulation_evaluator)
+            start_tick_performer(simulation_evaluator)
             log.logger('main').info('Simulation evaluator started.')
-            while not simulation_evaluator.should_end_execution():
-                sleep(1)
+            if SCHEDULER is not None:
+                SCHEDULER.run(until=simulation_evaluator.should_end_execution)
+            else:
+                simulation_evaluator.wait_for_end_of_execution()
+            graceful_termination()
+        elif SCHEDULER is not None:
+            SCHEDULER.run()
             graceful_termination()
         else:
             join_tick_performers()
@@ -91,8 +121,14 @@ if __name__ == '__main__':
         log.logger('main').info('Program terminating upon keyboard interrupt.')
         graceful_termination()
     except Exception as e:
-        log.logger('main').info("Exception {0}".format(e))
+        log.logger('main').info("Exception {0}", e)
         traceback.print_exc(file=sys.stdout)
         graceful_termination()
-        sys.exit(1)
-    sys.exit(0)
+        return 1
+    finally:
+        metrics.stop_metrics_exporters()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run_execution())
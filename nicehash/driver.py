@@ -1,7 +1,5 @@
 import math
-from time import sleep
 
-from clock import get_clock
 from clock.clock import calculate_tick_duration_from_sleep_duration
 from clock.tick_performer import TickPerformer
 from configuration import EXECUTION_CONFIGS
@@ -15,15 +13,10 @@ class NiceHashDriver(TickPerformer):
         A singleton class that is the driver of nicehash
         """
         super().__init__()
-        self.tick_duration = calculate_tick_duration_from_sleep_duration(EXECUTION_CONFIGS.nice_hash_sleep_duration)
+        self.sleep_duration = EXECUTION_CONFIGS.nice_hash_sleep_duration
+        self.tick_duration = calculate_tick_duration_from_sleep_duration(self.sleep_duration)
 
-    def run(self, should_stop):
-        while True:
-            if should_stop():
-                break
-            sleep(self.tick_duration)
-            current_timestamp = get_clock().read_timestamp_of_now()
-            self.perform_tick(current_timestamp)
+    def after_ticks(self):
         self.pre_exit_house_keeping()
 
     def post_run(self):
@@ -35,11 +28,11 @@ class NiceHashDriver(TickPerformer):
     def perform_tick(self, up_to_timestamp):
         """
         Performs one tick.
-        :return: None
+        :return: False
         """
         logger('nicehash').warn(
-            "Base class of the driver in use! Performing a tick at timestamp {0}.".format(up_to_timestamp))
-        pass
+            "Base class of the driver in use! Performing a tick at timestamp {0}.", up_to_timestamp)
+        return False
 
     def pre_exit_house_keeping(self):
         """
@@ -81,3 +74,19 @@ class NiceHashDriver(TickPerformer):
         :return: True if any matching order found
         """
         pass
+
+    def get_deliveries_at(self, timestamp):
+        """
+        Returns the limit, price and delivered hashrate of every order at the given timestamp
+        :param timestamp:
+        :return: a list of (order_id, limit, price, delivered hashrate) tuples
+        """
+        pass
+
+    def get_delivered_hashrate(self, order_id):
+        """
+        Returns the hashrate that is delivered to the order with the given order id
+        :param order_id:
+        :return: the hashrate or None if there is no such order
+        """
+        pass
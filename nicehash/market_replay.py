@@ -0,0 +1,191 @@
+import warnings
+
+import numpy as np
+
+from utility.log import logger
+
+# The columns a market history file must have, after a header line that names them
+MOMENT_COLUMN = 'moment'
+PRICE_COLUMN = 'price'
+AVAILABLE_HASHRATE_COLUMN = 'available_hashrate'
+# Suffixes of the UTC timestamps of the files, e.g. '2021-01-05 12:01:00+00:00'
+UTC_SUFFIXES = ('+00:00', '+00', 'Z',)
+
+
+class MarketReplayException(Exception):
+    pass
+
+
+class MarketReplay:
+    """
+    The recorded price level and available hashrate of the marketplace over time, as parallel arrays sorted by
+    moment. A record holds from its moment until the next one, and the market is unknown before the first.
+    """
+
+    def __init__(self, moments, prices, available_hashrates):
+        """
+        :param moments: epoch seconds, sorted and distinct
+        :param prices: the lowest price per unit of hashrate per day at which hashrate is delivered
+        :param available_hashrates: the hashrate that the marketplace can deliver to orders at that price
+        """
+        self.moments = moments
+        self.prices = prices
+        self.available_hashrates = available_hashrates
+
+    def __len__(self):
+        return len(self.moments)
+
+    def index_at(self, timestamps):
+        """
+        :param timestamps: a timestamp or an array of them
+        :return: the index of the record that holds at each timestamp, -1 before the first record
+        """
+        return np.searchsorted(self.moments, timestamps, side='right') - 1
+
+    def market_at(self, timestamp):
+        """
+        :return: a tuple (price, available hashrate) at the timestamp, or None before the first record
+        """
+        index = self.index_at(timestamp)
+        if index < 0:
+            return None
+        return float(self.prices[index]), float(self.available_hashrates[index])
+
+    def markets_at(self, timestamps):
+        """
+        :param timestamps: an array of timestamps
+        :return: a tuple (prices, available hashrates) of arrays, with NaN before the first record
+        """
+        indexes = self.index_at(timestamps)
+        known = indexes >= 0
+        prices = np.where(known, self.prices[indexes], np.nan)
+        available_hashrates = np.where(known, self.available_hashrates[indexes], np.nan)
+        return prices, available_hashrates
+
+    def calculate_delivered_hashrates(self, timestamp, limits, prices):
+        """
+        Shares the available hashrate at the timestamp between the orders that pay at least the price level,
+        the higher paying orders first, as the marketplace does. An order gets no more than its limit.
+        Before the first record every order gets its limit.
+        :param timestamp:
+        :param limits: an array of the limits of the orders
+        :param prices: an array of the prices of the orders
+        :return: an array of the hashrates delivered to the orders
+        """
+        market = self.market_at(timestamp)
+        limits = np.maximum(np.asarray(limits, dtype=np.float64), 0.0)
+        if market is None:
+            return limits
+        price_level, available_hashrate = market
+        by_price = np.argsort(-np.asarray(prices, dtype=np.float64), kind='stable')
+        asked = np.where(np.asarray(prices)[by_price] >= price_level, limits[by_price], 0.0)
+        # what the higher paying orders took before each order
+        taken_before = np.cumsum(asked) - asked
+        delivered = np.empty(len(limits), dtype=np.float64)
+        delivered[by_price] = np.clip(available_hashrate - taken_before, 0.0, asked)
+        return delivered
+
+
+def parse_moments(values):
+    """
+    :param values: an array of strings of epoch seconds, or of UTC timestamps in single quotes
+    :return: an array of epoch seconds
+    """
+    values = np.char.strip(np.char.strip(values), "'")
+    try:
+        return values.astype(np.float64)
+    except ValueError:
+        pass
+    for suffix in UTC_SUFFIXES:
+        # the suffixes do not occur anywhere else in a timestamp
+        values = np.char.replace(values, suffix, '')
+    try:
+        return np.char.replace(values, ' ', 'T').astype('datetime64[s]').astype(np.int64).astype(np.float64)
+    except ValueError as e:
+        raise MarketReplayException("Moments must be epoch seconds or UTC timestamps: {0}".format(e))
+
+
+def has_fields_on_every_line(content, separator, number_of_columns):
+    """
+    :return: whether every line of the content has the number of fields, which is only checked for a separator
+             of one ASCII character
+    """
+    if len(separator) != 1 or ord(separator) >= 128 or separator == '\n':
+        return False
+    if not content.endswith('\n'):
+        content += '\n'
+    characters = np.frombuffer(content.encode(), dtype=np.uint8)
+    # the separators and line ends in order, which are number_of_columns - 1 separators and a line end per line
+    delimiters = characters[(characters == ord(separator)) | (characters == ord('\n'))]
+    if len(delimiters) % number_of_columns != 0:
+        return False
+    delimiters = delimiters.reshape(-1, number_of_columns)
+    return bool((delimiters[:, :-1] == ord(separator)).all() and (delimiters[:, -1] == ord('\n')).all())
+
+
+def parse_numeric_records(content, separator, number_of_columns):
+    """
+    Parses the records in one pass of numpy, which is only possible if every field is a number
+    :param content: the lines of the records
+    :return: a 2D array of the records, or None if a field is not a number or a line is blank or malformed
+    """
+    if content == "" or not has_fields_on_every_line(content, separator, number_of_columns):
+        return None
+    number_of_lines = content.count('\n') + (0 if content.endswith('\n') else 1)
+    with warnings.catch_warnings():
+        # numpy warns, instead of failing, when it stops at a field that is not a number
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(content.replace('\n', separator), dtype=np.float64, sep=separator)
+        except (ValueError, DeprecationWarning):
+            return None
+    if len(values) != number_of_lines * number_of_columns:
+        return None
+    return values.reshape(number_of_lines, number_of_columns)
+
+
+def load_market_replay(file_full_path, separator=','):
+    """
+    Loads a market history file whose first line names its columns, among which are moment, price and
+    available_hashrate. Records need not be sorted; of the records with the same moment the last one is kept.
+    :param file_full_path:
+    :param separator:
+    :return: a MarketReplay
+    """
+    with open(file_full_path) as market_file:
+        columns = [c.strip() for c in market_file.readline().split(separator)]
+        missing_columns = [c for c in (MOMENT_COLUMN, PRICE_COLUMN, AVAILABLE_HASHRATE_COLUMN) if c not in columns]
+        if len(missing_columns) != 0:
+            raise MarketReplayException("{0} has no {1} column.".format(file_full_path, ", ".join(missing_columns)))
+        content = market_file.read()
+    records = parse_numeric_records(content, separator, len(columns))
+    if records is not None:
+        moments = records[:, columns.index(MOMENT_COLUMN)]
+    else:
+        # e.g. timestamps instead of epoch seconds
+        records = [line.split(separator) for line in content.splitlines() if line.strip() != ""]
+        if any(len(r) != len(columns) for r in records):
+            raise MarketReplayException("Records of {0} do not all have {1} fields.".format(file_full_path,
+                                                                                            len(columns)))
+        records = np.array(records, dtype=str).reshape(len(records), len(columns))
+        moments = parse_moments(records[:, columns.index(MOMENT_COLUMN)])
+    if len(records) == 0:
+        raise MarketReplayException("{0} has no records.".format(file_full_path))
+    try:
+        prices = records[:, columns.index(PRICE_COLUMN)].astype(np.float64)
+        available_hashrates = records[:, columns.index(AVAILABLE_HASHRATE_COLUMN)].astype(np.float64)
+    except ValueError as e:
+        raise MarketReplayException("{0} has a value that is not a number: {1}".format(file_full_path, e))
+    if not (np.isfinite(moments).all() and np.isfinite(prices).all() and np.isfinite(available_hashrates).all()):
+        raise MarketReplayException("{0} has a moment, price or available hashrate that is not finite.".format(
+            file_full_path))
+
+    order = np.argsort(moments, kind='stable')
+    moments = moments[order]
+    # the last record of each moment, i.e. those that the next record does not have the moment of
+    last_of_moment = np.append(moments[1:] != moments[:-1], True)
+    replay = MarketReplay(np.ascontiguousarray(moments[last_of_moment]),
+                          np.ascontiguousarray(prices[order][last_of_moment]),
+                          np.ascontiguousarray(available_hashrates[order][last_of_moment]))
+    logger('nicehash/market-replay').info("Loaded {0} market records from {1}.", len(replay), file_full_path)
+    return replay
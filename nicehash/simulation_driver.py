@@ -1,50 +1,59 @@
 from threading import Lock
 
-import math
+import numpy as np
 
 from configuration import EXECUTION_CONFIGS
 from configuration.constants import NICE_HASH_LIMIT_CHANGE_PER_SECOND
 from nicehash.driver import NiceHashDriver
+from nicehash.market_replay import load_market_replay
+from nicehash.timeline import OrderTimeline
 from utility.log import logger
 
 
 class NiceHashOrder:
-    class OrderChange:
-        def __init__(self, change_timestamp, limit_change=0, price_change=0):
-            self.timestamp = change_timestamp
-            self.limit_change = limit_change
-            self.price_change = price_change
-
     def __init__(self, current_timestamp, order_id, initial_limit, initial_price):
         self.creation_timestamp = current_timestamp
         self.order_id = order_id
-        self.changes = []
-        initial_change = NiceHashOrder.OrderChange(current_timestamp, limit_change=initial_limit,
-                                                   price_change=initial_price)
-        self.changes.append(initial_change)
+        self.timeline = OrderTimeline(NICE_HASH_LIMIT_CHANGE_PER_SECOND)
+        self.timeline_mutex = Lock()
+        self.timeline.add_change(current_timestamp, limit_change=initial_limit, price_change=initial_price)
+        # the hashrate the marketplace delivered to the order since the last delivery timestamp
+        self.delivered_hashrate = 0.0
+        self.last_delivery_timestamp = None
+        # the hashrate delivered to the order integrated over time, in hashrate times seconds
+        self.total_delivered_hash = 0.0
+
+    def record_delivery(self, timestamp, delivered_hashrate):
+        """
+        Accounts for the hashrate that was delivered since the previous delivery and sets the one that is
+        delivered from now on
+        :return: None
+        """
+        if self.last_delivery_timestamp is not None and timestamp > self.last_delivery_timestamp:
+            self.total_delivered_hash += self.delivered_hashrate * (timestamp - self.last_delivery_timestamp)
+        self.delivered_hashrate = delivered_hashrate
+        self.last_delivery_timestamp = timestamp
 
     def change(self, change_timestamp, limit_change=0, price_change=0):
-        new_change = NiceHashOrder.OrderChange(change_timestamp, limit_change=limit_change, price_change=price_change)
-        self.changes.append(new_change)
+        self.timeline_mutex.acquire()
+        try:
+            self.timeline.add_change(change_timestamp, limit_change=limit_change, price_change=price_change)
+        finally:
+            self.timeline_mutex.release()
 
     def calculate_limit_at(self, timestamp):
-        limit_change = 0
-        for c in self.changes:
-            if c.limit_change == 0 or c.timestamp >= timestamp:
-                continue
-            abs_limit_change = abs(c.limit_change)
-            change_in_time_difference = max((timestamp - c.timestamp) * NICE_HASH_LIMIT_CHANGE_PER_SECOND,
-                                            abs_limit_change)
-            limit_change += math.copysign(change_in_time_difference, c.limit_change)
-        return limit_change
+        self.timeline_mutex.acquire()
+        try:
+            return self.timeline.limit_at(timestamp)
+        finally:
+            self.timeline_mutex.release()
 
     def calculate_price_at(self, timestamp):
-        price_change = 0
-        for c in self.changes:
-            if c.price_change == 0 or c.timestamp >= timestamp:
-                continue
-            price_change += c.price_change
-        return price_change
+        self.timeline_mutex.acquire()
+        try:
+            return self.timeline.price_at(timestamp)
+        finally:
+            self.timeline_mutex.release()
 
 
 class NiceHashSimulationDriver(NiceHashDriver):
@@ -56,17 +65,71 @@ class NiceHashSimulationDriver(NiceHashDriver):
         """
         A singleton class that is the driver of nicehash
         """
-        # A map from order_id to its information object
         super().__init__()
-        self.orders = []
+        # A map from order_id to its information object, in the order of creation
+        self.orders = {}
         self.orders_mutex = Lock()
+        self.number_of_created_orders = 0
+        # Incremented whenever an order is created or closed
+        self.orders_version = 0
+        # A (version, tuple of orders) pair that readers use without taking the lock
+        self.orders_snapshot = (0, tuple(),)
+        # The recorded marketplace the orders are delivered from, or None if every order gets its limit
+        self.market_replay = None
+        if EXECUTION_CONFIGS.nice_hash_market_history_file is not None:
+            self.market_replay = load_market_replay(EXECUTION_CONFIGS.nice_hash_market_history_file,
+                                                    separator=EXECUTION_CONFIGS.db_csv_separator)
 
     def perform_tick(self, up_to_timestamp):
         """
-        Performs one tick.
+        Performs one tick: the orders are delivered the hashrate that the recorded marketplace has for them
+        :return: False
+        """
+        logger('simulation/driver').debug("Performing a tick at timestamp {0}.", up_to_timestamp)
+        self.deliver_hashrate(up_to_timestamp)
+        return False
+
+    def calculate_deliveries_at(self, timestamp):
+        """
+        Shares the hashrate of the marketplace at the timestamp between the orders by their limits and prices.
+        Without a market replay every order is delivered its limit.
+        :return: a list of (order, limit, price, delivered hashrate) tuples, one for each order
+        """
+        orders = self.get_orders()
+        if len(orders) == 0:
+            return []
+        limits = np.array([o.calculate_limit_at(timestamp) for o in orders], dtype=np.float64)
+        prices = np.array([o.calculate_price_at(timestamp) for o in orders], dtype=np.float64)
+        if self.market_replay is None:
+            delivered_hashrates = np.maximum(limits, 0.0)
+        else:
+            delivered_hashrates = self.market_replay.calculate_delivered_hashrates(timestamp, limits, prices)
+        return [(order, float(limit), float(price), float(delivered_hashrate),)
+                for order, limit, price, delivered_hashrate in zip(orders, limits, prices, delivered_hashrates)]
+
+    def deliver_hashrate(self, timestamp):
+        """
+        Records the deliveries of the marketplace at the timestamp on the orders
         :return: None
         """
-        logger('simulation/driver').debug("Performing a tick at timestamp {0}.".format(up_to_timestamp))
+        for order, _, _, delivered_hashrate in self.calculate_deliveries_at(timestamp):
+            order.record_delivery(timestamp, delivered_hashrate)
+
+    def get_deliveries_at(self, timestamp):
+        """
+        :return: a list of (order_id, limit, price, delivered hashrate) tuples of the orders at the timestamp
+        """
+        return [(order.order_id, limit, price, delivered_hashrate,)
+                for order, limit, price, delivered_hashrate in self.calculate_deliveries_at(timestamp)]
+
+    def get_delivered_hashrate(self, order_id):
+        """
+        :return: the hashrate the order was delivered at the last tick, or None if there is no such order
+        """
+        order = self.orders.get(order_id)
+        if order is None:
+            return None
+        return order.delivered_hashrate
 
     def pre_exit_house_keeping(self):
         """
@@ -86,11 +149,12 @@ class NiceHashSimulationDriver(NiceHashDriver):
         :param creation_timestamp:
         :return: order id
         """
-        new_order_id = generate_order_id(creation_timestamp)
-        new_order = NiceHashOrder(creation_timestamp, new_order_id, initial_limit, initial_price)
         self.orders_mutex.acquire()
         try:
-            self.orders.append(new_order)
+            self.number_of_created_orders += 1
+            new_order_id = generate_order_id(creation_timestamp, self.number_of_created_orders)
+            self.orders[new_order_id] = NiceHashOrder(creation_timestamp, new_order_id, initial_limit, initial_price)
+            self.orders_version += 1
             return new_order_id
         finally:
             self.orders_mutex.release()
@@ -103,15 +167,10 @@ class NiceHashSimulationDriver(NiceHashDriver):
         """
         self.orders_mutex.acquire()
         try:
-            found = False
-            new_order_list = []
-            for o in self.orders:
-                if order_id == o.order_id:
-                    found = True
-                    continue
-                new_order_list.append(o)
-            self.orders = new_order_list
-            return found
+            if self.orders.pop(order_id, None) is None:
+                return False
+            self.orders_version += 1
+            return True
         finally:
             self.orders_mutex.release()
 
@@ -119,18 +178,18 @@ class NiceHashSimulationDriver(NiceHashDriver):
         """
         Returns all orders or the one with the given order id (or None if not exists)
         :param order_id:
-        :return: and array of orders or a single order
+        :return: an immutable snapshot (tuple) of the orders or a single order
         """
+        if order_id is not None:
+            return self.orders.get(order_id)
+        version, orders = self.orders_snapshot
+        if version == self.orders_version:
+            return orders
+        # the set of orders changed since the last snapshot was taken
         self.orders_mutex.acquire()
         try:
-            if order_id is None:
-                orders = self.orders.copy()
-                return orders
-            else:
-                for o in self.orders:
-                    if order_id == o.order_id:
-                        return o.copy()
-                return None
+            self.orders_snapshot = (self.orders_version, tuple(self.orders.values()),)
+            return self.orders_snapshot[1]
         finally:
             self.orders_mutex.release()
 
@@ -139,16 +198,17 @@ class NiceHashSimulationDriver(NiceHashDriver):
         Applies the given change in limit or price in nicehash for the order with the given order id
         :return: True if any matching order found
         """
-        self.orders_mutex.acquire()
-        try:
-            for o in self.orders:
-                if order_id == o.order_id:
-                    o.change(change_timestamp=timestamp, limit_change=limit_change, price_change=price_change)
-                    return True
+        order = self.orders.get(order_id)
+        if order is None:
             return False
-        finally:
-            self.orders_mutex.release()
+        order.change(change_timestamp=timestamp, limit_change=limit_change, price_change=price_change)
+        return True
 
 
-def generate_order_id(creation_timestamp):
-    return "{0}_{1}".format(EXECUTION_CONFIGS.identifier, creation_timestamp)
\ No newline at end of file
+def generate_order_id(creation_timestamp, sequence_number):
+    """
+    :param creation_timestamp:
+    :param sequence_number: tells apart the orders that are created at the same timestamp
+    :return: a unique order id
+    """
+    return "{0}_{1}_{2}".format(EXECUTION_CONFIGS.identifier, creation_timestamp, sequence_number)
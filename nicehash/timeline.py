@@ -0,0 +1,103 @@
+import heapq
+from bisect import bisect_left, bisect_right, insort
+
+
+class SortedPrefixSums:
+    """
+    Keys in ascending order, each with a tuple of values, together with the running sums of the values,
+    so that the sum of the values of all keys before a given key is found with one binary search.
+    Adding a key that is not smaller than the largest key is O(1).
+    """
+
+    def __init__(self, number_of_values):
+        self.number_of_values = number_of_values
+        self.keys = []
+        # prefix_sums[i] is the sum of the values of the first i keys
+        self.prefix_sums = [(0,) * number_of_values]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, values):
+        if len(self.keys) == 0 or key >= self.keys[-1]:
+            self.keys.append(key)
+            self.prefix_sums.append(tuple(s + v for s, v in zip(self.prefix_sums[-1], values)))
+            return
+        # an out of order key shifts the sums of all larger keys
+        position = bisect_right(self.keys, key)
+        values_of_keys = [tuple(b - a for a, b in zip(self.prefix_sums[i], self.prefix_sums[i + 1]))
+                          for i in range(position, len(self.keys))]
+        self.keys.insert(position, key)
+        del self.prefix_sums[position + 1:]
+        for v in [values] + values_of_keys:
+            self.prefix_sums.append(tuple(s + x for s, x in zip(self.prefix_sums[-1], v)))
+
+    def sum_before(self, key, inclusive=False):
+        """
+        :param key:
+        :param inclusive: also counts the keys equal to the given key if True
+        :return: a tuple of the sums of the values of the keys smaller than (or equal to) the given key
+        """
+        if inclusive:
+            return self.prefix_sums[bisect_right(self.keys, key)]
+        return self.prefix_sums[bisect_left(self.keys, key)]
+
+
+class OrderTimeline:
+    """
+    The limit and price of an order over time, built from its changes.
+
+    A price change counts from right after its timestamp. A limit change of size d at timestamp t0
+    contributes d from right after t0 until the ramp of the limit passes it at t0 + |d| / rate, after which
+    it contributes sign(d) * rate * (t - t0), i.e. d + sign(d) * rate * (t - breakpoint). The limit at t is
+    therefore the sum of the limit changes before t, plus rate * (t * S - B) where S and B are the sums of
+    sign(d) and sign(d) * breakpoint over the breakpoints that t has passed.
+
+    Breakpoints are kept in a heap until a query passes them and then moved, in ascending order, into
+    prefix sums, so both queries and changes cost O(log n).
+    """
+
+    def __init__(self, limit_change_per_second):
+        self.limit_change_per_second = limit_change_per_second
+        # price changes by timestamp: (price_change,)
+        self.price_changes = SortedPrefixSums(1)
+        # limit changes by timestamp: (limit_change,)
+        self.limit_changes = SortedPrefixSums(1)
+        # passed breakpoints: (sign, sign * breakpoint)
+        self.passed_breakpoints = SortedPrefixSums(2)
+        # A heap of (breakpoint, sign) for the breakpoints no query has passed yet
+        self.pending_breakpoints = []
+        # the largest timestamp that was queried for the limit
+        self.frontier = None
+
+    def add_change(self, change_timestamp, limit_change=0, price_change=0):
+        if price_change != 0:
+            self.price_changes.add(change_timestamp, (price_change,))
+        if limit_change == 0:
+            return
+        self.limit_changes.add(change_timestamp, (limit_change,))
+        sign = 1 if limit_change > 0 else -1
+        breakpoint = change_timestamp + abs(limit_change) / self.limit_change_per_second
+        if self.frontier is not None and breakpoint <= self.frontier:
+            self.passed_breakpoints.add(breakpoint, (sign, sign * breakpoint))
+        else:
+            heapq.heappush(self.pending_breakpoints, (breakpoint, sign))
+
+    def price_at(self, timestamp):
+        return self.price_changes.sum_before(timestamp)[0]
+
+    def limit_at(self, timestamp):
+        self.pass_breakpoints_up_to(timestamp)
+        limit_change = self.limit_changes.sum_before(timestamp)[0]
+        sum_of_signs, sum_of_signed_breakpoints = self.passed_breakpoints.sum_before(timestamp, inclusive=True)
+        if sum_of_signs == 0 and sum_of_signed_breakpoints == 0:
+            return limit_change
+        return limit_change + self.limit_change_per_second * (timestamp * sum_of_signs - sum_of_signed_breakpoints)
+
+    def pass_breakpoints_up_to(self, timestamp):
+        if self.frontier is not None and timestamp <= self.frontier:
+            return
+        self.frontier = timestamp
+        while len(self.pending_breakpoints) != 0 and self.pending_breakpoints[0][0] <= timestamp:
+            breakpoint, sign = heapq.heappop(self.pending_breakpoints)
+            self.passed_breakpoints.add(breakpoint, (sign, sign * breakpoint))
@@ -0,0 +1,225 @@
+import json
+from io import BytesIO
+
+import numpy as np
+
+from configuration.constants import DAY_SECONDS
+
+# The binary COPY format: a header, rows of (field count, then length and value of each field), and a trailer
+COPY_BINARY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_BINARY_HEADER_LENGTH = len(COPY_BINARY_SIGNATURE) + 8
+COPY_BINARY_TRAILER_LENGTH = 2
+# A sample as (order key, moment, limit, price, delivered hashrate) in network byte order
+COPY_BINARY_SAMPLE_DTYPE = np.dtype([('number_of_fields', '>i2'),
+                                     ('order_key_length', '>i4'), ('order_key', '>i4'),
+                                     ('moment_length', '>i4'), ('moment', '>f8'),
+                                     ('limit_length', '>i4'), ('limit', '>f8'),
+                                     ('price_length', '>i4'), ('price', '>f8'),
+                                     ('delivered_hashrate_length', '>i4'), ('delivered_hashrate', '>f8')])
+# Samples without a delivered hashrate were delivered their limit
+DELIVERED_HASHRATE_SQL = "coalesce({0}delivered_hashrate, {0}power_limit, 0.0)"
+
+
+
+class EvaluationException(Exception):
+    pass
+
+
+class OrderInfoSamples:
+    """
+    The order info samples of a simulation as parallel arrays, sorted by order and then by moment
+    """
+
+    def __init__(self, order_ids, order_indexes, moments, limits, prices, delivered_hashrates):
+        """
+        :param order_ids: the distinct order ids, sorted
+        :param order_indexes: the index of the order of each sample in order_ids
+        :param moments: epoch seconds of the samples
+        :param limits: hashrate limits of the samples
+        :param prices: prices of the samples per unit of hashrate per day
+        :param delivered_hashrates: the hashrates the marketplace delivered to the orders at the samples
+        """
+        self.order_ids = order_ids
+        self.order_indexes = order_indexes
+        self.moments = moments
+        self.limits = limits
+        self.prices = prices
+        self.delivered_hashrates = delivered_hashrates
+
+    def __len__(self):
+        return len(self.moments)
+
+
+def load_order_info_samples(db_handler, table_name):
+    """
+    Loads all samples of a simulation table with one binary COPY straight into arrays. The orders of the
+    samples are identified by the hash of their id, and the rows are sorted here, because the database is slow
+    to sort or join on the wide order id column.
+    :param db_handler: the SimulationDatabaseHandler
+    :param table_name: the table of the simulation
+    :return: an OrderInfoSamples
+    """
+    if not db_handler.supports_copy_select_to_stream():
+        return select_order_info_samples(db_handler, table_name)
+    orders = db_handler.execute_select(select_sql_query="""SELECT rtrim(order_id), hashtext(order_id) 
+    FROM (SELECT DISTINCT order_id FROM {0}) d ORDER BY order_id;""".format(table_name))
+    order_ids = [o[0] for o in orders]
+    order_keys = np.array([o[1] for o in orders], dtype=np.int64)
+    if len(np.unique(order_keys)) == len(order_keys):
+        order_key_query = """SELECT hashtext(order_id), extract(epoch FROM moment)::double precision, 
+        coalesce(power_limit, 0.0), coalesce(price, 0.0), {1} FROM {0}""".format(
+            table_name, DELIVERED_HASHRATE_SQL.format(""))
+    else:
+        # the ranks of the order ids tell the orders with colliding hashes apart
+        order_keys = np.arange(len(order_ids), dtype=np.int64)
+        order_key_query = """SELECT o.order_rank::integer, extract(epoch FROM s.moment)::double precision, 
+        coalesce(s.power_limit, 0.0), coalesce(s.price, 0.0), {1}
+        FROM {0} s JOIN (SELECT order_id, row_number() OVER (ORDER BY order_id) - 1 AS order_rank
+                         FROM (SELECT DISTINCT order_id FROM {0}) d) o USING (order_id)""".format(
+            table_name, DELIVERED_HASHRATE_SQL.format("s."))
+    stream = BytesIO()
+    db_handler.copy_select_to_stream(order_key_query, stream, binary=True)
+    rows = parse_copy_binary_samples(stream.getbuffer())
+    order_keys_sorter = np.argsort(order_keys)
+    order_indexes = order_keys_sorter[np.searchsorted(order_keys, rows['order_key'].astype(np.int64),
+                                                      sorter=order_keys_sorter)]
+    order = np.lexsort((rows['moment'], order_indexes))
+    return OrderInfoSamples(order_ids=order_ids,
+                            order_indexes=order_indexes[order],
+                            moments=rows['moment'][order].astype(np.float64),
+                            limits=rows['limit'][order].astype(np.float64),
+                            prices=rows['price'][order].astype(np.float64),
+                            delivered_hashrates=rows['delivered_hashrate'][order].astype(np.float64))
+
+
+def select_order_info_samples(db_handler, table_name):
+    """
+    Loads all samples of a simulation table with a plain select, for the backends that cannot COPY
+    :param db_handler: the SimulationDatabaseHandler
+    :param table_name: the table of the simulation
+    :return: an OrderInfoSamples
+    """
+    rows = db_handler.execute_select(select_sql_query="""SELECT order_id, {0}, coalesce(power_limit, 0.0), 
+    coalesce(price, 0.0), {1} FROM {2};""".format(db_handler.epoch_seconds_sql('moment'),
+                                                 DELIVERED_HASHRATE_SQL.format(""), table_name))
+    order_ids, order_indexes = np.unique(np.array([r[0].rstrip() for r in rows], dtype=object), return_inverse=True)
+    moments = np.array([r[1] for r in rows], dtype=np.float64)
+    limits = np.array([r[2] for r in rows], dtype=np.float64)
+    prices = np.array([r[3] for r in rows], dtype=np.float64)
+    delivered_hashrates = np.array([r[4] for r in rows], dtype=np.float64)
+    order = np.lexsort((moments, order_indexes))
+    return OrderInfoSamples(order_ids=list(order_ids),
+                            order_indexes=order_indexes[order].astype(np.int64),
+                            moments=moments[order],
+                            limits=limits[order],
+                            prices=prices[order],
+                            delivered_hashrates=delivered_hashrates[order])
+
+
+def parse_copy_binary_samples(buffer):
+    """
+    :param buffer: the output of a binary COPY of (integer, double, double, double, double) rows without NULLs
+    :return: a structured array of COPY_BINARY_SAMPLE_DTYPE
+    """
+    if bytes(buffer[:len(COPY_BINARY_SIGNATURE)]) != COPY_BINARY_SIGNATURE:
+        raise EvaluationException("The samples are not in the binary COPY format.")
+    number_of_rows, remainder = divmod(len(buffer) - COPY_BINARY_HEADER_LENGTH - COPY_BINARY_TRAILER_LENGTH,
+                                       COPY_BINARY_SAMPLE_DTYPE.itemsize)
+    if remainder != 0:
+        raise EvaluationException("The binary COPY of the samples has rows of an unexpected size.")
+    rows = np.frombuffer(buffer, dtype=COPY_BINARY_SAMPLE_DTYPE, count=number_of_rows,
+                         offset=COPY_BINARY_HEADER_LENGTH)
+    if np.any(rows['number_of_fields'] != 5) or np.any(rows['order_key_length'] != 4) or \
+            np.any(rows['moment_length'] != 8) or np.any(rows['limit_length'] != 8) or \
+            np.any(rows['price_length'] != 8) or np.any(rows['delivered_hashrate_length'] != 8):
+        raise EvaluationException("The binary COPY of the samples has rows of an unexpected layout.")
+    return rows
+
+
+def calculate_sample_durations(order_indexes, moments):
+    """
+    A sample holds until the next sample of the same order; the last sample of an order does not last
+    :param order_indexes: sorted
+    :param moments: sorted within each order
+    :return: an array of the seconds each sample lasts
+    """
+    durations = np.zeros(len(moments), dtype=np.float64)
+    if len(moments) > 1:
+        same_order = order_indexes[1:] == order_indexes[:-1]
+        durations[:-1] = np.where(same_order, moments[1:] - moments[:-1], 0.0)
+    return durations
+
+
+def evaluate_simulation(samples, block_moments):
+    """
+    Calculates what the orders of a simulation cost and delivered, and how they lined up with the blocks
+    that were found while they ran. The delivered hashrate and price of a sample hold from its moment until the
+    next sample of the order; the price is per unit of hashrate per day, and is paid for the delivered hashrate.
+    :param samples: an OrderInfoSamples
+    :param block_moments: a sorted array of the epoch seconds of the blocks of the pool
+    :return: a dictionary with the totals and the results of each order
+    """
+    number_of_orders = len(samples.order_ids)
+    durations = calculate_sample_durations(samples.order_indexes, samples.moments)
+    hashrate_times = samples.delivered_hashrates * durations
+    spends = samples.prices * hashrate_times / DAY_SECONDS
+
+    # the blocks found while each sample was delivering hashrate, in [moment, moment + duration)
+    delivering = (samples.delivered_hashrates > 0) & (durations > 0)
+    blocks_during_samples = np.where(delivering,
+                                     np.searchsorted(block_moments, samples.moments + durations, side='left') -
+                                     np.searchsorted(block_moments, samples.moments, side='left'), 0)
+    hashrates_at_blocks = samples.delivered_hashrates * blocks_during_samples
+
+    def sum_per_order(values):
+        return np.bincount(samples.order_indexes, weights=values, minlength=number_of_orders)
+
+    samples_per_order = np.bincount(samples.order_indexes, minlength=number_of_orders)
+    spend_per_order = sum_per_order(spends)
+    hashrate_time_per_order = sum_per_order(hashrate_times)
+    blocks_per_order = sum_per_order(blocks_during_samples)
+    hashrate_at_blocks_per_order = sum_per_order(hashrates_at_blocks)
+
+    begin_timestamp = float(samples.moments.min()) if len(samples) != 0 else None
+    end_timestamp = float(samples.moments.max()) if len(samples) != 0 else None
+    blocks_with_hashrate = 0
+    if len(samples) != 0:
+        # the number of delivering samples is a step function that changes at the start and end of each of them
+        event_moments = np.concatenate((samples.moments, samples.moments + durations))
+        event_changes = np.concatenate((delivering.astype(np.int64), -delivering.astype(np.int64)))
+        event_order = np.argsort(event_moments, kind='stable')
+        numbers_of_delivering_samples = np.cumsum(event_changes[event_order])
+        block_event_indexes = np.searchsorted(event_moments[event_order], block_moments, side='right') - 1
+        delivering_at_blocks = (block_event_indexes >= 0) & \
+                               (numbers_of_delivering_samples[np.maximum(block_event_indexes, 0)] > 0)
+        blocks_with_hashrate = int(np.count_nonzero(delivering_at_blocks))
+
+    return {
+        'samples': len(samples),
+        'orders': number_of_orders,
+        'begin_timestamp': begin_timestamp,
+        'end_timestamp': end_timestamp,
+        'total_spend': float(spend_per_order.sum()),
+        'total_hashrate_time': float(hashrate_time_per_order.sum()),
+        'blocks': int(len(block_moments)),
+        'blocks_with_hashrate': blocks_with_hashrate,
+        'hashrate_at_blocks': float(hashrate_at_blocks_per_order.sum()),
+        'per_order': {
+            order_id: {
+                'samples': int(samples_per_order[i]),
+                'spend': float(spend_per_order[i]),
+                'hashrate_time': float(hashrate_time_per_order[i]),
+                'blocks': int(blocks_per_order[i]),
+                'hashrate_at_blocks': float(hashrate_at_blocks_per_order[i]),
+            } for i, order_id in enumerate(samples.order_ids)
+        },
+    }
+
+
+def write_evaluation_summary(summary, file_full_path):
+    """
+    Writes the summary as JSON
+    :return: None
+    """
+    with open(file_full_path, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=1, sort_keys=True)
@@ -1,15 +1,24 @@
 import os
 import glob
+import json
 from threading import Lock
-from time import sleep
-from pathlib import Path
-from clock import get_clock
+from time import monotonic
 from clock.clock import calculate_tick_duration_from_sleep_duration
 from clock.tick_performer import TickPerformer
 from configuration import EXECUTION_CONFIGS, is_new_simulation_going_to_happen
 from data_bank import get_database_handler, get_simulation_database_handler
+from data_bank.sample_writer import SampleWriterException
 from nicehash import get_nice_hash_driver
+from simulation_evaluator.evaluation import load_order_info_samples, evaluate_simulation, write_evaluation_summary
 from utility.log import logger
+from utility.metrics import get_metrics_registry
+
+EVALUATED_SAMPLES = get_metrics_registry().counter(
+    'smart_miner_evaluator_samples_total', "Order info samples that simulations were evaluated on")
+EVALUATION_DURATION = get_metrics_registry().histogram(
+    'smart_miner_evaluator_evaluation_duration_seconds', "Seconds an evaluation of a simulation took")
+EVALUATION_THROUGHPUT = get_metrics_registry().gauge(
+    'smart_miner_evaluator_samples_per_second', "Samples per second of the latest evaluation of a simulation")
 
 
 class SimulationEvaluator(TickPerformer):
@@ -20,13 +29,15 @@ class SimulationEvaluator(TickPerformer):
         A singleton class that is the simulation evaluator
         """
         super().__init__()
-        self.tick_duration = calculate_tick_duration_from_sleep_duration(
-            EXECUTION_CONFIGS.simulation_evaluator_sleep_duration)
+        self.sleep_duration = EXECUTION_CONFIGS.simulation_evaluator_sleep_duration
+        self.tick_duration = calculate_tick_duration_from_sleep_duration(self.sleep_duration)
         self.simulation_db_handler = get_simulation_database_handler()
         self.simulation_driver = get_nice_hash_driver()
         self.current_simulation_identifier = EXECUTION_CONFIGS.identifier
+        self.proof_recorded = False
+        self.evaluation = None
 
-    def run(self, should_stop):
+    def before_ticks(self):
         # prepare the simulation database at the beginning of the evaluation
         proven_simulation_identifiers = None
         if EXECUTION_CONFIGS.clean_simulation_database:
@@ -34,57 +45,121 @@ class SimulationEvaluator(TickPerformer):
         self.simulation_db_handler.prepare_for_simulation(
             proven_simulation_identifiers=proven_simulation_identifiers)
         # start taking samples if a new simulation is going to happen
-        if not is_new_simulation_going_to_happen():
-            return
-        while True:
-            if should_stop():
-                break
-            sleep(self.tick_duration)
-            current_timestamp = get_clock().read_timestamp_of_now()
-            logger('simulation/evaluator').debug("Updating evaluations at timestamp {0}.".format(current_timestamp))
-            # fetch new order samples from the driver and record them in the database
-            self.save_new_order_data_samples(current_timestamp=current_timestamp)
-            # check if we are at the time of ending the simulation stop
-            if current_timestamp >= EXECUTION_CONFIGS.simulation_end_timestamp:
-                # TODO: calculate the results of the evaluation and write it to file as proof
-                # write the proof
-                simulation_proof_file_name = "{0}{1}".format(self.current_simulation_identifier,
-                                                             self.SIMULATION_PROOF_NAME_EXTENSION)
-                simulation_proof_file_full_path = os.path.join(EXECUTION_CONFIGS.simulation_summaries_data_dir,
-                                                               simulation_proof_file_name)
-                Path(simulation_proof_file_full_path).touch()
-                logger('simulation/evaluator').debug(
-                    "Recorded evaluation proof {0}.".format(simulation_proof_file_full_path))
-                return
+        return is_new_simulation_going_to_happen()
+
+    def perform_tick(self, current_timestamp):
+        logger('simulation/evaluator').debug("Updating evaluations at timestamp {0}.", current_timestamp)
+        # fetch new order samples from the driver and record them in the database
+        self.save_new_order_data_samples(current_timestamp=current_timestamp)
+        # check if we are at the time of ending the simulation stop
+        if current_timestamp < EXECUTION_CONFIGS.simulation_end_timestamp:
+            return False
+        # make sure all samples are in the database before the simulation is proven
+        try:
+            self.simulation_db_handler.flush_order_info_samples()
+        except SampleWriterException as e:
+            # an evaluation of the incomplete samples must not be proven
+            logger('simulation/evaluator').error("The simulation cannot be proven: {0}", e)
+            return True
+        # calculate the results of the evaluation and write them to file as proof
+        self.evaluation = self.evaluate()
+        simulation_proof_file_name = "{0}{1}".format(self.current_simulation_identifier,
+                                                     self.SIMULATION_PROOF_NAME_EXTENSION)
+        simulation_proof_file_full_path = os.path.join(EXECUTION_CONFIGS.simulation_summaries_data_dir,
+                                                       simulation_proof_file_name)
+        write_evaluation_summary(self.evaluation, simulation_proof_file_full_path)
+        self.simulation_db_handler.record_simulation_proof(self.current_simulation_identifier, self.evaluation,
+                                                           begin_timestamp=EXECUTION_CONFIGS.clock_start_timestamp,
+                                                           end_timestamp=current_timestamp)
+        self.proof_recorded = True
         logger('simulation/evaluator').debug(
-            "Terminating without recording the proof.")
+            "Recorded evaluation proof {0}.", simulation_proof_file_full_path)
+        return True
+
+    def after_ticks(self):
+        if not self.proof_recorded:
+            logger('simulation/evaluator').debug(
+                "Terminating without recording the proof.")
 
     def post_run(self):
+        self.simulation_db_handler.close_order_info_sample_writer()
         logger('simulation/evaluator').info("Simulation evaluator is terminating.")
 
     def is_a_daemon(self):
         return False
 
+    def evaluate(self):
+        """
+        Evaluates the samples of the current simulation against the blocks that were found meanwhile
+        :return: the summary of the evaluation
+        """
+        evaluation_begin = monotonic()
+        samples = load_order_info_samples(self.simulation_db_handler,
+                                          self.simulation_db_handler.current_simulation_table_name)
+        block_moments = get_database_handler().get_block_moments_between(EXECUTION_CONFIGS.clock_start_timestamp,
+                                                                          EXECUTION_CONFIGS.simulation_end_timestamp)
+        evaluation = evaluate_simulation(samples, block_moments)
+        evaluation['identifier'] = self.current_simulation_identifier
+        evaluation_time = monotonic() - evaluation_begin
+        EVALUATED_SAMPLES.labels().inc(len(samples))
+        EVALUATION_DURATION.labels().observe(evaluation_time)
+        if evaluation_time > 0:
+            EVALUATION_THROUGHPUT.labels().set(len(samples) / evaluation_time)
+        logger('simulation/evaluator').info(
+            "Evaluated {0} samples of {1} orders in {2:.3f} seconds.", len(samples), len(samples.order_ids),
+            evaluation_time)
+        return evaluation
+
+    def get_summary(self):
+        """
+        :return: a dictionary that summarizes the simulation
+        """
+        summary = {
+            'identifier': self.current_simulation_identifier,
+            'proof_recorded': self.proof_recorded,
+            'orders': len(self.simulation_driver.get_orders()),
+        }
+        if self.evaluation is not None:
+            summary.update({k: v for k, v in self.evaluation.items() if k != 'per_order'})
+        if self.simulation_db_handler.order_info_sample_writer is not None:
+            writer_statistics = self.simulation_db_handler.order_info_sample_writer.get_statistics()
+            summary['samples_written'] = writer_statistics['samples_written']
+            summary['samples_failed'] = writer_statistics['samples_failed']
+        return summary
+
     def save_new_order_data_samples(self, current_timestamp):
-        all_orders = self.simulation_driver.get_orders()
-        for o in all_orders:
-            id = o.order_id
-            limit = o.calculate_limit_at(current_timestamp)
-            price = o.calculate_price_at(current_timestamp)
+        for id, limit, price, delivered_hashrate in self.simulation_driver.get_deliveries_at(current_timestamp):
             self.simulation_db_handler.insert_order_info_sample(order_id=id,
                                                                 timestamp=current_timestamp,
                                                                 limit=limit,
-                                                                price=price)
+                                                                price=price,
+                                                                delivered_hashrate=delivered_hashrate)
 
     def get_proven_simulation_identifiers(self):
-        proven_identifiers = []
+        """
+        :return: the set of the identifiers of the proven simulations
+        """
+        if not self.simulation_db_handler.are_legacy_simulation_proofs_imported():
+            self.import_legacy_simulation_proofs()
+        return self.simulation_db_handler.get_proven_simulation_identifiers()
 
+    def import_legacy_simulation_proofs(self):
+        """
+        Registers the simulations whose proof files were written before the proof registry existed
+        :return: None
+        """
+        proofs = []
         directory_path = EXECUTION_CONFIGS.simulation_summaries_data_dir
         file_format = "*{0}".format(self.SIMULATION_PROOF_NAME_EXTENSION)
         file_search_pattern = os.path.join(directory_path, file_format)
         for file_name in glob.glob(file_search_pattern):
-            if file_name not in self.data_files_loaded:
-                simulation_identifier = os.path.basename(file_name)[
-                                        :file_name.find(self.SIMULATION_PROOF_NAME_EXTENSION)]
-                proven_identifiers.append(simulation_identifier)
-        return proven_identifiers
+            simulation_identifier = os.path.basename(file_name)[:-len(self.SIMULATION_PROOF_NAME_EXTENSION)]
+            summary = None
+            try:
+                with open(file_name) as proof_file:
+                    summary = json.load(proof_file)
+            except ValueError:
+                # proof files used to be empty
+                pass
+            proofs.append((simulation_identifier, summary,))
+        self.simulation_db_handler.import_legacy_simulation_proofs(proofs)
@@ -0,0 +1,254 @@
+"""
+Runs a simulation for every combination of config overrides, each in a worker process of its own, and writes
+one row per run into a CSV result table.
+
+The grid file has the sections of the config file, with a list of values to try for each entry:
+
+    simulation:
+      controller_sleep_duration: ["60", "120"]
+      clock_scheduling: ["|||virtual"]
+
+Each value overrides the entry of the same name for the whole run, whichever section of the config file has it.
+When a grid names an entry in both sections, the simulation one wins.
+
+A run whose worker process dies, e.g. killed for running out of memory, is recorded as failed as soon as it dies.
+A run that has not returned --run-timeout seconds after its worker started is recorded as failed, and its worker
+is killed to make room for the next run.
+
+Usage: python sweep.py grid.yaml [--config files/config.yaml] [--processes 4] [--output sweep.csv]
+                                 [--run-timeout 7200]
+"""
+import argparse
+import csv
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+
+import yaml
+
+RESULT_COLUMNS = ['run', 'identifier', 'status', 'exit_code', 'seconds', 'error']
+# Seconds a run may take before it is recorded as failed
+DEFAULT_RUN_TIMEOUT = 2 * 60 * 60
+# Seconds a worker that sent its result may take to exit, e.g. while threads of the run are still stopping
+WORKER_EXIT_TIMEOUT = 10
+
+
+def read_grid(grid_file_path):
+    """
+    :param grid_file_path:
+    :return: a list of ((section, key), list of values) tuples
+    """
+    with open(grid_file_path) as grid_file:
+        grid_raw_data = yaml.safe_load(grid_file)
+    grid = []
+    for section, entries in grid_raw_data.items():
+        for key, values in entries.items():
+            if not isinstance(values, list):
+                values = [values]
+            # the config file keeps every value as a string
+            grid.append(((section, key,), [str(v) for v in values],))
+    return grid
+
+
+def generate_variants(grid):
+    """
+    :param grid: a list of ((section, key), list of values) tuples
+    :return: a list of dictionaries from (section, key) to value, one for each combination of the values
+    """
+    entries = [entry for entry, _ in grid]
+    return [dict(zip(entries, combination)) for combination in itertools.product(*[values for _, values in grid])]
+
+
+def build_variant_overrides(overrides, identifier):
+    """
+    Runs never clean the simulation database, since that would drop the tables of the runs that are still
+    going on, and do not export metrics.
+    :param overrides: a dictionary from (section, key) to the value of the entry as written in a config file
+    :param identifier: the identifier of the simulation of the run
+    :return: a dictionary of evaluated config entries
+    """
+    from configuration.configs import evaluate_value
+
+    variant_overrides = {}
+    for (section, key), value in sorted(overrides.items(), key=lambda o: o[0][0] == 'simulation'):
+        variant_overrides[key] = evaluate_value(value)
+    variant_overrides['identifier'] = identifier
+    variant_overrides['clean_simulation_database'] = False
+    # the runs would all export into the same file and port
+    variant_overrides['metrics_file_path'] = None
+    variant_overrides['metrics_http_port'] = None
+    return variant_overrides
+
+
+def create_failed_result(run, error=''):
+    index, identifier, _, overrides = run
+    result = {'run': index, 'identifier': identifier, 'status': 'failed', 'exit_code': None, 'error': error}
+    result.update({"{0}.{1}".format(section, key): value for (section, key), value in overrides.items()})
+    return result
+
+
+def run_variant(run):
+    """
+    Runs one simulation in a worker process. Singletons are set up once per process, which is why every worker
+    performs a single run.
+    :param run: a tuple (index, identifier, config file path, overrides)
+    :return: a dictionary with the result of the run and the summary of the simulation
+    """
+    index, identifier, config_file_path, overrides = run
+    result = create_failed_result(run)
+    begin = time.time()
+    try:
+        import configuration
+        import main
+        from simulation_evaluator import get_simulation_evaluator
+        configuration.configure(config_file_path, overrides=build_variant_overrides(overrides, identifier),
+                                runtime_mode=configuration.RuntimeMode.SIMULATION)
+        result['exit_code'] = main.run_execution()
+        summary = get_simulation_evaluator().get_summary()
+        result.update(summary)
+        if result['exit_code'] == 0 and summary['proof_recorded']:
+            result['status'] = 'succeeded'
+    except BaseException as e:
+        result['error'] = repr(e)
+    result['seconds'] = round(time.time() - begin, 3)
+    return result
+
+
+def run_variant_in_worker(run, result_connection):
+    """
+    The target of the worker process of a run, which sends the result of the run to the sweep
+    :param run: a tuple (index, identifier, config file path, overrides)
+    :param result_connection: the sending end of a pipe to the sweep
+    :return: None
+    """
+    try:
+        result_connection.send(run_variant(run))
+    finally:
+        result_connection.close()
+
+
+class RunningVariant:
+    """
+    A run whose worker process was started
+    """
+
+    def __init__(self, run, process, result_connection):
+        self.run = run
+        self.process = process
+        # the receiving end of the pipe from the worker, which is at its end if the worker died without a result
+        self.result_connection = result_connection
+        self.begin = time.time()
+
+    def stop(self, exit_timeout=0):
+        """
+        Waits for the worker to exit, kills it if it does not, and closes the pipe
+        :return: None
+        """
+        self.process.join(exit_timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.result_connection.close()
+
+    def receive_result(self):
+        """
+        :return: the result that the worker sent, or a failed result if the worker died before it sent one
+        """
+        try:
+            result = self.result_connection.recv()
+        except EOFError:
+            self.stop()
+            result = create_failed_result(self.run, error="worker process died with exit code {0}".format(
+                self.process.exitcode))
+            result['seconds'] = round(time.time() - self.begin, 3)
+            return result
+        self.stop(exit_timeout=WORKER_EXIT_TIMEOUT)
+        return result
+
+    def time_out(self, run_timeout):
+        """
+        Kills the worker
+        :return: a failed result
+        """
+        self.stop()
+        result = create_failed_result(self.run, error="timed out after {0} seconds".format(run_timeout))
+        result['seconds'] = round(time.time() - self.begin, 3)
+        return result
+
+
+def write_results(results, output_file_path):
+    columns = list(RESULT_COLUMNS)
+    for result in results:
+        columns += [c for c in result.keys() if c not in columns]
+    with open(output_file_path, 'w', newline='') as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=columns)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+
+
+def run_sweep(grid_file_path, config_file_path, number_of_processes, output_file_path,
+              run_timeout=DEFAULT_RUN_TIMEOUT):
+    """
+    Runs all variants of the grid, each in a worker process of its own, with at most number_of_processes of them
+    at a time. A failed, dead or timed out run is recorded in the result table and does not stop the other runs.
+    :param run_timeout: seconds a run may take from the start of its worker, or None to wait as long as it takes
+    :return: the list of results, ordered by run
+    """
+    config_file_path = os.path.abspath(config_file_path)
+    variants = generate_variants(read_grid(grid_file_path))
+    sweep_identifier = "sweep{0}".format(int(time.time()))
+    runs = [(index, "{0}_{1}".format(sweep_identifier, index), config_file_path, overrides,)
+            for index, overrides in enumerate(variants)]
+    # fresh interpreters, so that no threads or connections of this process are inherited
+    context = multiprocessing.get_context('spawn')
+    pending_runs = list(reversed(runs))
+    # A map from the receiving end of the pipe of each running variant to it
+    running_variants = {}
+    results = []
+    try:
+        while len(pending_runs) != 0 or len(running_variants) != 0:
+            while len(pending_runs) != 0 and len(running_variants) < number_of_processes:
+                run = pending_runs.pop()
+                result_connection, worker_connection = context.Pipe(duplex=False)
+                process = context.Process(target=run_variant_in_worker, args=(run, worker_connection,))
+                process.start()
+                # only the worker holds the sending end, so the pipe ends when the worker dies
+                worker_connection.close()
+                running_variants[result_connection] = RunningVariant(run, process, result_connection)
+            timeout = None
+            if run_timeout is not None:
+                first_begin = min(v.begin for v in running_variants.values())
+                timeout = max(0.0, first_begin + run_timeout - time.time())
+            for result_connection in multiprocessing.connection.wait(list(running_variants), timeout=timeout):
+                results.append(running_variants.pop(result_connection).receive_result())
+            if run_timeout is not None:
+                for result_connection, variant in list(running_variants.items()):
+                    if time.time() - variant.begin >= run_timeout:
+                        results.append(running_variants.pop(result_connection).time_out(run_timeout))
+    finally:
+        for variant in running_variants.values():
+            variant.stop()
+    results.sort(key=lambda r: r['run'])
+    write_results(results, output_file_path)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a simulation for every combination of config overrides.")
+    parser.add_argument('grid', help="a YAML file with a list of values for each overridden config entry")
+    parser.add_argument('--config', default="files/config.yaml", help="the base config file")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help="the number of worker processes")
+    parser.add_argument('--output', default="sweep-{0}.csv".format(int(time.time())), help="the result table")
+    parser.add_argument('--run-timeout', type=float, default=DEFAULT_RUN_TIMEOUT,
+                        help="seconds a run may take before it is recorded as failed")
+    arguments = parser.parse_args()
+    sweep_results = run_sweep(arguments.grid, arguments.config, arguments.processes, arguments.output,
+                              run_timeout=arguments.run_timeout)
+    number_of_failed_runs = len([r for r in sweep_results if r['status'] != 'succeeded'])
+    print("{0} runs, {1} failed. Results are in {2}.".format(len(sweep_results), number_of_failed_runs,
+                                                            arguments.output))
+    sys.exit(0 if number_of_failed_runs == 0 else 1)
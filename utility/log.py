@@ -1,14 +1,217 @@
+import atexit
+import copy
 import logging
+import logging.handlers
+import queue
+from threading import Lock
+from time import monotonic
 
-
-# Initialize the logging utility
 from configuration import EXECUTION_CONFIGS
 
-FORMAT = EXECUTION_CONFIGS.log_format
-logging.basicConfig(level=logging.DEBUG, format=FORMAT)
+LOGGING_SET_UP = False
+LOGGING_SET_UP_LOCK = Lock()
+# Formats and writes the records off the threads that log them, when logging is asynchronous
+LOG_QUEUE_LISTENER = None
+
+# The loggers of the components by name
+COMPONENT_LOGGERS = {}
+COMPONENT_LOGGERS_LOCK = Lock()
+
+
+class LazyMessage:
+    """
+    A log message that is only formatted when a handler writes it
+    """
+
+    def __init__(self, message, arguments, number_of_suppressed_messages=0):
+        """
+        :param message: a message in the str.format syntax, taken as it is if there are no arguments
+        :param arguments: a tuple of the positional arguments of the message
+        :param number_of_suppressed_messages: the number of messages of the component that the rate limit dropped
+        since the previous one that was let through
+        """
+        self.message = message
+        self.arguments = arguments
+        self.number_of_suppressed_messages = number_of_suppressed_messages
+
+    def __str__(self):
+        message = self.message.format(*self.arguments) if len(self.arguments) != 0 else self.message
+        if self.number_of_suppressed_messages != 0:
+            return "{0} ({1} earlier messages were suppressed)".format(message, self.number_of_suppressed_messages)
+        return message
+
+
+class RateLimit:
+    """
+    Lets at most a number of messages through in every window of time
+    """
+
+    def __init__(self, max_messages, interval):
+        """
+        :param max_messages: the number of messages let through in each window
+        :param interval: seconds of a window
+        """
+        self.max_messages = max_messages
+        self.interval = interval
+        self.window_begin = monotonic()
+        self.number_of_messages_in_window = 0
+        self.number_of_suppressed_messages = 0
+        self.mutex = Lock()
+
+    def admit(self):
+        """
+        :return: None if the message is to be dropped, or else the number of messages dropped since the
+        previous one that was admitted
+        """
+        self.mutex.acquire()
+        try:
+            now = monotonic()
+            if now - self.window_begin >= self.interval:
+                self.window_begin = now
+                self.number_of_messages_in_window = 0
+            if self.number_of_messages_in_window >= self.max_messages:
+                self.number_of_suppressed_messages += 1
+                return None
+            self.number_of_messages_in_window += 1
+            number_of_suppressed_messages = self.number_of_suppressed_messages
+            self.number_of_suppressed_messages = 0
+            return number_of_suppressed_messages
+        finally:
+            self.mutex.release()
+
+
+class ComponentLogger:
+    """
+    The logger of a component. The message of a call is given in the str.format syntax with its arguments,
+    and it is neither formatted nor queued unless the level of the call is enabled:
+
+        logger('controller').debug("Updating controller at timestamp {0}.", current_timestamp)
+    """
+
+    def __init__(self, name, level, rate_limit=None):
+        self.name = name
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(level)
+        self.rate_limit = rate_limit
+
+    def is_enabled_for(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, message, *arguments, exc_info=False):
+        if not self.logger.isEnabledFor(level):
+            return
+        number_of_suppressed_messages = 0
+        if self.rate_limit is not None:
+            number_of_suppressed_messages = self.rate_limit.admit()
+            if number_of_suppressed_messages is None:
+                return
+        self.logger.log(level, LazyMessage(message, arguments, number_of_suppressed_messages), exc_info=exc_info)
+
+    def debug(self, message, *arguments, exc_info=False):
+        self.log(logging.DEBUG, message, *arguments, exc_info=exc_info)
+
+    def info(self, message, *arguments, exc_info=False):
+        self.log(logging.INFO, message, *arguments, exc_info=exc_info)
+
+    def warning(self, message, *arguments, exc_info=False):
+        self.log(logging.WARNING, message, *arguments, exc_info=exc_info)
+
+    warn = warning
+
+    def error(self, message, *arguments, exc_info=False):
+        self.log(logging.ERROR, message, *arguments, exc_info=exc_info)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues the records as they are, so that their messages are formatted on the thread of the listener
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info:
+            # the traceback is only at hand on the thread that logs it
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def set_up_logging():
+    """
+    Initializes the logging utility with the configured format, once. Unless the root logger already has
+    handlers, the records are written to stderr, by a listener thread if logging is asynchronous.
+    :return: None
+    """
+    global LOGGING_SET_UP, LOG_QUEUE_LISTENER
+    if LOGGING_SET_UP:
+        return
+    LOGGING_SET_UP_LOCK.acquire()
+    try:
+        if not LOGGING_SET_UP:
+            root_logger = logging.getLogger()
+            if len(root_logger.handlers) == 0:
+                root_logger.setLevel(logging.DEBUG)
+                stream_handler = logging.StreamHandler()
+                stream_handler.setFormatter(logging.Formatter(EXECUTION_CONFIGS.log_format))
+                if EXECUTION_CONFIGS.log_asynchronously:
+                    log_queue = queue.Queue(-1)
+                    root_logger.addHandler(LogQueueHandler(log_queue))
+                    LOG_QUEUE_LISTENER = logging.handlers.QueueListener(log_queue, stream_handler,
+                                                                        respect_handler_level=True)
+                    LOG_QUEUE_LISTENER.start()
+                    atexit.register(stop_logging)
+                else:
+                    root_logger.addHandler(stream_handler)
+            LOGGING_SET_UP = True
+    finally:
+        LOGGING_SET_UP_LOCK.release()
+
+
+def stop_logging():
+    """
+    Writes the records that are still queued and stops the listener thread
+    :return: None
+    """
+    global LOG_QUEUE_LISTENER
+    LOGGING_SET_UP_LOCK.acquire()
+    try:
+        if LOG_QUEUE_LISTENER is not None:
+            LOG_QUEUE_LISTENER.stop()
+            LOG_QUEUE_LISTENER = None
+    finally:
+        LOGGING_SET_UP_LOCK.release()
+
+
+def set_rate_limit(name, max_messages, interval=1):
+    """
+    Limits the number of messages a component logs in every window of time; the next message that is let
+    through tells how many were dropped
+    :param name: the name of the logger of the component
+    :param max_messages: None to remove the limit
+    :param interval: seconds
+    :return: None
+    """
+    logger(name).rate_limit = RateLimit(max_messages, interval) if max_messages is not None else None
 
 
 def logger(name):
-    logger_ = logging.getLogger(name)
-    logger_.setLevel(EXECUTION_CONFIGS.log_level)
-    return logger_
+    """
+    :param name: the name of the component
+    :return: the ComponentLogger of the component, created on the first call
+    """
+    component_logger = COMPONENT_LOGGERS.get(name)
+    if component_logger is None:
+        set_up_logging()
+        COMPONENT_LOGGERS_LOCK.acquire()
+        try:
+            component_logger = COMPONENT_LOGGERS.get(name)
+            if component_logger is None:
+                rate_limit = None
+                max_messages_per_second = EXECUTION_CONFIGS.log_rate_limits.get(name)
+                if max_messages_per_second is not None:
+                    rate_limit = RateLimit(max_messages_per_second, 1)
+                component_logger = ComponentLogger(name, EXECUTION_CONFIGS.log_level, rate_limit=rate_limit)
+                COMPONENT_LOGGERS[name] = component_logger
+        finally:
+            COMPONENT_LOGGERS_LOCK.release()
+    return component_logger
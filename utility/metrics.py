@@ -0,0 +1,359 @@
+import os
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread, Event
+
+from configuration import EXECUTION_CONFIGS
+from utility.log import logger
+
+# Upper bounds of the buckets of histograms of durations, in seconds
+DEFAULT_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                            30.0, 60.0,)
+PROMETHEUS_TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsException(Exception):
+    pass
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(label_names, label_values, extra_label=None):
+    """
+    :param extra_label: a (name, value) tuple added after the others, e.g. the bucket of a histogram
+    :return: the labels in the exposition format, e.g. {performer="Clock"}, or an empty string
+    """
+    pairs = ['{0}="{1}"'.format(n, escape_label_value(v)) for n, v in zip(label_names, label_values)]
+    if extra_label is not None:
+        pairs.append('{0}="{1}"'.format(extra_label[0], escape_label_value(extra_label[1])))
+    return "{{{0}}}".format(",".join(pairs)) if len(pairs) != 0 else ""
+
+
+def format_number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+        self.mutex = Lock()
+
+    def inc(self, amount=1):
+        self.mutex.acquire()
+        try:
+            self.value += amount
+        finally:
+            self.mutex.release()
+
+    def get(self):
+        return self.value
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        # a single assignment, so no lock is needed
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the number of observations in each bucket alone, the last one being +Inf
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.mutex = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        self.mutex.acquire()
+        try:
+            self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+        finally:
+            self.mutex.release()
+
+    def get(self):
+        """
+        :return: a tuple (cumulative bucket counts, sum, count)
+        """
+        self.mutex.acquire()
+        try:
+            bucket_counts = list(self.bucket_counts)
+            observed_sum = self.sum
+            count = self.count
+        finally:
+            self.mutex.release()
+        cumulative_counts = []
+        total = 0
+        for c in bucket_counts:
+            total += c
+            cumulative_counts.append(total)
+        return cumulative_counts, observed_sum, count
+
+
+class Metric:
+    """
+    A family of values of one kind that are told apart by their labels
+    """
+    type_name = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        # A map from a tuple of label values to the value with those labels
+        self.values = {}
+        self.values_mutex = Lock()
+
+    def create_value(self):
+        raise NotImplementedError()
+
+    def labels(self, *label_values):
+        """
+        :return: the value with the given labels, created on the first call
+        """
+        value = self.values.get(label_values)
+        if value is None:
+            if len(label_values) != len(self.label_names):
+                raise MetricsException("Metric {0} has the labels {1}, but {2} were given.".format(
+                    self.name, self.label_names, label_values))
+            self.values_mutex.acquire()
+            try:
+                value = self.values.get(label_values)
+                if value is None:
+                    value = self.create_value()
+                    self.values[label_values] = value
+            finally:
+                self.values_mutex.release()
+        return value
+
+    def get_values(self):
+        self.values_mutex.acquire()
+        try:
+            return sorted(self.values.items(), key=lambda v: [str(l) for l in v[0]])
+        finally:
+            self.values_mutex.release()
+
+    def render_samples(self):
+        """
+        :return: a list of lines of the exposition format
+        """
+        return ["{0}{1} {2}".format(self.name, format_labels(self.label_names, label_values),
+                                    format_number(value.get())) for label_values, value in self.get_values()]
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def create_value(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def create_value(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_DURATION_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def create_value(self):
+        return HistogramValue(self.buckets)
+
+    def render_samples(self):
+        lines = []
+        for label_values, value in self.get_values():
+            cumulative_counts, observed_sum, count = value.get()
+            for upper_bound, cumulative_count in zip(self.buckets + (float('inf'),), cumulative_counts):
+                lines.append("{0}_bucket{1} {2}".format(
+                    self.name, format_labels(self.label_names, label_values, ('le', format_number(upper_bound))),
+                    cumulative_count))
+            labels = format_labels(self.label_names, label_values)
+            lines.append("{0}_sum{1} {2}".format(self.name, labels, format_number(observed_sum)))
+            lines.append("{0}_count{1} {2}".format(self.name, labels, count))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of the process and renders them in the Prometheus text exposition format. Recording
+    a value only updates it in memory; the text is built when the metrics are exported.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.mutex = Lock()
+
+    def register(self, metric):
+        """
+        :return: the metric of the same name that was registered before, or else the given one
+        """
+        self.mutex.acquire()
+        try:
+            registered_metric = self.metrics.get(metric.name)
+            if registered_metric is None:
+                self.metrics[metric.name] = metric
+                return metric
+        finally:
+            self.mutex.release()
+        if type(registered_metric) is not type(metric) or registered_metric.label_names != metric.label_names:
+            raise MetricsException("Metric {0} is already registered with another type or labels.".format(
+                metric.name))
+        return registered_metric
+
+    def counter(self, name, description, label_names=()):
+        return self.register(Counter(name, description, label_names))
+
+    def gauge(self, name, description, label_names=()):
+        return self.register(Gauge(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_DURATION_BUCKETS):
+        return self.register(Histogram(name, description, label_names, buckets=buckets))
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        self.mutex.acquire()
+        try:
+            metrics = [self.metrics[name] for name in sorted(self.metrics.keys())]
+        finally:
+            self.mutex.release()
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {0} {1}".format(metric.name, metric.description.replace('\\', '\\\\')
+                                                 .replace('\n', '\\n')))
+            lines.append("# TYPE {0} {1}".format(metric.name, metric.type_name))
+            lines += metric.render_samples()
+        return "\n".join(lines) + "\n"
+
+
+METRICS_REGISTRY = MetricsRegistry()
+
+
+def get_metrics_registry():
+    return METRICS_REGISTRY
+
+
+def write_metrics_file(file_full_path):
+    """
+    Writes the metrics into the file at once, so that a reader never sees half of them
+    :return: None
+    """
+    temporary_file_full_path = "{0}.tmp".format(file_full_path)
+    with open(temporary_file_full_path, 'w') as metrics_file:
+        metrics_file.write(get_metrics_registry().render())
+    os.replace(temporary_file_full_path, file_full_path)
+
+
+class MetricsFileWriter:
+    """
+    Rewrites the metrics file periodically on a daemon thread, e.g. for the textfile collector of the
+    node exporter
+    """
+
+    def __init__(self, file_full_path, interval):
+        self.file_full_path = file_full_path
+        self.interval = interval
+        self.stop_event = Event()
+        self.t = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.t.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            write_metrics_file(self.file_full_path)
+        except OSError as e:
+            logger('metrics').error("Writing metrics into {0} failed: {1}.", self.file_full_path, e)
+
+    def stop(self):
+        """
+        Stops the thread and writes the file once more, with the final values
+        :return: None
+        """
+        self.stop_event.set()
+        self.t.join()
+        self.write()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = get_metrics_registry().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_TEXT_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger('metrics/http').debug("{0} {1}", self.address_string(), format % args)
+
+
+class MetricsHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+METRICS_FILE_WRITER = None
+METRICS_HTTP_SERVER = None
+
+
+def start_metrics_exporters():
+    """
+    Starts the exporters that are configured: a file that is rewritten every metrics_file_interval seconds
+    if metrics_file_path is set, and an HTTP endpoint at /metrics if metrics_http_port is set
+    :return: None
+    """
+    global METRICS_FILE_WRITER, METRICS_HTTP_SERVER
+    if EXECUTION_CONFIGS.metrics_file_path is not None and METRICS_FILE_WRITER is None:
+        METRICS_FILE_WRITER = MetricsFileWriter(EXECUTION_CONFIGS.metrics_file_path,
+                                                EXECUTION_CONFIGS.metrics_file_interval)
+        METRICS_FILE_WRITER.start()
+        logger('metrics').info("Writing metrics into {0} every {1} seconds.", EXECUTION_CONFIGS.metrics_file_path,
+                               EXECUTION_CONFIGS.metrics_file_interval)
+    if EXECUTION_CONFIGS.metrics_http_port is not None and METRICS_HTTP_SERVER is None:
+        METRICS_HTTP_SERVER = MetricsHTTPServer((EXECUTION_CONFIGS.metrics_http_host,
+                                                 EXECUTION_CONFIGS.metrics_http_port), MetricsRequestHandler)
+        Thread(target=METRICS_HTTP_SERVER.serve_forever, daemon=True).start()
+        logger('metrics').info("Serving metrics at http://{0}:{1}/metrics.", *METRICS_HTTP_SERVER.server_address)
+
+
+def stop_metrics_exporters():
+    """
+    Writes the final values into the metrics file and stops serving them
+    :return: None
+    """
+    global METRICS_FILE_WRITER, METRICS_HTTP_SERVER
+    if METRICS_FILE_WRITER is not None:
+        METRICS_FILE_WRITER.stop()
+        METRICS_FILE_WRITER = None
+    if METRICS_HTTP_SERVER is not None:
+        METRICS_HTTP_SERVER.shutdown()
+        METRICS_HTTP_SERVER.server_close()
+        METRICS_HTTP_SERVER = None
@@ -13,5 +13,8 @@ CREATE TABLE network_data (moment timestamptz PRIMARY KEY, network_hash DOUBLE P
 CREATE TABLE blocks (id INTEGER PRIMARY KEY, moment timestamptz NOT NULL, pool_id INTEGER NOT NULL, CONSTRAINT fk_pool_id FOREIGN KEY(pool_id) REFERENCES pools(id));
 CREATE INDEX blocks_range_query_index on blocks (pool_id, moment, moment desc);
 CREATE TABLE key_values (owner character(100), key character(500), value TEXT, CONSTRAINT owner_key_unique UNIQUE(owner, key));
+CREATE TABLE ingest_ledger (path TEXT PRIMARY KEY, size BIGINT NOT NULL, mtime DOUBLE PRECISION NOT NULL, content_hash character(64), rows_inserted BIGINT, rows_skipped BIGINT, rows_rejected BIGINT, load_seconds DOUBLE PRECISION, byte_offset BIGINT, prefix_hash character(64), loaded_at timestamptz NOT NULL DEFAULT now());
 \c smart_miner_simulation_data
 CREATE TABLE key_values (owner character(100), key character(500), value TEXT, CONSTRAINT owner_key_unique UNIQUE(owner, key));
+CREATE TABLE ingest_ledger (path TEXT PRIMARY KEY, size BIGINT NOT NULL, mtime DOUBLE PRECISION NOT NULL, content_hash character(64), rows_inserted BIGINT, rows_skipped BIGINT, rows_rejected BIGINT, load_seconds DOUBLE PRECISION, byte_offset BIGINT, prefix_hash character(64), loaded_at timestamptz NOT NULL DEFAULT now());
+CREATE TABLE simulation_proofs (identifier character varying(200) PRIMARY KEY, table_name character varying(250) NOT NULL, execution_identifier character varying(200), begin_moment timestamptz, end_moment timestamptz, proven_at timestamptz NOT NULL DEFAULT now(), summary jsonb);